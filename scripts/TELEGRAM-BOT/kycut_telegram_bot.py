@@ -15,9 +15,12 @@ import threading
 from datetime import datetime, timedelta
 from typing import Dict, Optional, Any, List, Union, Tuple
 import re
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 import sys
 import atexit
+import base64
+import secrets
+import socket
 try:
     import fcntl
 except Exception:
@@ -25,16 +28,49 @@ except Exception:
     fcntl = None
 import signal
 import time
+import bisect
+import functools
+import itertools
+import heapq
+import traceback
+import contextvars
+import contextlib
+import random
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import importlib.util
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+def _lazy_import(name: str):
+    """Module object whose real import happens on first attribute access."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
 
 # Third-party imports
 try:
-    import requests
-    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+    # requests is only needed once website calls start; it is loaded during warm-up
+    requests = _lazy_import('requests')
+    from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
     from telegram.ext import (
-        Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-        ContextTypes, filters
+        Application, BaseUpdateProcessor, CommandHandler, MessageHandler, CallbackQueryHandler,
+        ContextTypes, TypeHandler, Updater, filters
     )
     from telegram.constants import ParseMode
+    from telegram.error import BadRequest, ChatMigrated, Forbidden, RetryAfter
+    from telegram.helpers import escape_markdown
 except ImportError as e:
     print(f"Missing required packages. Please install with:")
     print("pip install python-telegram-bot requests python-dotenv")
@@ -59,14 +95,67 @@ try:
 except Exception:
     ADMIN_ID = 0
 DB_PATH = os.getenv("BOT_LOCAL_DB", "kycut_bot.db")
+# Bot API endpoint, e.g. a local Bot API server or a fake one for benchmarks (default: api.telegram.org)
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL")
 
-# ---- UTF-8 safe console logger (Windows cp1252 friendly) ----
-log_stream = sys.stdout
-try:
-    if hasattr(log_stream, "buffer"):
-        log_stream = io.TextIOWrapper(log_stream.buffer, encoding="utf-8", errors="replace")
-except Exception:
-    log_stream = sys.stdout
+
+def _env_number(name: str, default: Union[int, float], cast=int) -> Union[int, float]:
+    """Read a numeric setting from the environment, falling back to default on bad input."""
+    try:
+        return cast(os.getenv(name) or default)
+    except Exception:
+        return default
+
+
+# Max number of updates handled at once; updates from the same user are still serialised
+CONCURRENT_UPDATES = max(1, _env_number("BOT_CONCURRENT_UPDATES", 32))
+# Outbound Telegram limits: ~30 msg/s per bot, ~1 msg/s per chat (small bursts allowed)
+SEND_GLOBAL_RATE = _env_number("BOT_SEND_GLOBAL_RATE", 30.0, float)
+SEND_CHAT_RATE = _env_number("BOT_SEND_CHAT_RATE", 1.0, float)
+SEND_CHAT_BURST = _env_number("BOT_SEND_CHAT_BURST", 3.0, float)
+SEND_MAX_RETRIES = _env_number("BOT_SEND_MAX_RETRIES", 3)
+# Admin order digests: the first ADMIN_IMMEDIATE_THRESHOLD confirmations within a window
+# are sent one by one; beyond that they are merged into a digest sent every
+# ADMIN_DIGEST_SECONDS or once ADMIN_DIGEST_MAX orders queue up
+ADMIN_DIGEST_SECONDS = _env_number("BOT_ADMIN_DIGEST_SECONDS", 30.0, float)
+ADMIN_DIGEST_MAX = _env_number("BOT_ADMIN_DIGEST_MAX", 25)
+ADMIN_IMMEDIATE_THRESHOLD = _env_number("BOT_ADMIN_IMMEDIATE_THRESHOLD", 3)
+# Repeated errors (same type and raising frame) are reported once per window plus a summary
+ERROR_WINDOW_SECONDS = _env_number("BOT_ERROR_WINDOW_SECONDS", 300.0, float)
+# Local intake for order-notification batches from the website (0 disables the listener)
+NOTIFY_HOST = os.getenv("BOT_NOTIFY_HOST", "127.0.0.1")
+NOTIFY_PORT = _env_number("BOT_NOTIFY_PORT", 0)
+# How long fetched orders may be reused for paging and filter views without a refetch
+ORDERS_CACHE_SECONDS = _env_number("BOT_ORDERS_CACHE_SECONDS", 30.0, float)
+# On SIGTERM/SIGINT: time allowed for in-flight handlers and queued sends before they are dropped
+SHUTDOWN_TIMEOUT = _env_number("BOT_SHUTDOWN_TIMEOUT", 8.0, float)
+# Discard updates that queued up at Telegram while the bot was down; by default they are handled
+DROP_PENDING_UPDATES = os.getenv("BOT_DROP_PENDING_UPDATES", "0").strip().lower() in ("1", "true", "yes")
+# Worker processes; above 1, one ingress process polls and routes each user's updates to one worker
+BOT_WORKERS = max(1, _env_number("BOT_WORKERS", 1))
+# Active/standby: instances sharing BOT_LOCAL_DB compete for a polling lease of this many seconds
+BOT_STANDBY = os.getenv("BOT_STANDBY", "0").strip().lower() in ("1", "true", "yes")
+LEASE_SECONDS = max(1.0, _env_number("BOT_LEASE_SECONDS", 5.0, float))
+# Prometheus text endpoint (GET /metrics); 0 disables it. Shard worker i listens on port + i.
+METRICS_HOST = os.getenv("BOT_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = _env_number("BOT_METRICS_PORT", 0)
+# Tracing (off by default): keep this fraction of update traces, plus every trace slower than
+# BOT_TRACE_SLOW_MS (0 = off). Kept traces go to a rotating JSONL file next to the debug log.
+TRACE_SAMPLE = min(1.0, max(0.0, _env_number("BOT_TRACE_SAMPLE", 0.0, float)))
+TRACE_SLOW_MS = max(0.0, _env_number("BOT_TRACE_SLOW_MS", 0.0, float))
+TRACE_FILE = os.getenv("BOT_TRACE_FILE") or os.path.join(os.getcwd(), 'logs', 'telegram_bot.trace.log')
+TRACE_MAX_BYTES = _env_number("BOT_TRACE_MAX_BYTES", 10 * 1024 * 1024)
+TRACE_BACKUPS = _env_number("BOT_TRACE_BACKUPS", 5)
+# /profile (admin only): stack sampling interval and the longest run allowed
+PROFILE_INTERVAL_MS = max(1.0, _env_number("BOT_PROFILE_INTERVAL_MS", 10.0, float))
+PROFILE_MAX_SECONDS = max(1.0, _env_number("BOT_PROFILE_MAX_SECONDS", 300.0, float))
+# Event-loop watchdog: capture the stack of anything that blocks the loop this long (0 = off)
+LOOP_BLOCK_MS = max(0.0, _env_number("BOT_LOOP_BLOCK_MS", 100.0, float))
+# Structured debug events: the fraction written to the debug log, capped at this many per second.
+# All of them are kept in a ring of the last BOT_LOG_RING_SIZE, written to the crash log on errors.
+DEBUG_LOG_SAMPLE = min(1.0, max(0.0, _env_number("BOT_DEBUG_LOG_SAMPLE", 0.1, float)))
+DEBUG_LOG_RATE = max(0.0, _env_number("BOT_DEBUG_LOG_RATE", 20.0, float))
+LOG_RING_SIZE = max(0, _env_number("BOT_LOG_RING_SIZE", 2000))
 
 class ColorFormatter(logging.Formatter):
     COLORS = {
@@ -87,34 +176,111 @@ class ColorFormatter(logging.Formatter):
             color = '\x1b[32m'  # green
         return f"{color}{msg}{self.RESET}"
 
-handler = logging.StreamHandler(log_stream)
-handler.setFormatter(ColorFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
-
-root = logging.getLogger()
-root.handlers.clear()
-root.setLevel(logging.INFO)
-root.addHandler(handler)
 
 # Add a JSONL debug log so we can tail structured events (requests/responses/errors)
 debug_logger = logging.getLogger('telegram.debug')
 debug_logger.setLevel(logging.DEBUG)
-debug_file = os.path.join(os.getcwd(), 'logs', 'telegram_bot.debug.log')
-try:
-    os.makedirs(os.path.dirname(debug_file), exist_ok=True)
-    df_handler = logging.FileHandler(debug_file, encoding='utf-8')
-    df_handler.setLevel(logging.DEBUG)
-    df_handler.setFormatter(logging.Formatter('%(asctime)s\t%(levelname)s\t%(message)s'))
-    debug_logger.addHandler(df_handler)
-except Exception:
-    pass
+# Finished traces, one JSON span per line in the same layout as the debug log (see Tracer)
+trace_logger = logging.getLogger('telegram.trace')
+trace_logger.setLevel(logging.INFO)
+trace_logger.propagate = False
 
 logger = logging.getLogger(__name__)
-# --------------------------------------------------------------
 
-# Fail fast if bot token is not provided via env or .env
-if not (os.getenv("BOT_TOKEN") or os.getenv("TELEGRAM_BOT_TOKEN")):
-    print("Error: TELEGRAM BOT TOKEN is not set. Please set BOT_TOKEN or TELEGRAM_BOT_TOKEN in the environment or .env file.")
-    sys.exit(1)
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread when that is safe.
+
+    Records without args or exception info carry either a plain string or a
+    message object the caller gave up (see EventLog), so they are queued as is
+    and rendered off the event loop. Other records are prepared as usual.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not record.args and record.exc_info is None and record.stack_info is None:
+            return record
+        return super().prepare(record)
+
+
+_log_listener: Optional[QueueListener] = None
+
+
+def _stop_log_listener() -> None:
+    """Flush queued records; registered after logging's own exit hook, so it runs first."""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+atexit.register(_stop_log_listener)
+
+
+def setup_logging(file_suffix: str = '') -> None:
+    """Console, debug-file, trace and crash logging; called from main() rather than at import.
+
+    Loggers only put records on a queue; one listener thread formats them and
+    does all the writing. `file_suffix` keeps each shard worker on its own
+    trace and crash files.
+    """
+    global _log_listener
+    # ---- UTF-8 safe console logger (Windows cp1252 friendly) ----
+    log_stream = sys.stdout
+    try:
+        if hasattr(log_stream, "buffer"):
+            log_stream = io.TextIOWrapper(log_stream.buffer, encoding="utf-8", errors="replace")
+    except Exception:
+        log_stream = sys.stdout
+
+    handler = logging.StreamHandler(log_stream)
+    handler.setFormatter(ColorFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    handler.addFilter(lambda record: record.name not in ('telegram.debug', 'telegram.trace'))
+    handlers: List[logging.Handler] = [handler]
+
+    debug_file = os.path.join(os.getcwd(), 'logs', 'telegram_bot.debug.log')
+    try:
+        os.makedirs(os.path.dirname(debug_file), exist_ok=True)
+        df_handler = logging.FileHandler(debug_file, encoding='utf-8')
+        df_handler.setLevel(logging.DEBUG)
+        df_handler.setFormatter(logging.Formatter('%(asctime)s\t%(levelname)s\t%(message)s'))
+        df_handler.addFilter(logging.Filter('telegram.debug'))
+        handlers.append(df_handler)
+        base, ext = os.path.splitext(debug_file.replace('.debug', '.crash'))
+        handlers.append(RingDumpHandler(EVENTS, base + file_suffix + ext))
+    except Exception:
+        pass
+
+    trace_error = None
+    if TRACE_SAMPLE > 0 or TRACE_SLOW_MS > 0:
+        from logging.handlers import RotatingFileHandler
+        base, ext = os.path.splitext(TRACE_FILE)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(TRACE_FILE)), exist_ok=True)
+            tr_handler = RotatingFileHandler(base + file_suffix + ext, maxBytes=TRACE_MAX_BYTES,
+                                             backupCount=TRACE_BACKUPS, encoding='utf-8')
+            tr_handler.setFormatter(logging.Formatter('%(asctime)s\t%(levelname)s\t%(message)s'))
+            tr_handler.addFilter(logging.Filter('telegram.trace'))
+            handlers.append(tr_handler)
+        except Exception as e:
+            trace_error = e
+
+    _stop_log_listener()
+    log_queue = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+    # Debug events and spans only go to their own files
+    for own in (debug_logger, trace_logger):
+        own.handlers.clear()
+        own.addHandler(queue_handler)
+        own.propagate = False
+    _log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    if trace_error is not None:
+        logger.error("Could not open trace log %s: %s", TRACE_FILE, trace_error)
+# --------------------------------------------------------------
 
 API_ENDPOINTS = {
     'bot_ping': '/api/bot/ping',
@@ -134,6 +300,370 @@ API_ENDPOINTS = {
 
 user_sessions: Dict[int, Dict[str, Any]] = {}
 
+# (message key, generation) of the callback render running in the current task, if any
+_callback_render: contextvars.ContextVar = contextvars.ContextVar('callback_render', default=None)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Bucketed observations for one label combination.
+
+    observe() is a bisect plus two increments (well under 1µs). Counts are
+    kept per bucket and made cumulative only when rendered. There is no lock:
+    an observation racing with one from a worker thread may rarely be lost,
+    which is acceptable for monitoring.
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate of the q-quantile, interpolating within a bucket like Prometheus' histogram_quantile."""
+        total = self.count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    @classmethod
+    def merge(cls, histograms) -> 'Histogram':
+        """One histogram summing several with the same buckets (e.g. every child of a family)."""
+        merged = cls()
+        for h in histograms:
+            merged.counts = [a + b for a, b in zip(merged.counts, h.counts)]
+            merged.sum += h.sum
+        return merged
+
+
+class RateMeter:
+    """Events per second over the last `window` seconds, counted in one-second slots."""
+
+    __slots__ = ('window', 'slots', 'total', 'started')
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self.slots: deque = deque()          # [second, count]
+        self.total = 0
+        self.started = time.monotonic()
+
+    def mark(self, n: int = 1) -> None:
+        self.total += n
+        second = int(time.monotonic())
+        slots = self.slots
+        if slots and slots[-1][0] == second:
+            slots[-1][1] += n
+        else:
+            slots.append([second, n])
+            if len(slots) > self.window:
+                slots.popleft()
+
+    def rate(self) -> float:
+        now = time.monotonic()
+        span = min(float(self.window), max(1.0, now - self.started))
+        return sum(n for second, n in self.slots if second >= now - span) / span
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class MetricFamily:
+    """A named metric and its children, one per tuple of label values."""
+
+    def __init__(self, name: str, help_text: str, kind: str, labelnames: Tuple[str, ...], factory=None, collect=None):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = labelnames
+        self.factory = factory
+        # For gauges read at scrape time: collect() -> iterable of (label values, value)
+        self.collect = collect
+        self.children: Dict[tuple, Any] = {}
+
+    def labels(self, *values: Any) -> Any:
+        """Child for these label values; resolve it once and keep it on hot paths."""
+        child = self.children.get(values)
+        if child is None:
+            child = self.children.setdefault(values, self.factory())
+        return child
+
+    def _label_str(self, values: tuple, extra: str = '') -> str:
+        pairs = [f'{n}="{_escape_label(v)}"' for n, v in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self, out: List[str]) -> None:
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        if self.collect is not None:
+            try:
+                samples = list(self.collect())
+            except Exception as e:
+                logger.debug("Metric %s could not be collected: %s", self.name, e)
+                samples = []
+            for values, value in samples:
+                out.append(f"{self.name}{self._label_str(tuple(values))} {value}")
+            return
+        for values, child in list(self.children.items()):
+            if self.kind == 'histogram':
+                cumulative = 0
+                for bound, count in zip(child.bounds, child.counts):
+                    cumulative += count
+                    le = self._label_str(values, 'le="%g"' % bound)
+                    out.append(f"{self.name}_bucket{le} {cumulative}")
+                cumulative += child.counts[-1]
+                le = self._label_str(values, 'le="+Inf"')
+                out.append(f"{self.name}_bucket{le} {cumulative}")
+                out.append(f"{self.name}_sum{self._label_str(values)} {child.sum}")
+                out.append(f"{self.name}_count{self._label_str(values)} {cumulative}")
+            else:
+                out.append(f"{self.name}{self._label_str(values)} {child.value}")
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """In-process metrics, rendered in the Prometheus text format (version 0.0.4)."""
+
+    def __init__(self):
+        self.families: Dict[str, MetricFamily] = {}
+
+    def _add(self, family: MetricFamily) -> MetricFamily:
+        return self.families.setdefault(family.name, family)
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> MetricFamily:
+        return self._add(MetricFamily(name, help_text, 'histogram', labelnames, lambda: Histogram(buckets)))
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> MetricFamily:
+        return self._add(MetricFamily(name, help_text, 'counter', labelnames, Counter))
+
+    def collector(self, name: str, help_text: str, labelnames: Tuple[str, ...], collect,
+                  kind: str = 'gauge') -> MetricFamily:
+        """Metric read from existing state at scrape time; replaces an earlier one of the same name."""
+        family = MetricFamily(name, help_text, kind, labelnames, collect=collect)
+        self.families[name] = family
+        return family
+
+    def render(self) -> str:
+        out: List[str] = []
+        for family in list(self.families.values()):
+            family.render(out)
+        return '\n'.join(out) + '\n'
+
+
+METRICS = MetricsRegistry()
+HANDLER_SECONDS = METRICS.histogram(
+    'kycut_handler_duration_seconds', 'Time spent in a command or message handler', ('handler',))
+HANDLER_ERRORS = METRICS.counter(
+    'kycut_handler_errors_total', 'Handler calls that raised', ('handler',))
+CALLBACK_SECONDS = METRICS.histogram(
+    'kycut_callback_duration_seconds', 'Time spent handling an inline button, by action', ('action',))
+API_SECONDS = METRICS.histogram(
+    'kycut_api_request_duration_seconds', 'Website API calls by API_ENDPOINTS key and HTTP status', ('endpoint', 'status'))
+SEND_SECONDS = METRICS.histogram(
+    'kycut_outbound_send_duration_seconds', 'Telegram send/edit call latency', ('result',))
+SEND_WAIT_SECONDS = METRICS.histogram(
+    'kycut_outbound_queue_wait_seconds', 'Time a message waited in the outbound queue')
+SQLITE_SECONDS = METRICS.histogram(
+    'kycut_sqlite_duration_seconds', 'Local SQLite operations', ('op',))
+LOOP_LAG_SECONDS = METRICS.histogram(
+    'kycut_event_loop_lag_seconds', 'How late a periodic event-loop timer fired')
+LOOP_BLOCKED_TOTAL = METRICS.counter(
+    'kycut_event_loop_blocked_total', 'Times the event loop was blocked past BOT_LOOP_BLOCK_MS, by handler', ('handler',))
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'start', 'end', 'attrs')
+
+    def __init__(self, trace: 'Trace', parent_id: Optional[int], name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        trace.last_id += 1
+        self.span_id = trace.last_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        trace.spans.append(self)
+        trace.open += 1
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self.end is not None:
+            return
+        self.end = time.perf_counter()
+        if error is not None:
+            self.attrs['error'] = type(error).__name__
+        trace = self.trace
+        trace.open -= 1
+        if trace.open == 0:
+            trace.tracer.flush(trace)
+
+
+class Trace:
+    __slots__ = ('tracer', '_trace_id', 'sampled', 'spans', 'open', 'last_id', 'wall_start', 'perf_start')
+
+    def __init__(self, tracer: 'Tracer', sampled: bool):
+        self.tracer = tracer
+        self._trace_id: Optional[str] = None
+        self.sampled = sampled
+        self.spans: List[Span] = []
+        self.open = 0
+        self.last_id = 0
+        self.wall_start = time.time()
+        self.perf_start = time.perf_counter()
+
+    @property
+    def trace_id(self) -> str:
+        # Made on first use: most slow-only traces are dropped without ever logging one
+        if self._trace_id is None:
+            self._trace_id = secrets.token_hex(8)
+        return self._trace_id
+
+
+# Span the current task is inside, if its update is being traced
+_current_span: contextvars.ContextVar = contextvars.ContextVar('trace_span', default=None)
+
+
+class Tracer:
+    """Per-update traces: a root span per update with child spans for the work it causes.
+
+    Spans are buffered on their trace. A trace is complete once every span has
+    finished, including queued outbound sends, which can outlive the handler.
+    It is then written if it was sampled (probability `sample_rate`, decided
+    when it starts) or took at least `slow_ms`. Each span becomes one
+    `{"event": "span", ...}` JSON line on the `telegram.trace` logger.
+    """
+
+    def __init__(self, sample_rate: float = TRACE_SAMPLE, slow_ms: float = TRACE_SLOW_MS, sink: logging.Logger = trace_logger):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.sink = sink
+        self.enabled = sample_rate > 0 or slow_ms > 0
+        self.written = 0
+
+    def start_trace(self, name: str, **attrs: Any) -> Optional[Span]:
+        """Root span for a new trace, made current; None when this update isn't traced."""
+        if not self.enabled:
+            return None
+        sampled = self.sample_rate >= 1.0 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        if not sampled and not self.slow_ms:
+            return None
+        root = Span(Trace(self, sampled), None, name, attrs)
+        _current_span.set(root)
+        return root
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attrs: Any) -> Optional[Span]:
+        """Child of `parent` (default: the current span) without making it current."""
+        parent = parent or _current_span.get()
+        if parent is None:
+            return None
+        return Span(parent.trace, parent.span_id, name, attrs)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs: Any):
+        """Child span of the current one for the duration of the block."""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(parent.trace, parent.span_id, name, attrs)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish(error)
+
+    @staticmethod
+    def current_trace_id() -> Optional[str]:
+        span = _current_span.get()
+        return span.trace.trace_id if span is not None else None
+
+    def flush(self, trace: Trace) -> None:
+        end = max(span.end for span in trace.spans)
+        duration_ms = (end - trace.perf_start) * 1000
+        if not trace.sampled and duration_ms < self.slow_ms:
+            return
+        self.written += 1
+        for span in trace.spans:
+            record = {
+                'event': 'span',
+                'trace_id': trace.trace_id,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'name': span.name,
+                'start': round(trace.wall_start + (span.start - trace.perf_start), 6),
+                'duration_ms': round((span.end - span.start) * 1000, 3),
+            }
+            if span.parent_id is None:
+                record['trace_ms'] = round(duration_ms, 3)
+                record['sampled'] = trace.sampled
+            if span.attrs:
+                record['attrs'] = span.attrs
+            try:
+                self.sink.info(_JsonMessage(record))
+            except Exception:
+                pass
+
+
+TRACER = Tracer()
+
+
+def sqlite_timed(op: str):
+    """Decorator for (synchronous) storage methods: kycut_sqlite_duration_seconds plus a trace span."""
+    child = SQLITE_SECONDS.labels(op)
+    name = 'sqlite.' + op
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            span = TRACER.start_span(name) if _current_span.get() is not None else None
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+                if span is not None:
+                    span.finish()
+        return wrapper
+    return decorate
+
 
 class SessionStore:
     """Local persistence: prefers SQLite, falls back to JSON."""
@@ -142,6 +672,8 @@ class SessionStore:
         self.json_path = json_path
         self.lock = threading.Lock()
         self.use_sqlite = False
+        # command_usage is created off the startup path (init_analytics) or on first use
+        self.analytics_ready = False
         try:
             self.conn = sqlite3.connect(self.sqlite_path, check_same_thread=False)
             with self.conn:
@@ -168,15 +700,6 @@ class SessionStore:
                             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                         )
                     """)
-                self.conn.execute("""
-                    CREATE TABLE IF NOT EXISTS command_usage (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        telegram_user_id INTEGER,
-                        command TEXT,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        success INTEGER DEFAULT 1
-                    )
-                """)
             self.use_sqlite = True
             logger.info("Enhanced database initialized successfully")
         except Exception as e:
@@ -188,6 +711,7 @@ class SessionStore:
                 with open(self.json_path, "w", encoding="utf-8") as f:
                     json.dump({}, f)
 
+    @sqlite_timed("session_load_all")
     def load_all(self) -> Dict[int, Dict[str, Any]]:
         if self.use_sqlite:
             with self.lock, self.conn:
@@ -207,6 +731,7 @@ class SessionStore:
             except Exception:
                 return {}
 
+    @sqlite_timed("session_set")
     def set(self, telegram_user_id: int, data: Dict[str, Any]) -> None:
         if self.use_sqlite:
             with self.lock, self.conn:
@@ -253,6 +778,7 @@ class SessionStore:
                 with open(self.json_path, "w", encoding="utf-8") as f:
                     json.dump(store, f)
 
+    @sqlite_timed("session_set_link")
     def set_link(self, telegram_user_id: int, website_user_id: Optional[str]) -> None:
         """Store mapping from telegram user to website user id."""
         if self.use_sqlite:
@@ -276,6 +802,7 @@ class SessionStore:
             except Exception:
                 pass
 
+    @sqlite_timed("session_get_link")
     def get_link(self, telegram_user_id: int) -> Optional[str]:
         """Return website_user_id if present for a telegram user."""
         if self.use_sqlite:
@@ -297,10 +824,20 @@ class SessionStore:
                 return None
             return None
 
+    @sqlite_timed("session_get")
     def get(self, telegram_user_id: int) -> Optional[Dict[str, Any]]:
         all_data = self.load_all()
         return all_data.get(int(telegram_user_id))
 
+    @sqlite_timed("session_count")
+    def count(self) -> int:
+        """Sessions persisted on disk."""
+        if self.use_sqlite:
+            with self.lock:
+                return self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return len(self.load_all())
+
+    @sqlite_timed("session_delete")
     def delete(self, telegram_user_id: int) -> None:
         if self.use_sqlite:
             with self.lock, self.conn:
@@ -312,12 +849,30 @@ class SessionStore:
                 with open(self.json_path, "w", encoding="utf-8") as f:
                     json.dump(store, f)
 
+    def init_analytics(self) -> None:
+        """Create the analytics table; not needed to serve the first update."""
+        if not self.use_sqlite or self.analytics_ready:
+            return
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS command_usage (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    telegram_user_id INTEGER,
+                    command TEXT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    success INTEGER DEFAULT 1
+                )
+            """)
+        self.analytics_ready = True
+
+    @sqlite_timed("log_command")
     def log_command(self, telegram_user_id: int, command: str, success: bool = True):
         """Log command usage for analytics"""
         if not self.use_sqlite or not self.conn:
             return
         
         try:
+            self.init_analytics()
             with self.lock, self.conn:
                 self.conn.execute(
                     "INSERT INTO command_usage (telegram_user_id, command, success) VALUES (?, ?, ?)",
@@ -327,8 +882,2096 @@ class SessionStore:
             logger.error(f"Failed to log command usage: {e}")
 
 
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry, with hit counters."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Any, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        return self._data.pop(key, default)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {'entries': len(self._data), 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': (self.hits / lookups) if lookups else 0.0}
+
+
+class UserOrders:
+    """A user's orders as last fetched, with aggregates and a status index kept up to date.
+
+    Totals and the status -> order keys index are built once when a payload is
+    ingested and then adjusted on each status change, so the orders, stats and
+    filter views read them without scanning every order.
+    """
+
+    COMPLETED_STATUSES = ('delivered', 'completed')
+    # Orders without a status are kept apart: they count as neither pending nor completed
+    UNKNOWN_STATUS = 'unknown'
+
+    def __init__(self, orders: List[Dict], digest: bytes, version: int):
+        self.orders = orders
+        self.digest = digest
+        self.version = version
+        self.fetched_at = time.monotonic()
+        self.by_key: Dict[str, Dict] = {}
+        # id or order number -> key in by_key
+        self.aliases: Dict[str, str] = {}
+        # status -> {order key: None}, an insertion-ordered set
+        self.by_status: Dict[str, Dict[str, None]] = {}
+        self.total_spent = 0.0
+        self._search_index: Optional['OrderSearchIndex'] = None
+        # Bumped by set_status, so an index built off the event loop can tell it raced a change
+        self.changes = 0
+        for position, order in enumerate(orders):
+            self.total_spent += self.amount(order)
+            key = self.key_of(order, position)
+            self.by_key[key] = order
+            for alias in (order.get('id'), order.get('order_number')):
+                if alias is not None:
+                    self.aliases.setdefault(str(alias), key)
+            self.by_status.setdefault(self.status_of(order), {})[key] = None
+
+    @staticmethod
+    def key_of(order: Dict, position: int) -> str:
+        key = order.get('order_number') or order.get('id')
+        return str(key) if key is not None else f'#{position}'
+
+    @classmethod
+    def status_of(cls, order: Dict) -> str:
+        return (order.get('status') or cls.UNKNOWN_STATUS).lower()
+
+    @staticmethod
+    def amount(order: Dict) -> float:
+        return float(order.get('total_amount', 0) or 0)
+
+    @property
+    def total_orders(self) -> int:
+        return len(self.orders)
+
+    @property
+    def pending_count(self) -> int:
+        return self.count('pending')
+
+    @property
+    def completed_count(self) -> int:
+        return sum(self.count(s) for s in self.COMPLETED_STATUSES)
+
+    def count(self, status: str) -> int:
+        return len(self.by_status.get(status, ()))
+
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+    def get(self, order_key: str) -> Optional[Dict]:
+        key = self.aliases.get(str(order_key))
+        return self.by_key.get(key) if key is not None else None
+
+    def with_status(self, status: str, start: int = 0, stop: Optional[int] = None) -> List[Dict]:
+        """Orders with ``status`` in fetch order, sliced without touching other statuses."""
+        keys = self.by_status.get(status, {})
+        return [self.by_key[k] for k in itertools.islice(keys, start, stop)]
+
+    @property
+    def search_index(self) -> 'OrderSearchIndex':
+        """Inverted index over these orders, built on first use."""
+        if self._search_index is None:
+            self._search_index = OrderSearchIndex(self)
+        return self._search_index
+
+    async def build_search_index(self) -> 'OrderSearchIndex':
+        """The search index, built on a worker thread the first time (it takes ~0.5 s at 50k orders)."""
+        loop = asyncio.get_running_loop()
+        while self._search_index is None:
+            changes = self.changes
+            index = await loop.run_in_executor(None, OrderSearchIndex, self)
+            # A status change while building isn't in the index; build again from the new state
+            if self._search_index is None and self.changes == changes:
+                self._search_index = index
+        return self._search_index
+
+    def search_index_delta(self, previous: 'UserOrders') -> Optional[Tuple['OrderSearchIndex', List[str], List[str]]]:
+        """(index, changed keys, appended keys) to carry `previous`'s index over, or None if it can't be.
+
+        Only reads both books, so it can run on a worker thread.
+        """
+        index = previous._search_index
+        if index is None:
+            return None
+        keys = list(self.by_key)
+        if keys[:len(index.keys)] != index.keys:
+            return None
+        changed = [key for key in index.keys if previous.by_key[key] != self.by_key[key]]
+        return index, changed, keys[len(index.keys):]
+
+    def adopt_search_index(self, previous: 'UserOrders', delta=None) -> bool:
+        """Take over the index of the book this one replaces, updated for what changed.
+
+        Works when the orders kept their keys and order, with any new orders
+        appended (a refetch after a status change or a new purchase). Otherwise
+        the index is left to be built afresh on the next search. `delta` is
+        search_index_delta(previous) if it was already worked out.
+        """
+        if delta is None:
+            delta = self.search_index_delta(previous)
+        if delta is None or delta[0] is not previous._search_index:
+            return False
+        index, changed, added = delta
+        for key in changed:
+            index.reindex(key, index.order_tokens(previous.by_key[key]), index.order_tokens(self.by_key[key]))
+        for key in added:
+            index.add(key, self.by_key[key])
+        previous._search_index = None
+        self._search_index = index
+        return True
+
+    def set_status(self, order_key: str, status: str) -> bool:
+        """Apply a status change to one order; False if the order isn't known."""
+        key = self.aliases.get(str(order_key))
+        if key is None:
+            return False
+        order = self.by_key[key]
+        index = self._search_index
+        before = index.order_tokens(order) if index is not None else None
+        old, new = self.status_of(order), status.lower()
+        self.changes += 1
+        if old != new:
+            bucket = self.by_status[old]
+            del bucket[key]
+            if not bucket:
+                del self.by_status[old]
+            self.by_status.setdefault(new, {})[key] = None
+        order['status'] = status
+        if index is not None:
+            index.reindex(key, before, index.order_tokens(order))
+        return True
+
+
+class OrderSearchIndex:
+    """Inverted index (token -> order keys) over one user's orders.
+
+    Indexes ids, order numbers, product names and statuses. Each query term matches
+    indexed tokens by prefix and terms are ANDed. Orders matching every term
+    exactly come first (so ``ORD-1001`` finds that order ahead of ORD-10010..),
+    then the prefix matches, each in fetch order.
+    """
+
+    _TOKEN = re.compile(r'[a-z0-9]+')
+
+    def __init__(self, book: UserOrders):
+        # Postings hold positions (fetch order) rather than keys, so ranking is a plain int sort
+        self.keys: List[str] = list(book.by_key)
+        self.position: Dict[str, int] = {key: i for i, key in enumerate(self.keys)}
+        self.postings: Dict[str, set] = {}
+        for position, order in enumerate(book.by_key.values()):
+            for token in self.order_tokens(order):
+                self.postings.setdefault(token, set()).add(position)
+        # Sorted vocabulary for prefix lookups
+        self.tokens = sorted(self.postings)
+
+    @classmethod
+    def tokenize(cls, text: Any) -> List[str]:
+        return cls._TOKEN.findall(str(text).lower())
+
+    @classmethod
+    def order_tokens(cls, order: Dict) -> set:
+        fields = [order.get('id'), order.get('order_number'), UserOrders.status_of(order)]
+        fields += [item.get('product_name') or item.get('name') for item in order.get('items') or []]
+        tokens = set()
+        for field in fields:
+            if field:
+                tokens.update(cls.tokenize(field))
+        return tokens
+
+    def _matching(self, term: str) -> set:
+        """Positions of orders with a token starting with ``term`` (not to be mutated)."""
+        i = bisect.bisect_left(self.tokens, term)
+        if i < len(self.tokens) and self.tokens[i] == term and (
+                i + 1 == len(self.tokens) or not self.tokens[i + 1].startswith(term)):
+            return self.postings[term]
+        matches = set()
+        while i < len(self.tokens) and self.tokens[i].startswith(term):
+            matches |= self.postings[self.tokens[i]]
+            i += 1
+        return matches
+
+    def search(self, text: str, limit: int = 10) -> Tuple[List[str], int]:
+        """Keys of the first ``limit`` matching orders and the total number of matches."""
+        # Longer terms tend to be more selective, so intersect from those
+        terms = sorted(set(self.tokenize(text)), key=len, reverse=True)
+        result = None
+        for term in terms:
+            matches = self._matching(term)
+            result = matches if result is None else result & matches
+            if not result:
+                return [], 0
+        if not result:
+            return [], 0
+        exact = result
+        for term in terms:
+            exact = exact & self.postings.get(term, set())
+            if not exact:
+                break
+        ranked = heapq.nsmallest(limit, exact)
+        if len(ranked) < limit and len(exact) < len(result):
+            ranked += heapq.nsmallest(limit - len(ranked), result - exact)
+        return [self.keys[i] for i in ranked], len(result)
+
+    def add(self, key: str, order: Dict) -> None:
+        """Index an order appended after the existing ones."""
+        position = len(self.keys)
+        self.keys.append(key)
+        self.position[key] = position
+        for token in self.order_tokens(order):
+            if token not in self.postings:
+                self.postings[token] = set()
+                bisect.insort(self.tokens, token)
+            self.postings[token].add(position)
+
+    def reindex(self, key: str, before: set, after: set) -> None:
+        """Move one order's postings from its old tokens to its new ones."""
+        position = self.position[key]
+        for token in before - after:
+            matches = self.postings.get(token)
+            if matches is not None:
+                matches.discard(position)
+                if not matches:
+                    del self.postings[token]
+                    del self.tokens[bisect.bisect_left(self.tokens, token)]
+        for token in after - before:
+            if token not in self.postings:
+                self.postings[token] = set()
+                bisect.insort(self.tokens, token)
+            self.postings[token].add(position)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently while keeping each user's updates in order.
+
+    Updates are keyed by user (or chat when there is no user). Updates for the same
+    key run one after another in arrival order; different keys run in parallel, up
+    to ``max_concurrent_updates`` at a time.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        # BaseUpdateProcessor.process_update holds its own semaphore around do_process_update,
+        # which would let a user's backlog sit on global slots. Leave that one unbounded and
+        # apply the limit in do_process_update, after the per-user lock.
+        super().__init__(sys.maxsize)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._key_locks: Dict[int, asyncio.Lock] = {}
+        self._queue_depth: Dict[int, int] = {}
+        self.max_queue_depth = 0
+        self.in_flight = 0
+        self.processed = 0
+        self.rate = RateMeter()
+        # Tasks running or waiting in do_process_update, for draining on shutdown
+        self._tasks: set = set()
+        # Optional update -> None hook, called in arrival order before the update is queued
+        self.on_arrival = None
+        # Optional update -> awaitable bool check, started in arrival order and awaited
+        # under the user's lock; the update is dropped unless it resolves True
+        self.admit = None
+        self.refused = 0
+
+    @staticmethod
+    def _update_key(update: object) -> Optional[int]:
+        user = getattr(update, "effective_user", None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, "effective_chat", None)
+        return chat.id if chat is not None else None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if self.on_arrival is not None:
+            self.on_arrival(update)
+        admitted = self.admit(update) if self.admit is not None else None
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        root = TRACER.start_trace('update', update_id=getattr(update, 'update_id', None),
+                                  user_id=self._update_key(update))
+        error = None
+        try:
+            await self._process_in_order(update, coroutine, admitted)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._tasks.discard(task)
+            if root is not None:
+                root.finish(error)
+
+    async def _process_in_order(self, update: object, coroutine, admitted=None) -> None:
+        # Take the per-user lock *before* the global slots, so a user with a
+        # backlog waits in their own queue instead of holding global slots.
+        key = self._update_key(update)
+        if key is None:
+            if await self._admitted(admitted, coroutine):
+                async with self._slots:
+                    await self._run(coroutine)
+            return
+
+        lock = self._key_locks.get(key)
+        if lock is None:
+            lock = self._key_locks[key] = asyncio.Lock()
+        depth = self._queue_depth.get(key, 0) + 1
+        self._queue_depth[key] = depth
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        try:
+            async with lock:
+                if await self._admitted(admitted, coroutine):
+                    async with self._slots:
+                        await self._run(coroutine)
+        finally:
+            depth = self._queue_depth[key] - 1
+            if depth:
+                self._queue_depth[key] = depth
+            else:
+                # Drop idle users so the maps only hold users with pending work
+                del self._queue_depth[key]
+                self._key_locks.pop(key, None)
+
+    async def _admitted(self, admitted, coroutine) -> bool:
+        if admitted is None or await admitted:
+            return True
+        self.refused += 1
+        coroutine.close()
+        return False
+
+    async def _run(self, coroutine) -> None:
+        root = _current_span.get()
+        if root is not None:
+            # Time spent behind this user's earlier updates and the global limit
+            root.attrs['queued_ms'] = round((time.perf_counter() - root.start) * 1000, 3)
+        self.in_flight += 1
+        try:
+            await coroutine
+        finally:
+            self.in_flight -= 1
+            self.processed += 1
+            self.rate.mark()
+
+    def active_tasks(self) -> set:
+        """Tasks handling (or queued to handle) an update right now."""
+        return {t for t in self._tasks if not t.done()}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self, top: int = 5) -> Dict[str, Any]:
+        """Snapshot of queue metrics: per-user depth for the busiest users."""
+        busiest = sorted(self._queue_depth.items(), key=lambda kv: kv[1], reverse=True)[:top]
+        return {
+            'max_concurrent_updates': self.limit,
+            'in_flight': self.in_flight,
+            'processed': self.processed,
+            'queued_users': len(self._queue_depth),
+            'queued_updates': sum(self._queue_depth.values()),
+            'max_queue_depth': self.max_queue_depth,
+            'busiest_users': busiest,
+        }
+
+
+# Outbound priority classes (lower goes first)
+SEND_PRIORITY_INTERACTIVE = 0
+SEND_PRIORITY_ADMIN = 1
+SEND_PRIORITY_BULK = 2
+SEND_PRIORITY_NAMES = {
+    SEND_PRIORITY_INTERACTIVE: 'interactive',
+    SEND_PRIORITY_ADMIN: 'admin',
+    SEND_PRIORITY_BULK: 'bulk',
+}
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Seconds until one token is available (0 if one is available now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class _JsonMessage:
+    """Log message rendered as JSON only when a handler formats it."""
+    __slots__ = ('fields', 'event')
+
+    def __init__(self, fields: Dict[str, Any], event: Optional[str] = None):
+        self.fields = fields
+        self.event = event
+
+    def __str__(self) -> str:
+        if self.event is None:
+            return json.dumps(self.fields, default=str)
+        return json.dumps({'event': self.event, **self.fields}, default=str)
+
+
+class EventLog:
+    """Structured debug events, cheap enough for hot paths.
+
+    Every event is appended to an in-memory ring of the last `ring_size`. Only a
+    `sample` fraction of them, at most `rate` per second, is sent to the debug
+    log. Events passed with `always=True` skip the sampling. The JSON is
+    rendered on the logging listener thread. When an error is logged,
+    RingDumpHandler writes the ring events not written before to the crash
+    log, so the detail leading up to a failure is kept without paying for it
+    in steady state.
+    """
+
+    def __init__(self, sample: float = DEBUG_LOG_SAMPLE, rate: float = DEBUG_LOG_RATE,
+                 ring_size: int = LOG_RING_SIZE, sink: logging.Logger = debug_logger):
+        self.sample = sample
+        self.bucket = TokenBucket(rate, rate) if rate > 0 else None
+        self.ring: deque = deque(maxlen=ring_size)
+        self.sink = sink
+        self.written = 0
+        self.skipped = 0
+        # deque.append and next() on a count are atomic, so logging threads need no lock
+        self._seq = itertools.count(1)
+        self._dumped_seq = 0
+
+    def log(self, event: str, always: bool = False, **fields: Any) -> None:
+        if self.ring.maxlen:
+            self.ring.append((next(self._seq), time.time(), event, fields))
+        if always or self._admit():
+            self.written += 1
+            self.sink.debug(_JsonMessage(fields, event))
+        else:
+            self.skipped += 1
+
+    def _admit(self) -> bool:
+        if self.sample < 1.0 and (self.sample <= 0 or random.random() >= self.sample):
+            return False
+        if self.bucket is not None:
+            if self.bucket.delay(time.monotonic()) > 0:
+                return False
+            self.bucket.take()
+        return True
+
+    def dump(self, path: str, reason: str) -> int:
+        """Append the ring events not dumped before to `path`; returns how many were written."""
+        for _ in range(10):
+            try:
+                snapshot = list(self.ring)
+                break
+            except RuntimeError:
+                # Appended to while copying
+                continue
+        else:
+            return 0
+        entries = [entry for entry in snapshot if entry[0] > self._dumped_seq]
+        if not entries:
+            return 0
+        self._dumped_seq = entries[-1][0]
+
+        def stamp(ts: float) -> str:
+            return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts)) + f',{int(ts % 1 * 1000):03d}'
+
+        lines = [f"{stamp(time.time())}\tERROR\t{json.dumps({'event': 'ring_dump', 'reason': reason, 'events': len(entries)})}\n"]
+        lines.extend(f"{stamp(ts)}\tDEBUG\t{_JsonMessage(fields, event)}\n" for _, ts, event, fields in entries)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+        return len(entries)
+
+
+class RingDumpHandler(logging.Handler):
+    """On ERROR records, writes the EventLog ring to the crash log (at most every `min_interval` seconds)."""
+
+    def __init__(self, events: EventLog, path: str, min_interval: float = 10.0):
+        super().__init__(logging.ERROR)
+        self.events = events
+        self.path = path
+        self.min_interval = min_interval
+        self._next = 0.0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        now = time.monotonic()
+        if now < self._next:
+            return
+        self._next = now + self.min_interval
+        try:
+            self.events.dump(self.path, record.getMessage().splitlines()[0][:300])
+        except Exception:
+            self.handleError(record)
+
+
+EVENTS = EventLog()
+
+
+class _SendJob:
+    __slots__ = ('priority', 'seq', 'chat_id', 'factory', 'future', 'attempts', 'enqueued', 'span')
+
+    def __init__(self, priority, seq, chat_id, factory, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.factory = factory
+        self.future = future
+        self.attempts = 0
+        self.enqueued = time.monotonic()
+        # Keeps the submitting update's trace open until the send settles
+        self.span = TRACER.start_span('telegram.send', chat_id=chat_id, priority=SEND_PRIORITY_NAMES.get(priority, priority))
+
+    def __lt__(self, other: '_SendJob') -> bool:
+        # Per-chat heap order: best priority first, then submission order
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler:
+    """Central queue for everything the bot sends to Telegram.
+
+    Callers `submit()` a zero-argument coroutine factory and get a future back
+    without waiting for delivery. A single dispatcher task releases jobs while
+    honouring a global and a per-chat token bucket. The next chat to send is the
+    one whose next job has the best priority. Within one chat, jobs are sent one
+    at a time, by priority and then in submission order, so an interactive reply
+    doesn't wait behind bulk notifications to the same chat. On RetryAfter all sending pauses for
+    the requested time and the job is retried. A job whose future the caller
+    cancelled before it was sent is dropped.
+    """
+
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST, max_retries: int = SEND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._chat_queues: Dict[Any, List[_SendJob]] = {}    # heaps of _SendJob
+        self._ready: List[Tuple[int, int, Any]] = []       # (priority, seq, chat_id)
+        self._delayed: List[Tuple[float, Any]] = []        # (ready_at, chat_id)
+        self._scheduled: set = set()                        # chats in _ready or _delayed
+        self._busy: set = set()                             # chats with a send in flight
+        self._paused_until = 0.0
+        self._seq = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sending: set = set()                          # _send tasks in flight
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.queued_by_priority = {p: 0 for p in SEND_PRIORITY_NAMES}
+        self.max_wait = 0.0
+
+    def submit(self, chat_id: Any, factory, priority: int = SEND_PRIORITY_INTERACTIVE) -> asyncio.Future:
+        """Queue `factory()` for sending to `chat_id`; returns a future with its result."""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._dispatch(), name='OutboundScheduler')
+        future = loop.create_future()
+        # Callers usually don't await delivery; mark failures as retrieved (they are logged here)
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._seq += 1
+        job = _SendJob(priority, self._seq, chat_id, factory, future)
+        heapq.heappush(self._chat_queues.setdefault(chat_id, []), job)
+        self.queued_by_priority[priority] = self.queued_by_priority.get(priority, 0) + 1
+        self._arm(chat_id)
+        self._wakeup.set()
+        return future
+
+    def pending(self) -> int:
+        return sum(len(q) for q in self._chat_queues.values()) + len(self._busy)
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued job has been sent. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def close(self) -> None:
+        """Stop dispatching; sends in flight are cancelled and queued jobs dropped."""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for task in list(self._sending):
+            task.cancel()
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+        for queue in self._chat_queues.values():
+            for job in queue:
+                self.queued_by_priority[job.priority] -= 1
+                job.future.cancel()
+                if job.span is not None:
+                    job.span.finish(asyncio.CancelledError())
+        self._chat_queues.clear()
+        self._ready.clear()
+        self._delayed.clear()
+        self._scheduled.clear()
+
+    def _arm(self, chat_id: Any) -> None:
+        """Make a chat eligible for dispatch if it has work and nothing in flight."""
+        if chat_id in self._busy or chat_id in self._scheduled:
+            return
+        queue = self._chat_queues.get(chat_id)
+        if not queue:
+            self._chat_queues.pop(chat_id, None)
+            return
+        head = queue[0]
+        heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        self._scheduled.add(chat_id)
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 4096:
+                # Forget idle chats whose bucket has fully refilled
+                now = time.monotonic()
+                for cid, b in list(self._chat_buckets.items()):
+                    if cid not in self._chat_queues and b.delay(now) == 0 and b.tokens >= b.capacity:
+                        del self._chat_buckets[cid]
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _sleep(self, timeout: Optional[float]) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, chat_id = heapq.heappop(self._delayed)
+                self._scheduled.discard(chat_id)
+                self._arm(chat_id)
+            if self._paused_until > now:
+                await self._sleep(self._paused_until - now)
+                continue
+            if not self._ready:
+                await self._sleep(self._delayed[0][0] - now if self._delayed else None)
+                continue
+            wait = self.global_bucket.delay(now)
+            if wait > 0:
+                await self._sleep(wait)
+                continue
+            _, _, chat_id = heapq.heappop(self._ready)
+            if self._chat_queues[chat_id][0].future.cancelled():
+                self._drop_cancelled(chat_id)
+                continue
+            wait = self._chat_bucket(chat_id).delay(now)
+            if wait > 0:
+                heapq.heappush(self._delayed, (now + wait, chat_id))
+                continue
+            self._scheduled.discard(chat_id)
+            self.global_bucket.take()
+            self._chat_buckets[chat_id].take()
+            job = heapq.heappop(self._chat_queues[chat_id])
+            self._busy.add(chat_id)
+            task = asyncio.get_running_loop().create_task(self._send(job))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    def _drop_cancelled(self, chat_id: Any) -> None:
+        """Drop jobs at the head of a chat's queue whose caller cancelled them, then re-arm the chat."""
+        queue = self._chat_queues[chat_id]
+        while queue and queue[0].future.cancelled():
+            job = heapq.heappop(queue)
+            self.queued_by_priority[job.priority] -= 1
+            if job.span is not None:
+                job.span.finish(asyncio.CancelledError())
+        self._scheduled.discard(chat_id)
+        self._arm(chat_id)
+
+    async def _send(self, job: _SendJob) -> None:
+        job.attempts += 1
+        waited = time.monotonic() - job.enqueued
+        if waited > self.max_wait:
+            self.max_wait = waited
+        SEND_WAIT_SECONDS.labels().observe(waited)
+        if job.span is not None and job.attempts == 1:
+            job.span.attrs['queue_ms'] = round(waited * 1000, 3)
+        started = time.perf_counter()
+        result_label = 'error'
+        try:
+            result = await job.factory()
+            result_label = 'ok'
+        except RetryAfter as e:
+            result_label = 'retry_after'
+            retry_after = e.retry_after
+            retry_after = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            if job.attempts <= self.max_retries:
+                self.retried += 1
+                logger.warning("Telegram flood control: pausing sends for %.1fs (chat %s)", retry_after, job.chat_id)
+                heapq.heappush(self._chat_queues.setdefault(job.chat_id, []), job)
+            else:
+                self._finish(job, error=e)
+        except asyncio.CancelledError as e:
+            result_label = 'cancelled'
+            self.queued_by_priority[job.priority] -= 1
+            job.future.cancel()
+            if job.span is not None:
+                job.span.finish(e)
+            raise
+        except Exception as e:
+            self._finish(job, error=e)
+        else:
+            self._finish(job, result=result)
+        finally:
+            SEND_SECONDS.labels(result_label).observe(time.perf_counter() - started)
+            self._busy.discard(job.chat_id)
+            self._arm(job.chat_id)
+            if self._wakeup:
+                self._wakeup.set()
+
+    def _finish(self, job: _SendJob, result: Any = None, error: Optional[BaseException] = None) -> None:
+        self.queued_by_priority[job.priority] -= 1
+        if job.span is not None:
+            job.span.attrs['attempts'] = job.attempts
+            job.span.finish(error)
+        if job.future.done():
+            return
+        if error is None:
+            self.sent += 1
+            job.future.set_result(result)
+        else:
+            self.failed += 1
+            logger.error("Outbound send to chat %s failed: %s", job.chat_id, error)
+            job.future.set_exception(error)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending': self.pending(),
+            'pending_by_priority': {SEND_PRIORITY_NAMES.get(p, p): n for p, n in self.queued_by_priority.items()},
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'paused_for': max(0.0, self._paused_until - time.monotonic()),
+            'max_queue_wait': self.max_wait,
+        }
+
+
+class NotificationFanout:
+    """Durable fan-out of order notifications to linked Telegram users.
+
+    The website posts batches of order events (see `ingest_batch`). Each event is
+    resolved to a linked recipient through the local `telegram_users` table,
+    de-duplicated and written to the `notification_queue` table. A pump task
+    sends pending rows through `send` (normally the outbound scheduler at bulk
+    priority) and records the outcome. Rows are only marked sent after delivery,
+    so anything still pending after a restart is picked up again. A failed send
+    is retried after an exponential backoff (`next_attempt_at`).
+    """
+
+    FINAL_STATUSES = ('sent', 'failed', 'skipped')
+    RETRY_BASE = 5.0
+    RETRY_MAX = 300.0
+
+    def __init__(self, db_path: str, send, window: int = 200, max_attempts: int = 3):
+        self.db_path = db_path
+        self.send = send
+        self.window = window
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS notification_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    dedupe_key TEXT NOT NULL UNIQUE,
+                    telegram_user_id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    sent_at REAL,
+                    next_attempt_at REAL NOT NULL DEFAULT 0
+                )
+            """)
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(notification_queue)")}
+            if 'next_attempt_at' not in columns:
+                # Queue tables created before retries were delayed
+                self.conn.execute("ALTER TABLE notification_queue ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_notification_queue_status ON notification_queue (status, id)"
+            )
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+        self._claimed: set = set()       # row ids sent or in flight but not yet flushed
+        self._last_flush = time.monotonic()
+        self._results: List[Tuple[str, int, Optional[str], float, float, int]] = []
+        self._per_second: deque = deque(maxlen=60)   # [second, sent] buckets
+        self.accepted = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.skip_reasons: Dict[str, int] = {}
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    # --- ingestion (may be called from any thread) ---
+    @staticmethod
+    def dedupe_key(event: Dict[str, Any], telegram_user_id: int) -> str:
+        if event.get('event_id'):
+            return str(event['event_id'])
+        order = event.get('order_id') or event.get('order_number') or ''
+        return f"{telegram_user_id}:{order}:{event.get('event', 'status')}:{event.get('status', '')}"
+
+    @staticmethod
+    def _telegram_id(value: Any) -> Optional[int]:
+        """`value` as a Telegram user id, or None if it isn't one."""
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, int):
+            return value if value > 0 else None
+        if isinstance(value, str) and value.strip().isdigit():
+            return int(value)
+        return None
+
+    def _resolve_recipients(self, events: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Map telegram ids / website ids in `events` to linked telegram user ids."""
+        tg_ids = {str(self._telegram_id(e['telegram_user_id'])) for e in events
+                  if e.get('telegram_user_id') and self._telegram_id(e['telegram_user_id']) is not None}
+        web_ids = {str(e['website_user_id']) for e in events if e.get('website_user_id') and not e.get('telegram_user_id')}
+        resolved: Dict[str, int] = {}
+        try:
+            with self.lock:
+                for column, wanted, prefix in (('telegram_user_id', tg_ids, 'tg:'), ('website_user_id', web_ids, 'web:')):
+                    wanted = list(wanted)
+                    for i in range(0, len(wanted), 500):
+                        chunk = wanted[i:i + 500]
+                        rows = self.conn.execute(
+                            f"SELECT telegram_user_id, {column} FROM telegram_users "
+                            f"WHERE linked = 1 AND {column} IN ({','.join('?' * len(chunk))})",
+                            [int(x) for x in chunk] if column == 'telegram_user_id' else chunk,
+                        ).fetchall()
+                        for tg_id, key in rows:
+                            resolved[prefix + str(key)] = int(tg_id)
+        except sqlite3.Error as e:
+            # No telegram_users table (JSON session store): nobody can be resolved
+            logger.error("Notification recipient lookup failed: %s", e)
+        return resolved
+
+    @sqlite_timed("notification_ingest")
+    def ingest_batch(self, events: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Queue a batch of order events. Returns accepted/duplicate/skipped counts."""
+        resolved = self._resolve_recipients(events)
+        now = time.time()
+        rows = []
+        reasons: Dict[str, int] = {}
+        for event in events:
+            if event.get('telegram_user_id'):
+                tg_id = self._telegram_id(event['telegram_user_id'])
+                if tg_id is None:
+                    reasons['invalid_telegram_user_id'] = reasons.get('invalid_telegram_user_id', 0) + 1
+                    continue
+                tg_id = resolved.get(f"tg:{tg_id}")
+            elif event.get('website_user_id'):
+                tg_id = resolved.get(f"web:{event['website_user_id']}")
+            else:
+                reasons['no_recipient'] = reasons.get('no_recipient', 0) + 1
+                continue
+            if tg_id is None:
+                reasons['not_linked'] = reasons.get('not_linked', 0) + 1
+                continue
+            rows.append((self.dedupe_key(event, tg_id), tg_id, json.dumps(event, default=str), now))
+        skipped = sum(reasons.values())
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO notification_queue (dedupe_key, telegram_user_id, payload, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            accepted = self.conn.total_changes - before
+        self.accepted += accepted
+        self.duplicates += len(rows) - accepted
+        self.skipped += skipped
+        for reason, n in reasons.items():
+            self.skip_reasons[reason] = self.skip_reasons.get(reason, 0) + n
+        if accepted and self._loop and self._wakeup:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return {'received': len(events), 'accepted': accepted,
+                'duplicates': len(rows) - accepted, 'skipped': skipped, 'skip_reasons': dict(reasons)}
+
+    # --- delivery ---
+    @staticmethod
+    def format_event(event: Dict[str, Any]) -> str:
+        # Website-supplied text is escaped, or a stray _ or * fails the send with BadRequest
+        order = str(event.get('order_number') or event.get('order_id') or 'Unknown').replace('`', "'")
+        status = escape_markdown(str(event.get('status') or 'updated').upper())
+        text = f"🔔 **Order Update**\n\nOrder `{order}` is now **{status}**"
+        total = event.get('total_amount', event.get('total'))
+        if total is not None:
+            try:
+                text += f"\nTotal: ${float(total):.2f}"
+            except (TypeError, ValueError):
+                pass
+        if event.get('message'):
+            text += f"\n\n{escape_markdown(str(event['message']))}"
+        return text
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = self._loop.create_task(self._pump(), name='NotificationFanout')
+
+    async def stop(self, drain: bool = True) -> None:
+        """Stop taking rows; finish deliveries in flight, or cancel them (they stay pending) if not `drain`."""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._inflight:
+            if not drain:
+                for task in self._inflight:
+                    task.cancel()
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        await self._flush_results()
+
+    @sqlite_timed("notification_pending_rows")
+    def _pending_rows(self, after_id: int, limit: int) -> List[Tuple[int, int, str, float, int]]:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT id, telegram_user_id, payload, created_at, attempts FROM notification_queue "
+                "WHERE status = 'pending' AND next_attempt_at <= ? AND id > ? ORDER BY id LIMIT ?",
+                (time.time(), after_id, limit),
+            ).fetchall()
+
+    async def _pump(self) -> None:
+        loop = asyncio.get_running_loop()
+        window = asyncio.Semaphore(self.window)
+        last_id = 0
+        while True:
+            self._wakeup.clear()
+            rows = await loop.run_in_executor(None, self._pending_rows, last_id, self.window)
+            fresh = [row for row in rows if row[0] not in self._claimed]
+            if rows and not fresh:
+                # Only rows that are already in flight; keep scanning past them
+                last_id = rows[-1][0]
+                continue
+            if not fresh:
+                await self._flush_results()
+                # Start over from the oldest pending row; rows retried after failures live there
+                last_id = 0
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for row in fresh:
+                last_id = row[0]
+                await window.acquire()
+                self._claimed.add(row[0])
+                task = loop.create_task(self._deliver(row))
+                self._inflight.add(task)
+                task.add_done_callback(lambda t: (self._inflight.discard(t), window.release()))
+            if len(self._results) >= self.window or time.monotonic() - self._last_flush >= 1.0:
+                await self._flush_results()
+
+    async def _deliver(self, row: Tuple[int, int, str, float, int]) -> None:
+        row_id, tg_id, payload, created_at, attempts = row
+        try:
+            event = json.loads(payload)
+            await self.send(tg_id, self.format_event(event), parse_mode=ParseMode.MARKDOWN)
+        except asyncio.CancelledError:
+            # Still pending; free it for the next scan
+            self._claimed.discard(row_id)
+            raise
+        except Exception as e:
+            attempts += 1
+            # Blocked bot / bad chat won't get better; anything else is retried later
+            permanent = isinstance(e, (Forbidden, BadRequest, ChatMigrated))
+            status = 'failed' if permanent or attempts >= self.max_attempts else 'pending'
+            now = time.time()
+            if status == 'failed':
+                self.failed += 1
+                retry_at = now
+            else:
+                self.retried += 1
+                retry_at = now + self.retry_delay(attempts)
+            self._results.append((status, attempts, str(e)[:500], now, retry_at, row_id))
+            return
+        now = time.time()
+        self.sent += 1
+        self.last_lag = now - created_at
+        self.max_lag = max(self.max_lag, self.last_lag)
+        second = int(now)
+        if self._per_second and self._per_second[-1][0] == second:
+            self._per_second[-1][1] += 1
+        else:
+            self._per_second.append([second, 1])
+        self._results.append(('sent', attempts + 1, None, now, now, row_id))
+
+    async def _flush_results(self) -> None:
+        """Write delivery outcomes in one transaction (off the event loop)."""
+        self._last_flush = time.monotonic()
+        results, self._results = self._results, []
+        if not results:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self._write_results, results)
+        self._claimed.difference_update(row_id for *_, row_id in results)
+
+    def retry_delay(self, attempts: int) -> float:
+        """Seconds before retry number `attempts`: exponential with ±20% jitter, capped."""
+        return min(self.RETRY_MAX, self.RETRY_BASE * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+    def _write_results(self, results: List[Tuple[str, int, Optional[str], float, float, int]]) -> None:
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE notification_queue SET status = ?, attempts = ?, last_error = ?, "
+                "sent_at = CASE WHEN ? = 'sent' THEN ? ELSE sent_at END, next_attempt_at = ? WHERE id = ?",
+                [(status, attempts, error, status, ts, retry_at, row_id)
+                 for status, attempts, error, ts, retry_at, row_id in results],
+            )
+
+    def throughput(self, seconds: int = 10) -> float:
+        """Messages per second delivered over the last `seconds` complete seconds."""
+        now = int(time.time())
+        sent = sum(n for second, n in self._per_second if now - seconds <= second < now)
+        return sent / float(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        claimed = set(self._claimed)
+        with self.lock:
+            count = self.conn.execute(
+                "SELECT COUNT(*) FROM notification_queue WHERE status = 'pending'"
+            ).fetchone()[0]
+            # Claimed rows are in flight, not waiting; skip past them to the oldest unclaimed one
+            oldest = [created for row_id, created in self.conn.execute(
+                "SELECT id, created_at FROM notification_queue WHERE status = 'pending' ORDER BY id LIMIT ?",
+                (len(claimed) + 1,),
+            ) if row_id not in claimed]
+        return {
+            'accepted': self.accepted,
+            'duplicates': self.duplicates,
+            'skipped': self.skipped,
+            'skip_reasons': dict(self.skip_reasons),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'pending': max(0, count - len(claimed)),
+            'in_flight': len(self._inflight),
+            'oldest_pending_age': (time.time() - oldest[0]) if oldest else 0.0,
+            'throughput_per_sec': self.throughput(),
+            'last_lag': self.last_lag,
+            'max_lag': self.max_lag,
+        }
+
+
+class NotificationIngestServer:
+    """Tiny HTTP endpoint the website posts notification batches to.
+
+    POST /notifications with the `X-Webhook-Secret` header and a JSON body of
+    `{"events": [...]}` (or a bare list); GET /notifications/stats with the same
+    header. Runs in a daemon thread.
+    """
+
+    def __init__(self, fanout: NotificationFanout, host: str, port: int):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if self.path.rstrip('/') != '/notifications':
+                    return self._send(404, {'success': False, 'error': 'Not found'})
+                if not hmac.compare_digest(self.headers.get('X-Webhook-Secret', ''), WEBHOOK_SECRET):
+                    return self._send(401, {'success': False, 'error': 'Unauthorized'})
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    data = json.loads(self.rfile.read(length) or b'[]')
+                    events = data.get('events', []) if isinstance(data, dict) else data
+                    if not isinstance(events, list):
+                        raise ValueError('events must be a list')
+                except Exception as e:
+                    return self._send(400, {'success': False, 'error': f'Invalid body: {e}'})
+                summary = fanout.ingest_batch([e for e in events if isinstance(e, dict)])
+                return self._send(200, {'success': True, **summary})
+
+            def do_GET(self):
+                if self.path.rstrip('/') != '/notifications/stats':
+                    return self._send(404, {'success': False, 'error': 'Not found'})
+                if not hmac.compare_digest(self.headers.get('X-Webhook-Secret', ''), WEBHOOK_SECRET):
+                    return self._send(401, {'success': False, 'error': 'Unauthorized'})
+                return self._send(200, {'success': True, 'stats': fanout.stats()})
+
+            def log_message(self, format, *args):
+                logger.debug("notify-ingest: " + format, *args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='notify-ingest', daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        logger.info("Notification intake listening on %s:%s", *self.server.server_address[:2])
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsServer:
+    """Serves `GET /metrics` (Prometheus text format) from a daemon thread."""
+
+    def __init__(self, registry: MetricsRegistry, host: str, port: int):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0].rstrip('/') != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("metrics: " + format, *args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        logger.info("Metrics on http://%s:%s/metrics", *self.server.server_address[:2])
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class AdminDigest:
+    """Merges admin order-confirmation alerts into periodic digests.
+
+    While confirmations are rare each one is sent as soon as it arrives. Once
+    `immediate_threshold` of them arrive within `window_seconds`, further ones
+    are parked in the `admin_digest_pending` table and sent as a single digest
+    when the window closes or `max_orders` are waiting. Parked orders are only
+    removed after the digest is delivered, so they survive a restart.
+    """
+
+    def __init__(self, db_path: str, send, format_single, window_seconds: float = ADMIN_DIGEST_SECONDS,
+                 max_orders: int = ADMIN_DIGEST_MAX, immediate_threshold: int = ADMIN_IMMEDIATE_THRESHOLD,
+                 table: str = 'admin_digest_pending'):
+        self.send = send
+        # Shard workers each park in their own table so two workers never send the same digest
+        self.table = table
+        self.format_single = format_single
+        self.window_seconds = window_seconds
+        self.max_orders = max(1, max_orders)
+        self.immediate_threshold = immediate_threshold
+        self._recent: deque = deque()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_waiting = False
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    order_id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    confirmed_at REAL NOT NULL
+                )
+            """)
+
+    @staticmethod
+    def order_total(order_data: Dict[str, Any]) -> float:
+        order = order_data.get('order') if isinstance(order_data.get('order'), dict) else order_data
+        try:
+            return float(order.get('total', order.get('total_amount', 0)) or 0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def _pending(self) -> List[Tuple[str, str, float]]:
+        with self.lock:
+            return self.conn.execute(
+                f"SELECT order_id, payload, confirmed_at FROM {self.table} ORDER BY confirmed_at"
+            ).fetchall()
+
+    def start(self) -> None:
+        """Resume a digest left over from before a restart."""
+        pending = self._pending()
+        if pending:
+            logger.info("Resuming admin digest with %s parked confirmations", len(pending))
+            self._schedule_flush(pending[0][2] + self.window_seconds - time.time())
+
+    @sqlite_timed("admin_digest_park")
+    def _park(self, order_id: str, payload: str, confirmed_at: float) -> int:
+        """Store one confirmation for the digest; returns how many are parked."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (order_id, payload, confirmed_at) VALUES (?, ?, ?)",
+                (order_id, payload, confirmed_at),
+            )
+            return self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def _unpark(self, sent: List[Tuple[str, str, float]]) -> None:
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"DELETE FROM {self.table} WHERE order_id = ? AND confirmed_at = ?",
+                [(order_id, confirmed_at) for order_id, _, confirmed_at in sent],
+            )
+
+    async def add(self, order_id: str, order_data: Dict[str, Any]) -> None:
+        now = time.time()
+        while self._recent and self._recent[0] < now - self.window_seconds:
+            self._recent.popleft()
+        self._recent.append(now)
+        if len(self._recent) <= self.immediate_threshold and not self._flush_task:
+            self.send(self.format_single(order_id, order_data))
+            return
+        parked = await asyncio.get_running_loop().run_in_executor(
+            None, self._park, str(order_id), json.dumps(order_data, default=str), now)
+        if parked >= self.max_orders:
+            self._schedule_flush(0)
+        elif not self._flush_task:
+            self._schedule_flush(self.window_seconds)
+
+    def _schedule_flush(self, delay: float) -> None:
+        if self._flush_task and not self._flush_task.done():
+            if delay > 0:
+                return
+            self._flush_task.cancel()
+        self._flush_task = asyncio.get_running_loop().create_task(self._flush_after(max(0.0, delay)))
+
+    async def _flush_after(self, delay: float) -> None:
+        try:
+            if delay:
+                self._flush_waiting = True
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._flush_waiting = False
+            await self.flush()
+        finally:
+            if self._flush_task is asyncio.current_task():
+                self._flush_task = None
+
+    def format_digest(self, pending: List[Tuple[str, str, float]], max_lines: int = 30) -> str:
+        orders = []
+        for order_id, payload, confirmed_at in pending:
+            try:
+                orders.append((order_id, json.loads(payload), confirmed_at))
+            except Exception:
+                orders.append((order_id, {}, confirmed_at))
+        total = sum(self.order_total(data) for _, data, _ in orders)
+        first = datetime.fromtimestamp(orders[0][2]).strftime('%H:%M:%S')
+        last = datetime.fromtimestamp(orders[-1][2]).strftime('%H:%M:%S')
+        lines = [
+            f"🧾 **ORDER DIGEST** — {len(orders)} confirmed orders",
+            "",
+            f"**Total:** ${total:.2f}",
+            f"**Window:** {first} – {last}",
+            "",
+        ]
+        for order_id, data, _ in orders[:max_lines]:
+            customer = (data.get('customer') or {}).get('name') or 'N/A'
+            lines.append(f"• `{order_id}` ${self.order_total(data):.2f} — {customer}")
+        if len(orders) > max_lines:
+            lines.append(f"…and {len(orders) - max_lines} more")
+        lines += ["", "Please process these orders and contact the customers."]
+        return "\n".join(lines)
+
+    async def close(self) -> int:
+        """Send the parked digest now rather than at the end of the window.
+
+        Returns how many orders are still parked (kept for the next start).
+        """
+        task, self._flush_task = self._flush_task, None
+        if task is not None and not task.done():
+            if self._flush_waiting:
+                task.cancel()
+            # A flush already sending is left to finish, so the digest isn't sent twice
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+        return len(await asyncio.get_running_loop().run_in_executor(None, self._pending))
+
+    async def flush(self) -> None:
+        """Send everything parked as one digest; keep it parked if sending fails."""
+        loop = asyncio.get_running_loop()
+        pending = await loop.run_in_executor(None, self._pending)
+        if not pending:
+            return
+        try:
+            await self.send(self.format_digest(pending))
+        except Exception as e:
+            logger.error("Admin digest failed, keeping %s orders for the next one: %s", len(pending), e)
+            self._recent.clear()
+            return
+        await loop.run_in_executor(None, self._unpark, pending)
+
+
+class ErrorThrottle:
+    """Fingerprints errors and reports each distinct one once per window.
+
+    The fingerprint is the exception type plus the frame that raised it. The first
+    occurrence in a window gets a full traceback in the log and an admin alert.
+    Repeats are only counted, so their cost stays small during an error storm.
+    When the window closes, one summary lists everything that repeated.
+    """
+
+    def __init__(self, window_seconds: float = ERROR_WINDOW_SECONDS, max_fingerprints: int = 500):
+        self.window_seconds = window_seconds
+        self.max_fingerprints = max_fingerprints
+        # fingerprint -> {'count', 'first_seen', 'last_seen', 'message', 'where'}
+        self.window: Dict[Tuple[str, str, int, str], Dict[str, Any]] = {}
+        self.dropped = 0
+        self.total = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def fingerprint(err: BaseException) -> Tuple[str, str, int, str]:
+        tb = getattr(err, '__traceback__', None)
+        if tb is None:
+            return (type(err).__qualname__, '', 0, '')
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+        code = tb.tb_frame.f_code
+        return (type(err).__qualname__, os.path.basename(code.co_filename), tb.tb_lineno, code.co_name)
+
+    def record(self, err: BaseException) -> Tuple[bool, Dict[str, Any]]:
+        """Count `err`; returns (first occurrence in this window, entry)."""
+        self.total += 1
+        key = self.fingerprint(err)
+        entry = self.window.get(key)
+        now = time.time()
+        if entry is not None:
+            entry['count'] += 1
+            entry['last_seen'] = now
+            return False, entry
+        if len(self.window) >= self.max_fingerprints:
+            # Too many distinct errors to track; count them without reporting each
+            self.dropped += 1
+            return False, {'count': 1, 'message': str(err)[:200], 'where': key}
+        entry = self.window[key] = {
+            'count': 1, 'first_seen': now, 'last_seen': now,
+            'message': str(err)[:200], 'where': key,
+        }
+        return True, entry
+
+    def rollover(self) -> Optional[str]:
+        """Close the current window; returns a summary of repeated errors, if any."""
+        window, self.window = self.window, {}
+        dropped, self.dropped = self.dropped, 0
+        repeated = sorted((e for e in window.values() if e['count'] > 1), key=lambda e: e['count'], reverse=True)
+        if not repeated and not dropped:
+            return None
+        minutes = self.window_seconds / 60
+        lines = [f"🔁 Error summary (last {minutes:g} min)"]
+        for e in repeated[:15]:
+            name, filename, lineno, func = e['where']
+            lines.append(f"• {name} at {filename}:{lineno} in {func}() occurred {e['count']:,} times")
+        if len(repeated) > 15:
+            lines.append(f"…and {len(repeated) - 15} more repeating errors")
+        if dropped:
+            lines.append(f"• {dropped:,} errors beyond the {self.max_fingerprints} tracked fingerprints")
+        return "\n".join(lines)
+
+    def start(self, report) -> None:
+        """Run `report(summary)` at the end of every window that had repeats."""
+        async def loop():
+            while True:
+                await asyncio.sleep(self.window_seconds)
+                summary = self.rollover()
+                if summary:
+                    logger.warning(summary)
+                    report(summary)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(loop(), name='ErrorThrottle')
+
+    def stop(self) -> Optional[str]:
+        """Stop the window timer; returns the summary for the unfinished window, if any."""
+        if self._task and not self._task.done():
+            self._task.cancel()
+        return self.rollover()
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples Python stacks from a helper thread.
+
+    Every `interval` seconds the sampler reads sys._current_frames() and counts
+    the stack of the event-loop thread and of each worker thread whose name
+    starts with one of `thread_prefixes` (the default executor, which runs the
+    SQLite work, and the kycut-* pools). Pool threads waiting for work are
+    skipped. Nothing is installed in the profiled threads; the cost is the
+    sampler holding the GIL briefly once per interval.
+    """
+
+    POOL_WORKER_FILE = os.path.join('concurrent', 'futures', 'thread.py')
+
+    def __init__(self, loop_thread_id: int, interval: float = PROFILE_INTERVAL_MS / 1000,
+                 thread_prefixes: Tuple[str, ...] = ('asyncio', 'kycut-')):
+        self.loop_thread_id = loop_thread_id
+        self.interval = interval
+        self.thread_prefixes = thread_prefixes
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self.loop_samples = 0
+        self.loop_idle = 0
+        self.elapsed = 0.0
+        self.cpu = 0.0
+        self._labels: Dict[Any, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> 'SamplingProfiler':
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _run(self) -> None:
+        started = time.perf_counter()
+        cpu_start = time.thread_time()
+        me = threading.get_ident()
+        names: Dict[int, str] = {}
+        refresh_at = 0.0
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            if now >= refresh_at:
+                # Pool threads come and go; "kycut-http_3" is grouped as "kycut-http"
+                names = {t.ident: t.name.rstrip('0123456789').rstrip('_') for t in threading.enumerate()}
+                refresh_at = now + 1.0
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                leaf = frame.f_code
+                if ident == self.loop_thread_id:
+                    thread = 'event-loop'
+                    self.loop_samples += 1
+                    if leaf.co_name == 'select' and leaf.co_filename.endswith('selectors.py'):
+                        self.loop_idle += 1
+                else:
+                    thread = names.get(ident)
+                    if thread is None or not thread.startswith(self.thread_prefixes):
+                        continue
+                    if leaf.co_name == '_worker' and leaf.co_filename.endswith(self.POOL_WORKER_FILE):
+                        continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(thread)
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+        self.elapsed = time.perf_counter() - started
+        self.cpu = time.thread_time() - cpu_start
+
+    def collapsed(self) -> str:
+        """One "thread;outer;...;leaf count" line per distinct stack (flamegraph.pl / speedscope input)."""
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def top_functions(self, limit: int = 15) -> List[Tuple[str, int, int]]:
+        """(function, self samples, total samples) for the functions seen most often."""
+        own: Dict[str, int] = {}
+        total: Dict[str, int] = {}
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')[1:]
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for name in set(frames):
+                total[name] = total.get(name, 0) + count
+        ranked = sorted(total, key=lambda name: (own.get(name, 0), total[name]), reverse=True)
+        return [(name, own.get(name, 0), total[name]) for name in ranked[:limit]]
+
+    def summary(self, limit: int = 15) -> str:
+        samples = max(1, self.samples)
+        busy = 100.0 * (self.loop_samples - self.loop_idle) / max(1, self.loop_samples)
+        lines = [
+            f"🔬 Profile: {self.elapsed:.1f}s, {self.samples:,} samples every {self.interval * 1000:g}ms",
+            f"Event loop busy: {busy:.1f}% of {self.loop_samples:,} samples",
+            f"Sampler CPU: {self.cpu * 1000:.0f}ms ({100.0 * self.cpu / max(self.elapsed, 1e-9):.2f}%)",
+            "",
+            "  self%  total%  function",
+        ]
+        for name, own, total in self.top_functions(limit):
+            lines.append(f"{100.0 * own / samples:7.1f} {100.0 * total / samples:7.1f}  {name}")
+        return "\n".join(lines)
+
+
+class LoopWatchdog:
+    """Measures event-loop lag and captures the stack of callbacks that block the loop.
+
+    A heartbeat on the loop runs every `interval` and records how late it ran
+    (kycut_event_loop_lag_seconds). A helper thread watches the heartbeat. Once
+    it is `threshold` overdue, the loop is stuck inside a single callback, and
+    the thread takes the loop thread's stack. It also takes the handler and
+    update found on that stack (the `KYCutBot._timed` wrapper frame). When the
+    loop resumes, the stall is logged with its stack and the time the heartbeat
+    was held up, counted in kycut_event_loop_blocked_total and kept in `recent`.
+    Blocks longer than threshold + interval are always caught.
+    """
+
+    # Code objects of wrapper frames holding `handler` and `update` locals (see KYCutBot._timed)
+    handler_codes: set = set()
+
+    def __init__(self, threshold: float = LOOP_BLOCK_MS / 1000, interval: Optional[float] = None):
+        self.threshold = threshold
+        self.interval = interval or min(0.5, max(0.005, threshold / 4 if threshold else 0.5))
+        self.recent: deque = deque(maxlen=20)
+        self.blocked = 0
+        self.max_blocked_ms = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread = 0
+        self._expected = 0.0
+        self._handle = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._observe = LOOP_LAG_SECONDS.labels().observe
+
+    def start(self) -> None:
+        """Start the heartbeat on the running loop and, with a threshold, the watching thread."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._expected = time.monotonic() + self.interval
+        self._handle = self._loop.call_later(self.interval, self._beat)
+        if self.threshold:
+            self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._stop.set()
+
+    def _beat(self) -> None:
+        now = time.monotonic()
+        self._observe(max(0.0, now - self._expected))
+        self._expected = now + self.interval
+        self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self) -> None:
+        stall = None
+        while not self._stop.wait(self.interval):
+            expected = self._expected
+            if stall is not None:
+                if expected != stall['expected']:
+                    # The heartbeat ran again; it was held up until `expected - interval`
+                    self._record(stall, (expected - self.interval - stall['expected']) * 1000)
+                    stall = None
+                continue
+            if time.monotonic() - expected >= self.threshold:
+                frame = sys._current_frames().get(self._loop_thread)
+                # A late timer while the loop waits in select() isn't a blocked loop
+                if frame is not None and not frame.f_code.co_filename.endswith('selectors.py'):
+                    stall = self.capture(frame)
+                    stall['expected'] = expected
+                del frame
+
+    def capture(self, frame) -> Dict[str, Any]:
+        """Stack of the blocked loop thread plus the handler and update it was working on."""
+        handler = update = None
+        f = frame
+        while f is not None:
+            if f.f_code in self.handler_codes:
+                local = f.f_locals
+                handler, update = local.get('handler'), local.get('update')
+                break
+            f = f.f_back
+        return {
+            'handler': getattr(handler, '__name__', None) or self._outermost(frame),
+            'update_type': self.update_type(update),
+            'update_id': getattr(update, 'update_id', None),
+            'stack': traceback.format_list(traceback.extract_stack(frame)),
+        }
+
+    @staticmethod
+    def _outermost(frame) -> str:
+        """Name of the outermost bot function on the stack (for work outside handlers)."""
+        name = 'unknown'
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename == __file__ and code.co_name not in ('main', '<module>', 'run_shard'):
+                name = code.co_name
+            frame = frame.f_back
+        return name
+
+    @staticmethod
+    def update_type(update: Any) -> Optional[str]:
+        if update is None:
+            return None
+        for kind in ('message', 'edited_message', 'callback_query', 'inline_query', 'channel_post',
+                     'my_chat_member', 'chat_member', 'pre_checkout_query', 'shipping_query'):
+            if getattr(update, kind, None) is not None:
+                return kind
+        return type(update).__name__
+
+    def _record(self, stall: Dict[str, Any], blocked_ms: float) -> None:
+        stall.pop('expected', None)
+        stall['blocked_ms'] = round(max(blocked_ms, self.threshold * 1000), 1)
+        stall['at'] = time.time()
+        self.blocked += 1
+        self.max_blocked_ms = max(self.max_blocked_ms, stall['blocked_ms'])
+        self.recent.append(stall)
+        LOOP_BLOCKED_TOTAL.labels(stall['handler']).inc()
+        logger.warning("Event loop blocked for %.0fms in %s (%s update %s):\n%s",
+                       stall['blocked_ms'], stall['handler'], stall['update_type'] or 'no',
+                       stall['update_id'] or '', ''.join(stall['stack']).rstrip())
+        try:
+            EVENTS.log('loop_blocked', always=True, **stall)
+        except Exception:
+            pass
+
+
+class CallbackRouter:
+    """Maps callback data to handlers with dict lookups instead of an if/elif chain.
+
+    Three forms of callback data are understood:
+
+    * compact: ``!`` + one-char route code + base64url of the packed arguments.
+      Hex ids such as ``ord_<hex>`` are packed as raw bytes, so they take about
+      half the space, and ids with underscores survive intact.
+    * stored: ``~`` + token, for payloads that still exceed Telegram's 64-byte
+      limit. The route and arguments are kept in the ``callback_state`` table.
+      The token is a hash of the payload, so re-rendering a button reuses its
+      row. New rows are buffered and written by flush(); prune() drops rows
+      not rendered within ``STATE_TTL_SECONDS``.
+    * legacy: plain strings such as ``menu_main`` (exact match) or
+      ``confirm_<order id>`` (matched by their first ``_`` segment), so buttons
+      on messages sent before this format still work.
+    """
+
+    MAX_BYTES = 64
+    STATE_TTL_SECONDS = 30 * 24 * 3600
+    # A row rendered again after this long is rewritten, so prune() keeps it
+    STATE_REFRESH_SECONDS = 24 * 3600
+    FLUSH_SECONDS = 2.0
+    PRUNE_SECONDS = 3600.0
+    _HEX_ID = re.compile(r'([a-z]{1,15}_)?((?:[0-9a-f]{2})+)\Z')
+
+    def __init__(self, db_path: str):
+        self._routes: Dict[str, Tuple[str, Any]] = {}     # code -> (name, handler)
+        self._codes: Dict[str, str] = {}                  # name -> code
+        self._exact: Dict[str, Tuple[Any, tuple]] = {}
+        self._legacy: Dict[str, Tuple[str, Any, Any]] = {}  # first segment -> (prefix, handler, parse)
+        # token -> (code, args, when the row was last written)
+        self._state = LRUCache(5000)
+        # token -> (payload, created_at) not written yet; see flush()
+        self._unsaved: Dict[str, Tuple[str, float]] = {}
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS callback_state (
+                    token TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+        self.prune()
+
+    # -- registration -------------------------------------------------------
+
+    def route(self, name: str, code: str, handler) -> None:
+        """Register a route that buttons reach through ``encode(name, *args)``."""
+        if len(code) != 1 or code in self._routes:
+            raise ValueError(f"Bad or duplicate route code {code!r}")
+        self._routes[code] = (name, handler)
+        self._codes[name] = code
+
+    def exact(self, data: str, handler, *args) -> None:
+        self._exact[data] = (handler, args)
+
+    def legacy(self, prefix: str, handler, parse=lambda rest: (rest,)) -> None:
+        """Old ``<prefix><rest>`` callback data, dispatched as ``handler(query, *parse(rest))``."""
+        self._legacy[prefix.split('_', 1)[0]] = (prefix, handler, parse)
+
+    # -- encoding -----------------------------------------------------------
+
+    @staticmethod
+    def _varint(out: bytearray, n: int) -> None:
+        while True:
+            byte = n & 0x7F
+            n >>= 7
+            if n:
+                out.append(byte | 0x80)
+            else:
+                out.append(byte)
+                return
+
+    @staticmethod
+    def _read_varint(buf: bytes, i: int) -> Tuple[int, int]:
+        n = shift = 0
+        while True:
+            byte = buf[i]
+            i += 1
+            n |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return n, i
+            shift += 7
+
+    @classmethod
+    def pack(cls, args: tuple) -> bytes:
+        """Args to bytes: tag 0 = int, 1 = [prefix_]hex id, 2 = utf-8 string."""
+        out = bytearray()
+        for arg in args:
+            if isinstance(arg, int) and not isinstance(arg, bool) and arg >= 0:
+                out.append(0)
+                cls._varint(out, arg)
+                continue
+            text = str(arg)
+            match = cls._HEX_ID.match(text)
+            if match:
+                prefix, raw = (match.group(1) or '').encode(), bytes.fromhex(match.group(2))
+                out.append(1)
+                out.append(len(prefix))
+                out += prefix
+            else:
+                raw = text.encode()
+                out.append(2)
+            cls._varint(out, len(raw))
+            out += raw
+        return bytes(out)
+
+    @classmethod
+    def unpack(cls, buf: bytes) -> tuple:
+        args = []
+        i = 0
+        while i < len(buf):
+            tag = buf[i]
+            i += 1
+            if tag == 0:
+                value, i = cls._read_varint(buf, i)
+                args.append(value)
+                continue
+            prefix = ''
+            if tag == 1:
+                plen = buf[i]
+                prefix = buf[i + 1:i + 1 + plen].decode()
+                i += 1 + plen
+            size, i = cls._read_varint(buf, i)
+            raw = buf[i:i + size]
+            i += size
+            args.append(prefix + raw.hex() if tag == 1 else raw.decode())
+        return tuple(args)
+
+    def encode(self, name: str, *args) -> str:
+        """Callback data for route ``name``; goes through the state table if too long."""
+        code = self._codes[name]
+        data = '!' + code + base64.urlsafe_b64encode(self.pack(args)).decode().rstrip('=')
+        if len(data.encode()) <= self.MAX_BYTES:
+            return data
+        payload = json.dumps([code, list(args)])
+        token = base64.urlsafe_b64encode(hashlib.sha256(payload.encode()).digest()[:9]).decode()
+        now = time.time()
+        state = self._state.get(token)
+        if state is None or now - state[2] > self.STATE_REFRESH_SECONDS:
+            with self.lock:
+                self._unsaved[token] = (payload, now)
+            self._state.put(token, (code, tuple(args), now))
+        return '~' + token
+
+    @sqlite_timed("callback_state_load")
+    def _load_state(self, token: str) -> Optional[Tuple[str, tuple]]:
+        state = self._state.get(token)
+        if state is None:
+            with self.lock:
+                row = self._unsaved.get(token)
+                if row is None:
+                    row = self.conn.execute("SELECT payload, created_at FROM callback_state WHERE token = ?",
+                                            (token,)).fetchone()
+            if row is None:
+                return None
+            code, args = json.loads(row[0])
+            state = (code, tuple(args), row[1])
+            self._state.put(token, state)
+        return state[0], state[1]
+
+    @sqlite_timed("callback_state_flush")
+    def flush(self) -> int:
+        """Write the tokens encode() handed out since the last flush; returns how many."""
+        with self.lock:
+            rows, self._unsaved = self._unsaved, {}
+            if not rows:
+                return 0
+            try:
+                with self.conn:
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO callback_state (token, payload, created_at) VALUES (?, ?, ?)",
+                        [(token, payload, created_at) for token, (payload, created_at) in rows.items()],
+                    )
+            except sqlite3.Error:
+                # Keep them for the next flush
+                self._unsaved = {**rows, **self._unsaved}
+                raise
+        return len(rows)
+
+    @sqlite_timed("callback_state_prune")
+    def prune(self) -> int:
+        """Delete rows not written for ``STATE_TTL_SECONDS``; returns how many."""
+        with self.lock, self.conn:
+            cur = self.conn.execute("DELETE FROM callback_state WHERE created_at < ?",
+                                    (time.time() - self.STATE_TTL_SECONDS,))
+        return cur.rowcount
+
+    # -- dispatch -----------------------------------------------------------
+
+    def resolve(self, data: str) -> Optional[Tuple[Any, tuple]]:
+        """(handler, args) for callback data, or None if nothing handles it."""
+        if not data:
+            return None
+        head = data[0]
+        if head == '!':
+            route = self._routes.get(data[1:2])
+            if route is None:
+                return None
+            try:
+                encoded = data[2:]
+                args = self.unpack(base64.b64decode(encoded + '=' * (-len(encoded) % 4), altchars=b'-_', validate=True))
+            except (ValueError, IndexError, UnicodeDecodeError):
+                return None
+            return route[1], args
+        if head == '~':
+            state = self._load_state(data[1:])
+            if state is None or state[0] not in self._routes:
+                return None
+            return self._routes[state[0]][1], state[1]
+        exact = self._exact.get(data)
+        if exact is not None:
+            return exact
+        legacy = self._legacy.get(data.split('_', 1)[0])
+        if legacy is not None and data.startswith(legacy[0]):
+            try:
+                return legacy[1], legacy[2](data[len(legacy[0]):])
+            except (ValueError, IndexError):
+                return None
+        return None
+
+
+class LeaderLease:
+    """Renewable lease in SQLite that decides which of several bot instances polls.
+
+    The holder renews the `bot_lease` row every `ttl / 3` seconds; once it
+    expires any other instance may take it over. The row also records the
+    last update id the holder handled. A new leader skips updates at or below
+    it (Telegram redelivers the last batch that wasn't confirmed), and a former
+    leader that lost the lease has every further update refused (see admit).
+
+    admit() writes the row for every update. Callers on the event loop use
+    admit_async(), which runs it on the lease's own thread, one update at a
+    time in the order they were submitted.
+    """
+
+    # Telegram picks a random next update_id after a week without updates
+    FENCE_MAX_AGE = 7 * 24 * 3600
+
+    def __init__(self, db_path: str, ttl: float = LEASE_SECONDS, name: str = 'poller'):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+        self.held = False
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        # admit() writes once per update; losing the last write only matters if the OS crashes
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='kycut-lease')
+        with self.lock:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS bot_lease (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_update_id INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL DEFAULT 0
+                )
+            """)
+
+    def try_acquire(self) -> bool:
+        """Take the lease if it is free or expired, or renew it if held. Returns whether held."""
+        now = time.time()
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO bot_lease (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE bot_lease.holder = excluded.holder OR bot_lease.expires_at < ?",
+                (self.name, self.holder, now + self.ttl, now),
+            )
+        self.held = cur.rowcount == 1
+        return self.held
+
+    def current_holder(self) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT holder FROM bot_lease WHERE name = ?", (self.name,)).fetchone()
+        return row[0] if row else None
+
+    @sqlite_timed("lease_admit")
+    def admit(self, update_id: int) -> bool:
+        """Record `update_id` as handled; False if it was already handled or the lease was lost."""
+        now = time.time()
+        with self.lock:
+            cur = self.conn.execute(
+                "UPDATE bot_lease SET last_update_id = ?, updated_at = ? "
+                "WHERE name = ? AND holder = ? AND (last_update_id < ? OR updated_at < ?)",
+                (update_id, now, self.name, self.holder, update_id, now - self.FENCE_MAX_AGE),
+            )
+        return cur.rowcount == 1
+
+    def admit_async(self, update_id: int) -> 'asyncio.Future[bool]':
+        """admit() off the event loop; call in arrival order, the writes keep that order."""
+        return asyncio.wrap_future(self.writer.submit(self.admit, update_id))
+
+    def release(self) -> None:
+        """Expire the lease now so a standby can take over without waiting for the TTL."""
+        with self.lock:
+            self.conn.execute("UPDATE bot_lease SET expires_at = 0 WHERE name = ? AND holder = ?",
+                              (self.name, self.holder))
+        self.held = False
+
+    def wait(self, on_idle=None) -> None:
+        """Block until the lease is ours, calling `on_idle()` between attempts."""
+        if self.try_acquire():
+            return
+        logger.info("Standing by: %s holds the polling lease", self.current_holder())
+        while not self.try_acquire():
+            if on_idle:
+                on_idle()
+            time.sleep(min(1.0, self.ttl / 5))
+        logger.info("Acquired the polling lease (%s)", self.holder)
+
+
+def acquire_instance_lock(lockfile: str):
+    """Take the single-instance PID file lock or exit; returns the open lock file."""
+    handle = None
+    # Atomic file lock to prevent double instance.
+    # Use fcntl on Unix-like systems when available, otherwise use an
+    # atomic create (O_CREAT|O_EXCL) based approach which works on Windows.
+    try:
+        if fcntl:
+            handle = open(lockfile, 'a+')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.error('Another bot instance is already running (atomic file lock)')
+                raise SystemExit(1)
+            # Write our PID for visibility
+            handle.seek(0)
+            handle.truncate()
+            handle.write(str(os.getpid()) + '\n')
+            handle.flush()
+        else:
+            # Cross-platform fallback: attempt to atomically create the pid file.
+            flags = os.O_CREAT | os.O_EXCL | os.O_RDWR
+            try:
+                fd = os.open(lockfile, flags)
+                handle = os.fdopen(fd, 'w+')
+                handle.write(str(os.getpid()) + '\n')
+                handle.flush()
+            except FileExistsError:
+                # Existing lockfile: try to read PID and check if process is alive.
+                try:
+                    with open(lockfile, 'r') as f:
+                        lines = f.read().strip().splitlines()
+                        existing_pid = int(lines[0]) if lines else None
+                except Exception:
+                    existing_pid = None
+
+                if existing_pid:
+                    # Attempt to detect whether the PID is still running.
+                    try:
+                        # os.kill with signal 0 checks for process existence on both Unix and Windows
+                        os.kill(existing_pid, 0)
+                        logger.error('Another bot instance is already running (pid %s)', existing_pid)
+                        raise SystemExit(1)
+                    except OSError:
+                        # Process not running — stale lockfile. Remove and retry create.
+                        try:
+                            os.remove(lockfile)
+                            fd = os.open(lockfile, flags)
+                            handle = os.fdopen(fd, 'w+')
+                            handle.write(str(os.getpid()) + '\n')
+                            handle.flush()
+                        except Exception as e:
+                            logger.error('Failed to acquire lock after removing stale lockfile: %s', e)
+                            raise SystemExit(1)
+                else:
+                    logger.error('Lockfile exists and PID could not be determined; aborting')
+                    raise SystemExit(1)
+    except Exception as e:
+        logger.error(f'Failed to acquire atomic lock: {e}')
+        raise SystemExit(1)
+    # (Auto-terminate logic is now redundant with atomic lock, but left as fallback if needed)
+    # remove PID file at exit
+    try:
+        atexit.register(lambda: os.path.exists(lockfile) and os.remove(lockfile))
+    except Exception:
+        pass
+    return handle
+
+
 class KYCutBot:
-    def __init__(self):
+    def __init__(self, shard: Optional[Tuple[int, int]] = None):
+        # (index, count) when this is one of the worker processes started by ShardIngress
+        self.shard = shard
+        self.started_at = time.monotonic()
         # initialize local DB path for legacy store compatibility
         self.sqlite_path = DB_PATH
         # Initialize storage first
@@ -337,94 +2980,92 @@ class KYCutBot:
         # Initialize in-memory sessions from persistent store
         try:
             persisted = self.store.load_all()
+            if shard is not None:
+                # A worker only ever sees its own users' updates
+                persisted = {uid: data for uid, data in persisted.items() if uid % shard[1] == shard[0]}
             user_sessions.clear()
             user_sessions.update(persisted)
             logger.info(f"Loaded {len(user_sessions)} persisted sessions")
         except Exception as e:
             logger.error(f"Failed to load persisted sessions: {e}")
+        self._sessions_loaded_at = time.monotonic()
 
-        # Single-instance PID file to avoid getUpdates conflicts
+        # Single-instance PID file to avoid getUpdates conflicts; in sharded mode the
+        # ingress process holds it and the workers it starts skip it. With BOT_STANDBY
+        # the polling lease (LeaderLease) takes its place.
         self.lockfile = os.path.join(os.getcwd(), '.kycut_bot.pid')
         self.lockfile_fd = None
-        # Atomic file lock to prevent double instance.
-        # Use fcntl on Unix-like systems when available, otherwise use an
-        # atomic create (O_CREAT|O_EXCL) based approach which works on Windows.
-        try:
-            if fcntl:
-                self.lockfile_fd = open(self.lockfile, 'a+')
-                try:
-                    fcntl.flock(self.lockfile_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                except BlockingIOError:
-                    logger.error('Another bot instance is already running (atomic file lock)')
-                    raise SystemExit(1)
-                # Write our PID for visibility
-                self.lockfile_fd.seek(0)
-                self.lockfile_fd.truncate()
-                self.lockfile_fd.write(str(os.getpid()) + '\n')
-                self.lockfile_fd.flush()
-            else:
-                # Cross-platform fallback: attempt to atomically create the pid file.
-                flags = os.O_CREAT | os.O_EXCL | os.O_RDWR
-                try:
-                    fd = os.open(self.lockfile, flags)
-                    self.lockfile_fd = os.fdopen(fd, 'w+')
-                    self.lockfile_fd.write(str(os.getpid()) + '\n')
-                    self.lockfile_fd.flush()
-                except FileExistsError:
-                    # Existing lockfile: try to read PID and check if process is alive.
-                    try:
-                        with open(self.lockfile, 'r') as f:
-                            lines = f.read().strip().splitlines()
-                            existing_pid = int(lines[0]) if lines else None
-                    except Exception:
-                        existing_pid = None
-
-                    if existing_pid:
-                        # Attempt to detect whether the PID is still running.
-                        try:
-                            # os.kill with signal 0 checks for process existence on both Unix and Windows
-                            os.kill(existing_pid, 0)
-                            logger.error('Another bot instance is already running (pid %s)', existing_pid)
-                            raise SystemExit(1)
-                        except OSError:
-                            # Process not running — stale lockfile. Remove and retry create.
-                            try:
-                                os.remove(self.lockfile)
-                                fd = os.open(self.lockfile, flags)
-                                self.lockfile_fd = os.fdopen(fd, 'w+')
-                                self.lockfile_fd.write(str(os.getpid()) + '\n')
-                                self.lockfile_fd.flush()
-                            except Exception as e:
-                                logger.error('Failed to acquire lock after removing stale lockfile: %s', e)
-                                raise SystemExit(1)
-                    else:
-                        logger.error('Lockfile exists and PID could not be determined; aborting')
-                        raise SystemExit(1)
-        except Exception as e:
-            logger.error(f'Failed to acquire atomic lock: {e}')
-            raise SystemExit(1)
-    # (Auto-terminate logic is now redundant with atomic lock, but left as fallback if needed)
-        # remove PID file at exit
-        try:
-            atexit.register(lambda: os.path.exists(self.lockfile) and os.remove(self.lockfile))
-        except Exception:
-            pass
+        if shard is None and not BOT_STANDBY:
+            self.lockfile_fd = acquire_instance_lock(self.lockfile)
+        self.lease: Optional[LeaderLease] = None
 
         # Build the PTB application, schedule startup via post_init
-        self.application = (
+        builder = (
             Application.builder()
             .token(BOT_TOKEN)
+            .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
             .post_init(self._on_start)
-            .build()
+            .post_stop(self._on_stop)
         )
+        if TELEGRAM_API_BASE_URL:
+            builder = builder.base_url(TELEGRAM_API_BASE_URL)
+        if shard is not None:
+            # Updates arrive from the ingress process (see run_shard)
+            builder = builder.updater(None)
+        self.application = builder.build()
+        # Startup work that must not delay the first update (see _warm_up)
+        self._background_tasks: set = set()
+        self._requests_loaded: Optional[asyncio.Future] = None
+        # Shutdown: set by the first SIGINT/SIGTERM (see _on_stop_signal)
+        self._stopping: Optional[asyncio.Task] = None
+        self._shutdown_deadline: Optional[float] = None
+        self._shutdown_started = 0.0
+        self.drain_report: Dict[str, Any] = {'handlers_finished': 0, 'handlers_cancelled': 0}
+        # Every message/edit goes through one rate-limited queue; workers split the global limit
+        self.outbound = OutboundScheduler(global_rate=SEND_GLOBAL_RATE / (shard[1] if shard else 1))
+        # Order notifications from the website, delivered at bulk priority
+        self.notifications = NotificationFanout(
+            self.sqlite_path,
+            lambda chat_id, text, **kw: self._send_message(chat_id, text, SEND_PRIORITY_BULK, **kw),
+        )
+        self.notify_server = None
+        self.error_throttle = ErrorThrottle()
+        # In-flight callback work per (chat id, message id); see handle_callback
+        self._callback_tasks: Dict[Any, asyncio.Task] = {}
+        self._callback_generations: Dict[Any, int] = {}
+        self._callback_seq = 0
+        self.callback_stats = {'started': 0, 'cancelled': 0, 'superseded': 0, 'inline': 0}
+        # Rendered (text, keyboard) by view key, and the content last sent to each message
+        self.render_cache = LRUCache(5000)
+        self.sent_digests = LRUCache(20000)
+        self.edits_skipped = 0
+        # user id -> UserOrders (last fetched orders plus running aggregates)
+        self.order_books = LRUCache(1000)
+        self._orders_seq = 0
+        # Users who tapped "Search Orders" and whose next text message is the query
+        self._awaiting_search: set = set()
+        # Callback data -> handler table (see _build_callback_router)
+        self.callbacks = self._build_callback_router()
+        # Callbacks that change an order on the website: never cancelled, run in the user's turn
+        self._mutating_callbacks = {self._callback_confirm, self._callback_cancel}
+        self.metrics_server = None
+        self._register_gauges()
+        # Running /profile, if any (one at a time)
+        self._profiler: Optional[SamplingProfiler] = None
+        self.watchdog = LoopWatchdog()
+        LoopWatchdog.handler_codes.add(KYCutBot._dispatch_callback.__code__)
+        # Admin order alerts, merged into digests during bursts
+        self.admin_digest = AdminDigest(
+            self.sqlite_path,
+            lambda text: self._send_message(ADMIN_ID, text, parse_mode=ParseMode.MARKDOWN),
+            self._format_admin_order,
+            table=f'admin_digest_pending_{shard[0]}' if shard else 'admin_digest_pending',
+        )
+        # Blocking HTTP calls run here so a slow website call doesn't stall other users
+        self._http_pool = ThreadPoolExecutor(max_workers=CONCURRENT_UPDATES, thread_name_prefix='kycut-http')
 
-        # Ensure DB tables used by KYCutBot exist (enhanced schema)
-        try:
-            self._db_init()
-            self._load_persisted_sessions()
-        except Exception as e:
-            logger.debug(f"Local DB init/load skipped: {e}")
-
+        # Sessions were loaded from the store above; the legacy tables from _db_init
+        # aren't needed to serve updates and are created during warm-up
         self.setup_handlers()
         
 
@@ -560,47 +3201,60 @@ class KYCutBot:
             target = getattr(update, "message", None)
         return user_id, target
 
-    async def _reply(self, update, text: str, **kwargs):
-        """Reply that works for both message and callback, editing if callback."""
-        if getattr(update, "callback_query", None):
+    @staticmethod
+    def _timed(handler):
+        """Wrap a handler so its run time is recorded in kycut_handler_duration_seconds."""
+        seconds = HANDLER_SECONDS.labels(handler.__name__)
+        errors = HANDLER_ERRORS.labels(handler.__name__)
+
+        name = 'handler.' + handler.__name__
+
+        @functools.wraps(handler)
+        async def timed(update, context):
+            started = time.perf_counter()
             try:
-                await update.callback_query.edit_message_text(text, **kwargs)
+                with TRACER.span(name):
+                    return await handler(update, context)
             except Exception:
-                # fallback to sending a message
-                chat_id = update.callback_query.message.chat.id if update.callback_query and update.callback_query.message else None
-                if chat_id:
-                    await self.application.bot.send_message(chat_id=chat_id, text=text, **kwargs)
-        else:
-            if getattr(update, "message", None):
-                await update.message.reply_text(text, **kwargs)
-    
+                errors.inc()
+                raise
+            finally:
+                seconds.observe(time.perf_counter() - started)
+        LoopWatchdog.handler_codes.add(timed.__code__)
+        return timed
+
     def setup_handlers(self):
         """Set up all command and message handlers"""
+        # Runs before the handlers below: anything but plain text ends a "Search Orders" prompt
+        self.application.add_handler(TypeHandler(Update, self._disarm_search), group=-1)
+
         # Command handlers
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(CommandHandler("login", self.login_command))
-        self.application.add_handler(CommandHandler("logout", self.logout_command))
-        self.application.add_handler(CommandHandler("order", self.order_command))
-        self.application.add_handler(CommandHandler("orders", self.orders_command))
-        self.application.add_handler(CommandHandler("link", self.link_command))
-        self.application.add_handler(CommandHandler("menu", self.menu_command))
-        self.application.add_handler(CommandHandler("auth", self.auth_command))
-        self.application.add_handler(CommandHandler("ping", self.ping_command))
-        self.application.add_handler(CommandHandler("stats", self.stats_command))
-        self.application.add_handler(CommandHandler("status", self.status_command))
+        self.application.add_handler(CommandHandler("start", self._timed(self.start_command)))
+        self.application.add_handler(CommandHandler("help", self._timed(self.help_command)))
+        self.application.add_handler(CommandHandler("login", self._timed(self.login_command)))
+        self.application.add_handler(CommandHandler("logout", self._timed(self.logout_command)))
+        self.application.add_handler(CommandHandler("order", self._timed(self.order_command)))
+        self.application.add_handler(CommandHandler("orders", self._timed(self.orders_command)))
+        self.application.add_handler(CommandHandler("link", self._timed(self.link_command)))
+        self.application.add_handler(CommandHandler("menu", self._timed(self.menu_command)))
+        self.application.add_handler(CommandHandler("auth", self._timed(self.auth_command)))
+        self.application.add_handler(CommandHandler("ping", self._timed(self.ping_command)))
+        self.application.add_handler(CommandHandler("stats", self._timed(self.stats_command)))
+        self.application.add_handler(CommandHandler("search", self._timed(self.search_command)))
+        self.application.add_handler(CommandHandler("status", self._timed(self.status_command)))
+        self.application.add_handler(CommandHandler("profile", self._timed(self.profile_command)))
         
         # Message handlers
         self.application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND, self.handle_message
+            filters.TEXT & ~filters.COMMAND, self._timed(self.handle_message)
         ))
         
         # Callback query handler for inline buttons
-        self.application.add_handler(CallbackQueryHandler(self.handle_callback))
+        self.application.add_handler(CallbackQueryHandler(self._timed(self.handle_callback)))
         # Global update logger (logs raw updates to DB and file)
         try:
             from telegram import Update as TGUpdate
-            self.application.add_handler(MessageHandler(filters.ALL, self._log_update), group=0)
+            self.application.add_handler(MessageHandler(filters.ALL, self._timed(self._log_update)), group=0)
         except Exception:
             logger.debug("Could not register global update logger")
 
@@ -636,102 +3290,149 @@ class KYCutBot:
         except Exception as e:
             logger.debug("_log_update error: %s", e)
 
+    async def _http(self, method: str, url: str, **kwargs):
+        """Run a blocking `requests` call on the HTTP worker pool."""
+        if self._requests_loaded is not None:
+            # LazyLoader isn't safe to trigger from several threads at once
+            await self._requests_loaded
+        loop = asyncio.get_running_loop()
+        endpoint = self._endpoint_key(url)
+        span = TRACER.start_span('http.' + endpoint, method=method)
+        started = time.perf_counter()
+        status = 'error'
+        error = None
+        try:
+            response = await loop.run_in_executor(
+                self._http_pool, functools.partial(requests.request, method, url, **kwargs)
+            )
+            status = response.status_code
+            return response
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            API_SECONDS.labels(endpoint, status).observe(time.perf_counter() - started)
+            if span is not None:
+                span.attrs['status'] = status
+                span.finish(error)
+
+    _ENDPOINT_PATHS = {path: key for key, path in API_ENDPOINTS.items()}
+    _ENDPOINT_PATTERNS = [(re.compile('^' + re.escape(path).replace(r'\{\}', '[^/]+') + '$'), key)
+                          for key, path in API_ENDPOINTS.items() if '{}' in path]
+
+    @classmethod
+    def _endpoint_key(cls, url: str) -> str:
+        """API_ENDPOINTS key for a website URL (the path for calls not listed there)."""
+        path = urlsplit(url).path
+        key = cls._ENDPOINT_PATHS.get(path)
+        if key is None:
+            key = next((k for pattern, k in cls._ENDPOINT_PATTERNS if pattern.match(path)), None)
+        return key or ('other' if re.search(r'\d', path) else path)
+
     async def _make_api_request(self, endpoint_key: str, method: str = 'GET', 
                                data: Optional[Dict] = None, user_id: Optional[int] = None,
-                               **kwargs) -> Dict[str, Any]:
-        """Enhanced API request method with better error handling"""
+                               params: Optional[Dict] = None, **kwargs) -> Dict[str, Any]:
+        """Enhanced API request method with better error handling.
+
+        Query parameters go in ``params``, never in ``endpoint_key``: the key names
+        spans and events, and the query may hold user text.
+        """
         max_retries = 4
         backoff = 0.5
         last_err = None
-        for attempt in range(max_retries):
-            try:
-                endpoint = API_ENDPOINTS.get(endpoint_key, endpoint_key)
-                if '{}' in endpoint and 'order_id' in kwargs:
-                    endpoint = endpoint.format(kwargs['order_id'])
+        with TRACER.span('api.' + endpoint_key) as span:
+            for attempt in range(max_retries):
+                try:
+                    endpoint = API_ENDPOINTS.get(endpoint_key, endpoint_key)
+                    if '{}' in endpoint and 'order_id' in kwargs:
+                        endpoint = endpoint.format(kwargs['order_id'])
 
-                url = urljoin(WEBSITE_URL, endpoint)
+                    url = urljoin(WEBSITE_URL, endpoint)
 
-                headers = {
-                    'Content-Type': 'application/json',
-                    'User-Agent': 'KYCut-Enhanced-Bot/2.0',
-                    'X-Webhook-Secret': WEBHOOK_SECRET,
-                }
+                    headers = {
+                        'Content-Type': 'application/json',
+                        'User-Agent': 'KYCut-Enhanced-Bot/2.0',
+                        'X-Webhook-Secret': WEBHOOK_SECRET,
+                    }
 
-                # Add bot token if user has one
-                if user_id and user_id in user_sessions:
-                    bot_token = user_sessions[user_id].get('bot_token')
-                    if bot_token:
-                        headers['Authorization'] = f'Bearer {bot_token}'
+                    # Add bot token if user has one
+                    if user_id and user_id in user_sessions:
+                        bot_token = user_sessions[user_id].get('bot_token')
+                        if bot_token:
+                            headers['Authorization'] = f'Bearer {bot_token}'
 
-                request_kwargs = {
-                    'headers': headers,
-                    'timeout': 30,
-                }
+                    request_kwargs = {
+                        'headers': headers,
+                        'timeout': 30,
+                    }
 
-                if data:
-                    request_kwargs['json'] = data
-
-                # Log attempt
-                debug_logger.debug(json.dumps({
-                    'event': 'api_request_attempt',
-                    'endpoint_key': endpoint_key,
-                    'method': method.upper(),
-                    'url': url,
-                    'attempt': attempt + 1,
-                    'user_id': user_id,
-                }))
-
-                if method.upper() == 'GET':
-                    response = requests.get(url, **request_kwargs)
-                elif method.upper() == 'POST':
-                    response = requests.post(url, **request_kwargs)
-                elif method.upper() == 'PATCH':
-                    response = requests.patch(url, **request_kwargs)
-                elif method.upper() == 'PUT':
-                    response = requests.put(url, **request_kwargs)
-                else:
-                    raise ValueError(f"Unsupported HTTP method: {method}")
+                    if data:
+                        request_kwargs['json'] = data
+                    if params:
+                        request_kwargs['params'] = params
+
+                    # Log attempt
+                    EVENTS.log(
+                        'api_request_attempt',
+                        endpoint_key=endpoint_key,
+                        method=method.upper(),
+                        url=url,
+                        attempt=attempt + 1,
+                        user_id=user_id,
+                        trace_id=TRACER.current_trace_id(),
+                    )
 
-                if response.status_code in (429, 502, 503, 504):
-                    last_err = Exception(f"HTTP {response.status_code}")
-                    logger.warning("Transient API error %s on %s; retrying (attempt %s)", response.status_code, endpoint_key, attempt+1)
-                    time.sleep(backoff)
-                    backoff *= 2
-                    continue
+                    if method.upper() not in ('GET', 'POST', 'PATCH', 'PUT'):
+                        raise ValueError(f"Unsupported HTTP method: {method}")
+                    response = await self._http(method.upper(), url, **request_kwargs)
+
+                    if response.status_code in (429, 502, 503, 504):
+                        last_err = Exception(f"HTTP {response.status_code}")
+                        logger.warning("Transient API error %s on %s; retrying (attempt %s)", response.status_code, endpoint_key, attempt+1)
+                        await asyncio.sleep(backoff)
+                        backoff *= 2
+                        continue
+
+                    result = response.json() if response.content else {}
+                    result['_status_code'] = response.status_code
+                    result['_success'] = response.ok
+
+                    # Log success/failure
+                    EVENTS.log(
+                        'api_request_result',
+                        endpoint_key=endpoint_key,
+                        method=method.upper(),
+                        url=url,
+                        status_code=response.status_code,
+                        ok=response.ok,
+                        user_id=user_id,
+                        trace_id=TRACER.current_trace_id(),
+                    )
 
-                result = response.json() if response.content else {}
-                result['_status_code'] = response.status_code
-                result['_success'] = response.ok
-
-                # Log success/failure
-                debug_logger.debug(json.dumps({
-                    'event': 'api_request_result',
-                    'endpoint_key': endpoint_key,
-                    'method': method.upper(),
-                    'url': url,
-                    'status_code': response.status_code,
-                    'ok': response.ok,
-                    'user_id': user_id,
-                }))
-
-                return result
-
-            except requests.exceptions.Timeout as e:
-                last_err = e
-                logger.error(f"API request timeout for {endpoint_key}, attempt {attempt+1}")
-                time.sleep(backoff); backoff *= 2
-                continue
-            except requests.exceptions.ConnectionError as e:
-                last_err = e
-                logger.error(f"API connection error for {endpoint_key}, attempt {attempt+1}")
-                time.sleep(backoff); backoff *= 2
-                continue
-            except Exception as e:
-                last_err = e
-                logger.error(f"API request error for {endpoint_key}: {e}")
-                break
+                    if span is not None:
+                        span.attrs['attempts'] = attempt + 1
+
+                    return result
 
-        return {'success': False, 'error': str(last_err) if last_err else 'Unknown error'}
+                except requests.exceptions.Timeout as e:
+                    last_err = e
+                    logger.error(f"API request timeout for {endpoint_key}, attempt {attempt+1}")
+                    await asyncio.sleep(backoff); backoff *= 2
+                    continue
+                except requests.exceptions.ConnectionError as e:
+                    last_err = e
+                    logger.error(f"API connection error for {endpoint_key}, attempt {attempt+1}")
+                    await asyncio.sleep(backoff); backoff *= 2
+                    continue
+                except Exception as e:
+                    last_err = e
+                    logger.error(f"API request error for {endpoint_key}: {e}")
+                    break
+
+            if span is not None:
+                span.attrs['attempts'] = attempt + 1
+                span.attrs['error'] = type(last_err).__name__ if last_err else 'Unknown'
+            return {'success': False, 'error': str(last_err) if last_err else 'Unknown error'}
 
     def _make_headers(self, user_id: Optional[int] = None, json_content: bool = True, include_webhook_secret: bool = True) -> Dict[str, str]:
         """Construct headers preferring Authorization Bearer <bot_token> when available.
@@ -780,34 +3481,99 @@ class KYCutBot:
             pass
         return None
 
-    async def _reply(self, carrier: Union[Update, Any], text: str, **kwargs):
+    @staticmethod
+    def _chat_id(carrier: Any) -> Optional[int]:
+        """Chat id for an Update, CallbackQuery or Message."""
+        try:
+            chat = getattr(carrier, "effective_chat", None)
+            if chat:
+                return chat.id
+            message = getattr(carrier, "message", None)
+            if message is not None and getattr(message, "chat", None):
+                return message.chat.id
+            if getattr(carrier, "chat", None):
+                return carrier.chat.id
+            user = getattr(carrier, "from_user", None) or getattr(carrier, "effective_user", None)
+            if user:
+                return user.id
+        except Exception:
+            pass
+        return None
+
+    def _message_key(self, query: Any) -> Tuple[Optional[int], Any]:
+        """(chat id, message id) of the message a callback query belongs to."""
+        message = getattr(query, 'message', None)
+        return (self._chat_id(query), getattr(message, 'message_id', None) or getattr(query, 'inline_message_id', None))
+
+    @staticmethod
+    def _content_digest(text: str, kwargs: Dict[str, Any]) -> Optional[int]:
+        try:
+            return hash((text, kwargs.get('parse_mode'), kwargs.get('reply_markup')))
+        except TypeError:
+            return None
+
+    async def _reply(self, carrier: Union[Update, Any], text: str,
+                     priority: int = SEND_PRIORITY_INTERACTIVE, **kwargs) -> asyncio.Future:
         """
-        Unified reply:
-        - If called from a callback, edit that message.
+        Unified reply, queued on the outbound scheduler:
+        - If called from a callback (Update or CallbackQuery), edit that message.
         - If from a command/message, reply normally.
+        Returns the scheduler future without waiting for delivery.
         """
-        try:
-            if hasattr(carrier, "callback_query") and carrier.callback_query:
-                # Edit the existing message
-                return await carrier.callback_query.edit_message_text(text, **kwargs)
-            # Fallback to message reply
-            if hasattr(carrier, "message") and carrier.message:
-                return await carrier.message.reply_text(text, **kwargs)
-            # Sometimes we get a CallbackQuery directly
-            if hasattr(carrier, "edit_message_text"):
-                return await carrier.edit_message_text(text, **kwargs)
-        except Exception:
-            # Last resort: try replying via application bot using chat id
+        query = getattr(carrier, "callback_query", None)
+        if query is None and not hasattr(carrier, "callback_query") and hasattr(carrier, "edit_message_text"):
+            # We were handed a CallbackQuery directly
+            query = carrier
+        chat_id = self._chat_id(carrier)
+        render = _callback_render.get()
+        digest = self._content_digest(text, kwargs)
+
+        async def send():
+            if self._is_stale_render(render):
+                # A newer tap on this message is rendering; don't let this edit land after it
+                self.callback_stats['superseded'] += 1
+                return None
             try:
-                chat_id = None
-                if hasattr(carrier, "effective_chat") and carrier.effective_chat:
-                    chat_id = carrier.effective_chat.id
-                elif hasattr(carrier, "message") and carrier.message and carrier.message.chat:
-                    chat_id = carrier.message.chat.id
-                if chat_id:
-                    return await self.application.bot.send_message(chat_id=chat_id, text=text, **kwargs)
-            except Exception:
-                pass
+                if query is not None:
+                    message_key = self._message_key(query)
+                    if digest is not None and self.sent_digests.get(message_key) == digest:
+                        # Same content as what the message already shows
+                        self.edits_skipped += 1
+                        return None
+                    result = await query.edit_message_text(text, **kwargs)
+                    self.sent_digests.put(message_key, digest)
+                    return result
+                if getattr(carrier, "message", None):
+                    result = await carrier.message.reply_text(text, **kwargs)
+                    if getattr(result, "message_id", None) is not None:
+                        self.sent_digests.put((chat_id, result.message_id), digest)
+                    return result
+            except RetryAfter:
+                raise
+            except BadRequest as e:
+                if 'not modified' in str(e).lower():
+                    # Telegram already shows this content; a fresh send_message would duplicate it
+                    self.edits_skipped += 1
+                    if query is not None:
+                        self.sent_digests.put(self._message_key(query), digest)
+                    return None
+                logger.debug("Reply failed, falling back to send_message: %s", e)
+            except Exception as e:
+                logger.debug("Reply failed, falling back to send_message: %s", e)
+            # Last resort: send via application bot using chat id
+            if chat_id:
+                return await self.application.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+
+        return self.outbound.submit(chat_id, send, priority)
+
+    def _send_message(self, chat_id: int, text: str, priority: int = SEND_PRIORITY_ADMIN,
+                      **kwargs) -> asyncio.Future:
+        """Queue a plain send_message (admin alerts, notifications)."""
+        return self.outbound.submit(
+            chat_id,
+            lambda: self.application.bot.send_message(chat_id=chat_id, text=text, **kwargs),
+            priority,
+        )
 
     def is_authenticated(self, user_id: int) -> bool:
         """Check if user is authenticated with enhanced validation"""
@@ -879,7 +3645,8 @@ Ready to get started? 🚀
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(
+        await self._reply(
+            update,
             welcome_message.strip(),
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=reply_markup
@@ -921,7 +3688,8 @@ Ready to link? Use the buttons below!
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(
+        await self._reply(
+            update,
             welcome_text,
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=reply_markup
@@ -931,10 +3699,19 @@ Ready to link? Use the buttons below!
         """Show main navigation menu (works from /menu or inline button)."""
         user_id = self._get_user_id(update) or 0
         is_linked = self.is_authenticated(user_id)
-        # Build menu text and keyboard and use _reply so the message is edited when possible
+        username = user_sessions.get(user_id, {}).get('user_data', {}).get('name', 'User') if is_linked else None
+        # The menu only depends on link state and display name, so it's shared between users
+        cache_key = ('menu', is_linked, username)
+        rendered = self.render_cache.get(cache_key)
+        if rendered is None:
+            rendered = self._render_menu(is_linked, username)
+            self.render_cache.put(cache_key, rendered)
+        menu_text, reply_markup = rendered
+        # Use _reply so the message is edited when possible
+        await self._reply(update, menu_text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+
+    def _render_menu(self, is_linked: bool, username: Optional[str]) -> Tuple[str, InlineKeyboardMarkup]:
         if is_linked:
-            user_data = user_sessions.get(user_id, {}).get('user_data', {})
-            username = user_data.get('name', 'User')
             menu_text = (
                 f"🏠 **Main Menu - {username}**\n\n"
                 "Welcome to your KYCut dashboard! Choose an option below:\n\n"
@@ -961,8 +3738,7 @@ Ready to link? Use the buttons below!
                 [InlineKeyboardButton("ℹ️ Help", callback_data="menu_help")]
             ]
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await self._reply(update, menu_text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+        return menu_text, InlineKeyboardMarkup(keyboard)
 
     
     async def link_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -971,7 +3747,8 @@ Ready to link? Use the buttons below!
         telegram_username = update.effective_user.username
         
         if not context.args:
-            await update.message.reply_text(
+            await self._reply(
+                update,
                 "🔗 **Account Linking**\n\n"
                 "Please provide your 8-digit linking code:\n"
                 "`/link YOUR_CODE`\n\n"
@@ -984,7 +3761,8 @@ Ready to link? Use the buttons below!
         code = context.args[0].upper().strip()
         
         if len(code) != 8:
-            await update.message.reply_text(
+            await self._reply(
+                update,
                 "❌ **Invalid Code Format**\n\n"
                 "Linking codes must be exactly 8 characters.\n"
                 "Example: `ABC12345`\n\n"
@@ -1019,7 +3797,7 @@ Ready to link? Use the buttons below!
                 payload = {'telegramUserId': user_id}
                 headers = self._make_headers(user_id=None, json_content=True, include_webhook_secret=True)
                 # ensure-session is not user-scoped; use webhook secret or service credentials
-                r = requests.post(ensure_url, json=payload, headers=headers, timeout=10)
+                r = await self._http('POST', ensure_url, json=payload, headers=headers, timeout=10)
                 if r.status_code == 200:
                     data = r.json()
                     # data: { success, userId, botToken, expiresAt }
@@ -1037,7 +3815,8 @@ Ready to link? Use the buttons below!
             except Exception as e:
                 logger.debug(f"ensure-session call failed: {e}")
             
-            await update.message.reply_text(
+            await self._reply(
+                update,
                 f"✅ **Account Linked Successfully!**\n\n"
                 f"Your Telegram account is now connected to KYCut.\n\n"
                 f"**What's next?**\n"
@@ -1053,7 +3832,8 @@ Ready to link? Use the buttons below!
             await self.menu_command(update, context)
             
         else:
-            await update.message.reply_text(
+            await self._reply(
+                update,
                 f"❌ **Linking Failed**\n\n"
                 f"Error: {result.get('error', 'Invalid or expired code')}\n\n"
                 f"**Troubleshooting:**\n"
@@ -1089,8 +3869,8 @@ Ready to link? Use the buttons below!
             )
             return
 
-        orders = orders_result.get('orders', [])
-        if not orders:
+        book = orders_result['book']
+        if not book.orders:
             keyboard = [
                 [InlineKeyboardButton("🛒 Start Shopping", url=WEBSITE_URL)],
                 [InlineKeyboardButton("🏠 Main Menu", callback_data="menu_main")],
@@ -1103,73 +3883,51 @@ Ready to link? Use the buttons below!
             )
             return
 
-        await self.show_orders_list(update, orders, page=0)
+        await self.show_orders_list(update, book, page=0)
     
-    async def show_orders_list(self, update: Update, orders: List[Dict], page: int = 0):
-        """Show paginated list of orders"""
+    async def show_orders_list(self, update: Update, book: UserOrders, page: int = 0):
+        """Show paginated list of orders (rendered once per orders version and page)"""
+        user_id = self._get_user_id(update)
+        cache_key = ('orders', user_id, book.version, page)
+        rendered = self.render_cache.get(cache_key)
+        if rendered is None:
+            rendered = self._render_orders_list(book, page)
+            self.render_cache.put(cache_key, rendered)
+        text, reply_markup = rendered
+        await self._reply(update, text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+
+    def _render_orders_list(self, book: UserOrders, page: int) -> Tuple[str, InlineKeyboardMarkup]:
         orders_per_page = 5
-        total_orders = len(orders)
+        total_orders = book.total_orders
         total_pages = (total_orders + orders_per_page - 1) // orders_per_page
 
         start_idx = page * orders_per_page
         end_idx = min(start_idx + orders_per_page, total_orders)
-        page_orders = orders[start_idx:end_idx]
-
-        total_spent = sum(float(o.get('total_amount', 0) or 0) for o in orders)
-        pending_count = len([o for o in orders if (o.get('status') or '').lower() == 'pending'])
-        completed_count = len([o for o in orders if (o.get('status') or '').lower() in ['delivered','completed']])
+        page_orders = book.orders[start_idx:end_idx]
 
         orders_text = f"""
 📋 **Your Orders** (Page {page + 1}/{max(total_pages,1)})
 
 **📊 Quick Stats:**
 • Total Orders: {total_orders}
-• Total Spent: ${total_spent:.2f}
-• Pending: {pending_count} | Completed: {completed_count}
+• Total Spent: ${book.total_spent:.2f}
+• Pending: {book.pending_count} | Completed: {book.completed_count}
 
 **📦 Recent Orders:**
 """
         
         for i, order in enumerate(page_orders, start_idx + 1):
-            order_id = order.get('order_number', order.get('id', 'Unknown'))
-            status = (order.get('status') or 'pending').upper()
-            total = float(order.get('total_amount', 0) or 0)
-            date = order.get('created_at', '')
-            
-            date_str = 'Unknown'
-            if date:
-                try:
-                    date_obj = datetime.fromisoformat(str(date).replace('Z', '+00:00'))
-                    date_str = date_obj.strftime('%m/%d/%Y')
-                except Exception:
-                    pass
-            
-            status_emoji = {
-                'PENDING':'⏳','CONFIRMED':'✅','PROCESSING':'🔄','SHIPPED':'🚚','DELIVERED':'📦','CANCELLED':'❌'
-            }.get(status, '❓')
-            
-            orders_text += f"\n{i}. **{order_id}** {status_emoji}\n   ${total:.2f} • {date_str} • {status}\n"
-
-        keyboard = []
+            orders_text += self._order_line(i, order)
 
         # Quick view buttons with actionable Confirm/Cancel per order
-        if page_orders:
-            for order in page_orders[:5]:
-                oid = order.get('order_number') or order.get('id', 'Unknown')
-                display = oid if len(oid) <= 12 else oid[:12]
-                # Each order gets its own row with View + Confirm + Cancel buttons
-                keyboard.append([
-                    InlineKeyboardButton(f"📋 {display}", callback_data=f"order_view_{oid}"),
-                    InlineKeyboardButton("✅ Confirm", callback_data=f"confirm_{oid}"),
-                    InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_{oid}"),
-                ])
+        keyboard = [self._order_buttons(order) for order in page_orders[:5]]
 
         # Pagination
         nav = []
         if page > 0:
-            nav.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"orders_page_{page-1}"))
+            nav.append(InlineKeyboardButton("⬅️ Previous", callback_data=self.callbacks.encode('orders_page', page - 1)))
         if page < total_pages - 1:
-            nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"orders_page_{page+1}"))
+            nav.append(InlineKeyboardButton("Next ➡️", callback_data=self.callbacks.encode('orders_page', page + 1)))
         if nav: keyboard.append(nav)
 
         keyboard.extend([
@@ -1178,7 +3936,38 @@ Ready to link? Use the buttons below!
             [InlineKeyboardButton("🏠 Main Menu", callback_data="menu_main")],
         ])
 
-        await self._reply(update, orders_text, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
+        return orders_text, InlineKeyboardMarkup(keyboard)
+
+    @staticmethod
+    def _order_line(i: int, order: Dict) -> str:
+        order_id = order.get('order_number', order.get('id', 'Unknown'))
+        status = UserOrders.status_of(order).upper()
+        total = float(order.get('total_amount', 0) or 0)
+        date = order.get('created_at', '')
+        
+        date_str = 'Unknown'
+        if date:
+            try:
+                date_obj = datetime.fromisoformat(str(date).replace('Z', '+00:00'))
+                date_str = date_obj.strftime('%m/%d/%Y')
+            except Exception:
+                pass
+        
+        status_emoji = {
+            'PENDING':'⏳','CONFIRMED':'✅','PROCESSING':'🔄','SHIPPED':'🚚','DELIVERED':'📦','CANCELLED':'❌'
+        }.get(status, '❓')
+        
+        return f"\n{i}. **{order_id}** {status_emoji}\n   ${total:.2f} • {date_str} • {status}\n"
+
+    def _order_buttons(self, order: Dict) -> List[InlineKeyboardButton]:
+        """One keyboard row per order: View + Confirm + Cancel"""
+        oid = str(order.get('order_number') or order.get('id', 'Unknown'))
+        display = oid if len(oid) <= 12 else oid[:12]
+        return [
+            InlineKeyboardButton(f"📋 {display}", callback_data=self.callbacks.encode('order_view', oid)),
+            InlineKeyboardButton("✅ Confirm", callback_data=self.callbacks.encode('confirm', oid)),
+            InlineKeyboardButton("❌ Cancel", callback_data=self.callbacks.encode('cancel', oid)),
+        ]
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         text = (
@@ -1188,11 +3977,12 @@ Ready to link? Use the buttons below!
             "• /login EMAIL_OR_USERNAME PASSWORD – sign in to the website\n"
             "• /orders – list your orders\n"
             "• /order ID – view a specific order\n"
+            "• /search TEXT – search your orders by id, product or status\n"
             "• /logout – sign out from the bot\n"
             "• /auth – show your auth status\n"
             "• /ping – test the bot"
         )
-        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+        await self._reply(update, text, parse_mode=ParseMode.MARKDOWN)
 
     async def ping_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Test bot and API connectivity"""
@@ -1226,7 +4016,7 @@ Ready to link? Use the buttons below!
 • User ID: `{user_id}`
         """
         
-        await update.message.reply_text(message.strip(), parse_mode=ParseMode.MARKDOWN)
+        await self._reply(update, message.strip(), parse_mode=ParseMode.MARKDOWN)
 
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show comprehensive order statistics"""
@@ -1234,7 +4024,8 @@ Ready to link? Use the buttons below!
         self.store.log_command(user_id, "stats")
         
         if not self.is_authenticated(user_id):
-            await update.message.reply_text(
+            await self._reply(
+                update,
                 "❌ Authentication required. Use `/link CODE` or `/login EMAIL PASSWORD` first."
             )
             return
@@ -1268,60 +4059,210 @@ Ready to link? Use the buttons below!
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await update.message.reply_text(
+            await self._reply(
+                update,
                 message.strip(),
                 parse_mode=ParseMode.MARKDOWN,
                 reply_markup=reply_markup
             )
         else:
-            await update.message.reply_text(
+            await self._reply(
+                update,
                 f"❌ Failed to get statistics: {stats_result.get('error', 'Unknown error')}"
             )
 
-    async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Show bot status and system information"""
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin only: sample stacks for N seconds, then send a collapsed-stack file and a summary"""
         user_id = update.effective_user.id
-        self.store.log_command(user_id, "status")
-        
-        # Get bot status from API
-        status_result = await self._make_api_request('bot_status')
-        
-        if status_result.get('success'):
-            status_data = status_result.get('status', {})
-            
-            message = f"""
-🤖 **Bot System Status**
+        self.store.log_command(user_id, "profile")
 
-**🔧 System Health:**
-• Database: {'✅ Connected' if status_data.get('database') else '❌ Disconnected'}
-• API Server: {'✅ Online' if status_data.get('api_server') else '❌ Offline'}
-• Redis Cache: {'✅ Connected' if status_data.get('redis') else '❌ Disconnected'}
+        if not ADMIN_ID or user_id != ADMIN_ID:
+            await self._reply(update, "⛔ This command is only available to the bot admin.")
+            return
+        if self._profiler is not None:
+            await self._reply(update, "⏳ A profile is already running; wait for its results.")
+            return
+        seconds = 30.0
+        if context.args:
+            try:
+                seconds = float(context.args[0])
+            except ValueError:
+                await self._reply(update, "Usage: /profile [SECONDS]")
+                return
+        seconds = min(max(seconds, 1.0), PROFILE_MAX_SECONDS)
+
+        # Handlers run on the event-loop thread
+        self._profiler = SamplingProfiler(threading.get_ident())
+        self._profiler.start()
+        # Wait in the background so this user's later updates aren't held up behind the profile
+        self._spawn_background(self._finish_profile(update.effective_chat.id, seconds))
+        await self._reply(update, f"🔬 Profiling for {seconds:g}s…")
+
+    async def _finish_profile(self, chat_id: int, seconds: float) -> None:
+        """Stop the running profile after `seconds` (or at shutdown) and send the results."""
+        profiler = self._profiler
+        cut_short = False
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            cut_short = True
+            raise
+        finally:
+            # Joining the sampler takes at most one sampling interval
+            profiler.stop()
+            self._profiler = None
+            name = f"kycut-profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.collapsed"
+            data = profiler.collapsed().encode('utf-8')
+            caption = f"Collapsed stacks for flamegraph.pl or speedscope ({profiler.samples:,} samples)"
+            if cut_short:
+                caption += ", cut short by shutdown"
+            if data:
+                self.outbound.submit(
+                    chat_id,
+                    lambda: self.application.bot.send_document(chat_id=chat_id, document=data, filename=name, caption=caption),
+                    SEND_PRIORITY_ADMIN,
+                )
+            self._send_message(chat_id, profiler.summary())
 
-**📊 Statistics:**
-• Active Users: {status_data.get('active_users', 0)}
-• Total Sessions: {status_data.get('total_sessions', 0)}
-• Commands Today: {status_data.get('commands_today', 0)}
+    async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show bot status from the bot's own live state (no network calls); the admin gets the details"""
+        user_id = update.effective_user.id
+        self.store.log_command(user_id, "status")
 
-**⏰ Uptime:** {status_data.get('uptime', 'Unknown')}
-**🔄 Last Updated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-            """
-            
-            await update.message.reply_text(message.strip(), parse_mode=ParseMode.MARKDOWN)
-        else:
-            await update.message.reply_text(
-                f"❌ Failed to get bot status: {status_result.get('error', 'Unknown error')}"
-            )
+        started = time.perf_counter()
+        admin = bool(ADMIN_ID) and user_id == ADMIN_ID
+        lines = self._status_lines(user_id, admin)
+        lines.append(f"_Rendered in {(time.perf_counter() - started) * 1000:.1f} ms_")
+        await self._reply(update, "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+    @staticmethod
+    def _format_uptime(seconds: float) -> str:
+        minutes, secs = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+        if days:
+            return f"{days}d {hours}h {minutes}m"
+        if hours:
+            return f"{hours}h {minutes}m"
+        return f"{minutes}m {secs}s"
+
+    @staticmethod
+    def _format_ms(seconds: float) -> str:
+        return f"{seconds * 1000:.1f}ms" if seconds < 0.01 else f"{seconds * 1000:.0f}ms"
+
+    @classmethod
+    def _format_latency(cls, hist: Histogram) -> str:
+        if not hist.count:
+            return "no data yet"
+        return " · ".join(f"p{int(q * 100)} {cls._format_ms(hist.quantile(q))}" for q in (0.5, 0.95, 0.99))
+
+    @staticmethod
+    def _api_health() -> Dict[str, Dict[str, Any]]:
+        """Website calls since start per endpoint: count, errors (no response, 429 or 5xx), latency."""
+        endpoints: Dict[str, Dict[str, Any]] = {}
+        for (endpoint, status), hist in list(API_SECONDS.children.items()):
+            entry = endpoints.setdefault(endpoint, {'calls': 0, 'errors': 0, 'hists': []})
+            n = hist.count
+            entry['calls'] += n
+            if status == 'error' or status == 429 or (isinstance(status, int) and status >= 500):
+                entry['errors'] += n
+            entry['hists'].append(hist)
+        for entry in endpoints.values():
+            entry['latency'] = Histogram.merge(entry.pop('hists'))
+        return endpoints
+
+    def _status_lines(self, user_id: int, admin: bool) -> List[str]:
+        processor = self.application.update_processor
+        handlers = Histogram.merge(HANDLER_SECONDS.children.values())
+        api = self._api_health()
+        calls = sum(e['calls'] for e in api.values())
+        errors = sum(e['errors'] for e in api.values())
+        lines = [
+            "🤖 *Bot Status*",
+            "",
+            f"• Uptime: {self._format_uptime(time.monotonic() - self.started_at)}",
+            f"• Updates: {processor.rate.rate():.2f}/s over the last minute, {processor.processed:,} handled",
+            f"• Response time: {self._format_latency(handlers)}",
+            f"• Website API: {100.0 * (calls - errors) / calls:.1f}% ok of {calls:,} calls" if calls
+            else "• Website API: no calls yet",
+            f"• Your session: {'✅ authenticated' if self.is_authenticated(user_id) else '❌ not signed in'}",
+        ]
+        if not admin:
+            return lines + [""]
+
+        stats = processor.stats()
+        outbound = self.outbound.stats()
+        lines += [
+            "",
+            "*Sessions*",
+            f"• {len(user_sessions):,} in memory, {self.store.count():,} on disk",
+        ]
+        if self.shard:
+            lines.append(f"• Worker {self.shard[0] + 1} of {self.shard[1]}")
+        if self.lease is not None:
+            lines.append(f"• Polling lease: {'held' if self.lease.held else 'standby'}")
+
+        lines += ["", "*Handlers* (count · p50 · p95 · p99)"]
+        busiest = sorted(HANDLER_SECONDS.children.items(), key=lambda kv: kv[1].count, reverse=True)
+        for (name,), hist in busiest[:8]:
+            if hist.count:
+                lines.append(f"• `{name}` {hist.count:,} · {self._format_latency(hist)}")
+        failed = sum(c.value for c in HANDLER_ERRORS.children.values())
+        if failed:
+            lines.append(f"• Errors: {failed:,}")
+
+        lines += ["", "*Website API* (calls · errors · p95)"]
+        for endpoint, entry in sorted(api.items(), key=lambda kv: kv[1]['calls'], reverse=True)[:8]:
+            p95 = entry['latency'].quantile(0.95)
+            rate = 100.0 * entry['errors'] / entry['calls'] if entry['calls'] else 0.0
+            lines.append(f"• `{endpoint}` {entry['calls']:,} · {rate:.1f}% · {self._format_ms(p95)}"
+                         if p95 is not None else f"• `{endpoint}` no calls")
+
+        lines += [
+            "",
+            "*Queues*",
+            f"• Updates in flight: {stats['in_flight']} of {stats['max_concurrent_updates']}, "
+            f"{stats['queued_updates']} queued (max depth {stats['max_queue_depth']})",
+            "• Outbound: {} pending ({}), {:,} sent, {:,} failed{}".format(
+                outbound['pending'],
+                ", ".join(f"{k} {v}" for k, v in outbound['pending_by_priority'].items() if v) or "none",
+                outbound['sent'], outbound['failed'],
+                f", paused {outbound['paused_for']:.1f}s" if outbound['paused_for'] else ""),
+            f"• Admin digest: {len(self.admin_digest._pending())} parked",
+        ]
+        if self.notifications.conn is not None:
+            notify = self.notifications.stats()
+            lines.append(f"• Notifications: {notify['pending']:,} pending, {notify['sent']:,} sent, "
+                         f"{notify['throughput_per_sec']:.1f}/s")
+
+        lines += ["", "*Caches* (hit ratio · entries)"]
+        for name, cache in (('render', self.render_cache), ('sent digests', self.sent_digests),
+                            ('order books', self.order_books), ('callback state', self.callbacks._state)):
+            cache_stats = cache.stats()
+            lines.append(f"• {name}: {cache_stats['hit_ratio'] * 100:.0f}% · {cache_stats['entries']:,}")
+
+        lag = LOOP_LAG_SECONDS.labels()
+        lines += [
+            "",
+            "*Event loop*",
+            f"• Lag: {self._format_latency(lag)}",
+            f"• Blocked > {self.watchdog.threshold * 1000:.0f}ms: {self.watchdog.blocked:,} times"
+            + (f", longest {self.watchdog.max_blocked_ms:.0f}ms" if self.watchdog.blocked else ""),
+            "",
+        ]
+        return lines
 
     async def auth_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         uid = update.effective_user.id
         authed = self.is_authenticated(uid)
         sess = user_sessions.get(uid, {})
         how = sess.get("linked_via") or ("login" if "session_token" in sess else "unknown")
-        await update.message.reply_text(f"🔐 Authenticated: {authed}\nVia: {how}")
+        await self._reply(update, f"🔐 Authenticated: {authed}\nVia: {how}")
 
     async def login_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if len(context.args) < 2:
-            await update.message.reply_text(
+            await self._reply(
+                update,
                 "Usage:\n`/login EMAIL_OR_USERNAME PASSWORD`\n\n"
                 "Example:\n`/login user@mail.com StrongPass123`\n\n"
                 "**Note:** For better security, use `/link CODE` instead.",
@@ -1333,7 +4274,7 @@ Ready to link? Use the buttons below!
 
         result = await self.authenticate_user(username, password)
         if not result.get("success"):
-            await update.message.reply_text(f"❌ Login failed: {result.get('error','Unknown error')}")
+            await self._reply(update, f"❌ Login failed: {result.get('error','Unknown error')}")
             return
 
         uid = update.effective_user.id
@@ -1348,99 +4289,301 @@ Ready to link? Use the buttons below!
         # Persist session
         self.store.set(uid, user_sessions[uid])
         
-        await update.message.reply_text("✅ Logged in! Use /orders to view your orders or /menu.")
+        await self._reply(update, "✅ Logged in! Use /orders to view your orders or /menu.")
         await self.menu_command(update, context)
 
     async def logout_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         uid = update.effective_user.id
         user_sessions.pop(uid, None)
         self.store.delete(uid)
-        await update.message.reply_text("🚪 Logged out. Use /login or /link to connect again.")
+        await self._reply(update, "🚪 Logged out. Use /login or /link to connect again.")
 
     async def order_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Usage: /order ORDER_ID
         if not context.args:
-            await update.message.reply_text("Usage: `/order ORDER_ID`", parse_mode=ParseMode.MARKDOWN)
+            await self._reply(update, "Usage: `/order ORDER_ID`", parse_mode=ParseMode.MARKDOWN)
             return
         order_id = context.args[0]
         uid = update.effective_user.id
         if not self.is_authenticated(uid):
-            await update.message.reply_text("❌ Authentication required. Use /login or /link first.")
+            await self._reply(update, "❌ Authentication required. Use /login or /link first.")
             return
         result = await self.fetch_order(uid, order_id)
         if not result.get("success"):
-            await update.message.reply_text(f"❌ {result.get('error','Order not found')}")
+            await self._reply(update, f"❌ {result.get('error','Order not found')}")
+            return
+        await self.show_order_details(update, result["order"], result.get("version"))
+
+    async def search_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Usage: /search TEXT
+        uid = update.effective_user.id
+        self.store.log_command(uid, "search")
+        if not context.args:
+            await self._reply(update, "Usage: `/search TEXT` (order id, product name or status)", parse_mode=ParseMode.MARKDOWN)
+            return
+        if not self.is_authenticated(uid):
+            await self._reply(update, "❌ Authentication required. Use /login or /link first.")
+            return
+        await self.search_orders(update, uid, ' '.join(context.args))
+
+    async def search_orders(self, carrier: Any, user_id: int, text: str, limit: int = 10):
+        """Search the cached orders' index, falling back to the website's search endpoint"""
+        orders: List[Dict] = []
+        total = 0
+        orders_result = await self.fetch_all_orders(user_id, max_age=ORDERS_CACHE_SECONDS)
+        if orders_result['success']:
+            book = orders_result['book']
+            index = await book.build_search_index()
+            keys, total = index.search(text, limit)
+            orders = [book.by_key[k] for k in keys]
+        if not total:
+            # Nothing local (or no local copy): ask the website, which may know newer orders
+            remote = await self._make_api_request(
+                'orders_search', user_id=user_id,
+                params={'q': text, 'telegram_user_id': user_id, 'limit': limit},
+            )
+            if remote.get('success'):
+                orders = remote.get('orders', [])[:limit]
+                total = remote.get('total', len(orders))
+            elif not orders_result['success']:
+                await self._reply(
+                    carrier,
+                    f"❌ **Search Failed**\n\nError: {orders_result.get('error', 'Unknown error')}",
+                    parse_mode=ParseMode.MARKDOWN,
+                )
+                return
+        text_out, reply_markup = self._render_search_results(text, orders, total)
+        await self._reply(carrier, text_out, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+
+    def _render_search_results(self, text: str, orders: List[Dict], total: int) -> Tuple[str, InlineKeyboardMarkup]:
+        shown = text.replace('`', '')[:50]
+        body = f"🔍 **Search:** `{shown}`\n\n"
+        if not orders:
+            body += "No matching orders found."
+        else:
+            body += f"{total} matching order{'s' if total != 1 else ''}"
+            if total > len(orders):
+                body += f" (showing first {len(orders)})"
+            body += "\n"
+            for i, order in enumerate(orders, 1):
+                body += self._order_line(i, order)
+        keyboard = [self._order_buttons(order) for order in orders[:5]]
+        keyboard.extend([
+            [InlineKeyboardButton("🔍 New Search", callback_data="action_search"),
+             InlineKeyboardButton("📋 All Orders", callback_data=self.callbacks.encode('orders_page', 0))],
+            [InlineKeyboardButton("🏠 Main Menu", callback_data="menu_main")],
+        ])
+        return body, InlineKeyboardMarkup(keyboard)
+
+    async def _disarm_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Forget a pending search prompt once the user sends a command or taps a button."""
+        user = update.effective_user
+        if user is None or user.id not in self._awaiting_search:
             return
-        await self.show_order_details(update, result["order"])
+        text = update.message.text if update.message else None
+        if text and not text.startswith('/'):
+            # Plain text: handle_message takes it as the query
+            return
+        self._awaiting_search.discard(user.id)
 
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Text sent after tapping "Search Orders" is the search query
+        uid = update.effective_user.id
+        if uid in self._awaiting_search and (update.message.text or "").strip():
+            self._awaiting_search.discard(uid)
+            await self.search_orders(update, uid, update.message.text.strip())
+            return
         # Fallback for plain text
         text = (update.message.text or "").strip().lower()
         if text in {"menu", "start", "help"}:
             await self.menu_command(update, context)
         else:
-            await update.message.reply_text(
+            await self._reply(
+                update,
                 "I didn’t understand that. Try /menu, /orders, /link CODE or /login EMAIL PASSWORD."
             )
 
+    def _supersede_callbacks(self, update: object) -> None:
+        """Update-processor arrival hook: a new tap on a message supersedes older view work on it.
+
+        Runs before the tap waits for the user's earlier updates. It cancels view
+        work still running on the message and marks the tap's generation, so that
+        older taps still queued are skipped and their pending edits dropped.
+        """
+        query = getattr(update, 'callback_query', None)
+        if query is None:
+            return
+        key = self._message_key(query)
+        self._callback_seq += 1
+        generation = self._callback_seq
+        if len(self._callback_generations) > 10000:
+            # Forget messages with no work in flight (their queued edits have long gone out)
+            self._callback_generations = {k: g for k, g in self._callback_generations.items() if k in self._callback_tasks}
+        self._callback_generations[key] = generation
+        # The update's task, and so its handler, sees which generation it is
+        _callback_render.set((key, generation))
+        previous = self._callback_tasks.get(key)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            self.callback_stats['cancelled'] += 1
+
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle inline keyboard callbacks with dynamic navigation"""
+        """Acknowledge the tap at once, then handle it in the user's ordered turn.
+
+        View work runs as a child task of the update, so a newer tap on the same
+        message can cancel it (see _supersede_callbacks) without the tap leaving
+        the user's queue. Confirm and Cancel change the order on the website;
+        they are shielded from cancellation.
+        """
+        query = update.callback_query
+        # Stop the button spinner without waiting for this tap's turn
+        self.application.create_task(self._answer_callback(query))
+        resolved = self.callbacks.resolve(query.data)
+
+        if _callback_render.get() is None:
+            # Not seen by the update processor's arrival hook
+            self._supersede_callbacks(update)
+        key, generation = _callback_render.get()
+        self.callback_stats['started'] += 1
+
+        if resolved is not None and resolved[0] in self._mutating_callbacks:
+            self.callback_stats['inline'] += 1
+            # Once the website call is out, the cache update and admin alert must follow it
+            await asyncio.shield(self._dispatch_callback(update, context, resolved))
+            return
+
+        if self._is_stale_render((key, generation)):
+            # A newer tap on this message arrived while this one waited for its turn
+            self.callback_stats['cancelled'] += 1
+            return
+        task = asyncio.get_running_loop().create_task(self._run_callback(update, context, resolved))
+        self._callback_tasks[key] = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+            # Superseded by a newer tap; the update itself is done
+        finally:
+            if self._callback_tasks.get(key) is task:
+                del self._callback_tasks[key]
+
+    async def _answer_callback(self, query) -> None:
+        try:
+            await query.answer()
+        except Exception as e:
+            logger.debug("answerCallbackQuery failed: %s", e)
+
+    def _is_stale_render(self, render: Optional[Tuple[Any, int]]) -> bool:
+        """True if a newer callback has started on the same message."""
+        if render is None:
+            return False
+        key, generation = render
+        return self._callback_generations.get(key, generation) > generation
+
+    async def _run_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                            resolved: Optional[Tuple[Any, tuple]] = None):
+        try:
+            await self._dispatch_callback(update, context, resolved)
+        except asyncio.CancelledError:
+            logger.debug("Callback %r on %s superseded by a newer tap", update.callback_query.data,
+                         self._message_key(update.callback_query))
+            raise
+
+    async def _dispatch_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 resolved: Optional[Tuple[Any, tuple]] = None):
+        """Handle inline keyboard callbacks via the callback router"""
         query = update.callback_query
+        if resolved is None:
+            resolved = self.callbacks.resolve(query.data)
+        if resolved is None:
+            logger.debug("No handler for callback data %r", query.data)
+            return
+        handler, args = resolved
+        action = getattr(handler, '__name__', 'unknown')
+        started = time.perf_counter()
+        try:
+            with TRACER.span('callback.' + action):
+                await handler(query, *args)
+        finally:
+            CALLBACK_SECONDS.labels(action).observe(time.perf_counter() - started)
+
+    def _build_callback_router(self) -> CallbackRouter:
+        """Callback data table: compact routes for buttons carrying arguments, plus the plain and legacy forms"""
+        router = CallbackRouter(self.sqlite_path)
+
+        # Buttons with arguments, emitted through router.encode(name, *args)
+        router.route('orders_page', 'p', self._callback_orders_page)
+        router.route('filter', 'f', self.show_filtered_orders)
+        router.route('order_view', 'v', self.show_order_details_callback)
+        router.route('confirm', 'c', self._callback_confirm)
+        router.route('cancel', 'x', self._callback_cancel)
+
+        # Plain callback data
+        for data, handler in {
+            'menu_main': self.show_main_menu,
+            'menu_orders': self.show_orders_menu,
+            'menu_link': self.show_link_menu,
+            'menu_login': self.show_login_menu,
+            'menu_help': self.show_help_menu,
+            'menu_settings': self.show_settings_menu,
+            'menu_account': self.show_account_menu,
+            'menu_stats': self.show_stats_menu,
+            'orders_filter': self.show_orders_filter,
+            'action_search': self._callback_search_prompt,
+            'action_menu': self.show_main_menu,
+            'action_orders': self.show_orders_menu,
+            'action_stats': self.show_stats_menu,
+            'action_link': self.show_link_menu,
+            'action_help': self.show_help_menu,
+        }.items():
+            router.exact(data, handler)
+
+        # Buttons on messages sent before the compact format
+        def status_page(rest: str) -> tuple:
+            status, _, page = rest.partition('_')
+            return status, int(page) if page else 0
+
+        router.legacy('orders_page_', self._callback_orders_page, lambda rest: (int(rest),))
+        router.legacy('filter_', self.show_filtered_orders, status_page)
+        router.legacy('order_view_', self.show_order_details_callback)
+        router.legacy('confirm_', self._callback_confirm)
+        router.legacy('cancel_', self._callback_cancel)
+        return router
+
+    async def _callback_orders_page(self, query, page: int):
+        orders_result = await self.fetch_all_orders(query.from_user.id, max_age=ORDERS_CACHE_SECONDS)
+        if orders_result['success']:
+            await self.show_orders_list(query, orders_result['book'], page)
+
+    async def _callback_search_prompt(self, query):
+        """Search prompt: the next text message is the query"""
         user_id = query.from_user.id
-        data = query.data
-        
-        await query.answer()
-        
-        # Parse callback data
-        parts = data.split('_')
-        action = parts[0]
-        
-        # Menu navigation
-        if action == 'menu':
-            if data == 'menu_main':
-                await self.show_main_menu(query)
-            elif data == 'menu_orders':
-                await self.show_orders_menu(query)
-            elif data == 'menu_link':
-                await self.show_link_menu(query)
-            elif data == 'menu_login':
-                await self.show_login_menu(query)
-            elif data == 'menu_help':
-                await self.show_help_menu(query)
-            elif data == 'menu_settings':
-                await self.show_settings_menu(query)
-            elif data == 'menu_account':
-                await self.show_account_menu(query)
-            elif data == 'menu_stats':
-                await self.show_stats_menu(query)
-        
-        # Orders navigation
-        elif action == 'orders':
-            if data.startswith('orders_page_'):
-                page = int(parts[2])
-                orders_result = await self.fetch_all_orders(user_id)
-                if orders_result['success']:
-                    await self.show_orders_list(query, orders_result['orders'], page)
-            elif data == 'orders_filter':
-                await self.show_orders_filter(query)
-        
-        # Order actions
-        elif action == 'order':
-            if data.startswith('order_view_'):
-                order_id = '_'.join(parts[2:])
-                await self.show_order_details_callback(query, order_id)
-        
-        # Legacy order actions
-        elif action in ['confirm', 'cancel']:
-            if not self.is_authenticated(user_id):
-                await query.edit_message_text("❌ Authentication required!")
-                return
-            
-            order_id = parts[1] if len(parts) > 1 else None
-            if action == 'confirm' and order_id:
-                await self.confirm_order(query, user_id, order_id)
-            elif action == 'cancel' and order_id:
-                await self.cancel_order(query, user_id, order_id)
+        if not self.is_authenticated(user_id):
+            await self._reply(query, "❌ Authentication required!")
+            return
+        self._awaiting_search.add(user_id)
+        await self._reply(
+            query,
+            "🔍 **Search Orders**\n\n"
+            "Send an order id, order number, product name or status.\n"
+            "You can also use `/search TEXT` at any time.",
+            parse_mode=ParseMode.MARKDOWN,
+        )
+
+    async def _callback_confirm(self, query, order_id: str):
+        user_id = query.from_user.id
+        if not self.is_authenticated(user_id):
+            await self._reply(query, "❌ Authentication required!")
+            return
+        await self.confirm_order(query, user_id, order_id)
+
+    async def _callback_cancel(self, query, order_id: str):
+        user_id = query.from_user.id
+        if not self.is_authenticated(user_id):
+            await self._reply(query, "❌ Authentication required!")
+            return
+        await self.cancel_order(query, user_id, order_id)
 
     async def show_main_menu(self, query):
         """Show main menu via callback"""
@@ -1471,7 +4614,7 @@ You can link your account using a linking code or by logging in with your creden
             [InlineKeyboardButton("🏠 Main Menu", callback_data="menu_main")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+        await self._reply(query, text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
 
     async def show_login_menu(self, query):
         """Show login menu via callback"""
@@ -1500,7 +4643,7 @@ Configure your bot preferences here.
             [InlineKeyboardButton("🏠 Main Menu", callback_data="menu_main")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+        await self._reply(query, text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
 
     async def show_account_menu(self, query):
         """Show account menu via callback"""
@@ -1535,40 +4678,45 @@ Configure your bot preferences here.
             [InlineKeyboardButton("🏠 Main Menu", callback_data="menu_main")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+        await self._reply(query, text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
 
     async def show_stats_menu(self, query):
         """Show stats menu via callback"""
         user_id = query.from_user.id
         orders_result = await self.fetch_all_orders(user_id)
         if not orders_result['success']:
-            await query.edit_message_text(
+            await self._reply(
+                query,
                 f"❌ **Failed to Load Orders**\n\n"
                 f"Error: {orders_result.get('error', 'Unknown error')}\n\n"
                 f"Please try again or contact support.",
                 parse_mode=ParseMode.MARKDOWN
             )
             return
-        orders = orders_result['orders']
-        total_orders = len(orders)
-        total_spent = sum(float(order.get('total_amount', 0)) for order in orders)
-        pending_count = len([o for o in orders if o.get('status') == 'pending'])
-        completed_count = len([o for o in orders if o.get('status') in ['delivered', 'completed']])
+        book = orders_result['book']
+        cache_key = ('stats', user_id, book.version)
+        rendered = self.render_cache.get(cache_key)
+        if rendered is None:
+            rendered = self._render_stats(book)
+            self.render_cache.put(cache_key, rendered)
+        text, reply_markup = rendered
+        await self._reply(query, text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+
+    def _render_stats(self, book: UserOrders) -> Tuple[str, InlineKeyboardMarkup]:
         text = f"""
 📊 **Order Statistics**
 
 **Summary:**
-• Total Orders: {total_orders}
-• Total Spent: ${total_spent:.2f}
-• Pending: {pending_count}
-• Completed: {completed_count}
+• Total Orders: {book.total_orders}
+• Total Spent: ${book.total_spent:.2f}
+• Pending: {book.pending_count}
+• Completed: {book.completed_count}
         """
         keyboard = [
             [InlineKeyboardButton("📋 View Orders", callback_data="menu_orders")],
             [InlineKeyboardButton("🏠 Main Menu", callback_data="menu_main")]
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+        return text, InlineKeyboardMarkup(keyboard)
 
     async def show_orders_filter(self, query):
         """Show orders filter options"""
@@ -1593,14 +4741,75 @@ Filter your orders by status.
             [InlineKeyboardButton("🏠 Main Menu", callback_data="menu_main")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+        await self._reply(query, text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+
+    FILTER_STATUSES = {
+        'pending': '⏳ Pending',
+        'confirmed': '✅ Confirmed',
+        'shipped': '🚚 Shipped',
+        'delivered': '📦 Delivered',
+        'cancelled': '❌ Cancelled',
+    }
+
+    async def show_filtered_orders(self, query, status: str, page: int = 0):
+        """Show orders with one status, read from the cached status index"""
+        if status not in self.FILTER_STATUSES:
+            return
+        user_id = query.from_user.id
+        orders_result = await self.fetch_all_orders(user_id, max_age=ORDERS_CACHE_SECONDS)
+        if not orders_result['success']:
+            await self._reply(
+                query,
+                f"❌ **Failed to Load Orders**\n\n"
+                f"Error: {orders_result.get('error', 'Unknown error')}",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            return
+        book = orders_result['book']
+        cache_key = ('filter', user_id, book.version, status, page)
+        rendered = self.render_cache.get(cache_key)
+        if rendered is None:
+            rendered = self._render_filtered_orders(book, status, page)
+            self.render_cache.put(cache_key, rendered)
+        text, reply_markup = rendered
+        await self._reply(query, text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+
+    def _render_filtered_orders(self, book: UserOrders, status: str, page: int) -> Tuple[str, InlineKeyboardMarkup]:
+        orders_per_page = 5
+        total = book.count(status)
+        total_pages = max((total + orders_per_page - 1) // orders_per_page, 1)
+        page = min(max(page, 0), total_pages - 1)
+        start_idx = page * orders_per_page
+        page_orders = book.with_status(status, start_idx, start_idx + orders_per_page)
+
+        text = f"🔍 **{self.FILTER_STATUSES[status]} Orders** (Page {page + 1}/{total_pages})\n\n"
+        text += f"{total} of {book.total_orders} orders\n"
+        if not page_orders:
+            text += "\nNo orders with this status."
+        for i, order in enumerate(page_orders, start_idx + 1):
+            text += self._order_line(i, order)
+
+        keyboard = [self._order_buttons(order) for order in page_orders]
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("⬅️ Previous", callback_data=self.callbacks.encode('filter', status, page - 1)))
+        if page < total_pages - 1:
+            nav.append(InlineKeyboardButton("Next ➡️", callback_data=self.callbacks.encode('filter', status, page + 1)))
+        if nav: keyboard.append(nav)
+        keyboard.extend([
+            [InlineKeyboardButton("🔍 Filter Orders", callback_data="orders_filter"),
+             InlineKeyboardButton("📋 All Orders", callback_data=self.callbacks.encode('orders_page', 0))],
+            [InlineKeyboardButton("🏠 Main Menu", callback_data="menu_main")],
+        ])
+        return text, InlineKeyboardMarkup(keyboard)
 
     async def show_order_details_callback(self, query: Any, order_id: str):
         """Show order details from callback"""
         user_id = query.from_user.id
         order_data = await self.fetch_order(user_id, order_id)
         if not order_data['success']:
-            await query.edit_message_text(
+            await self._reply(
+                query,
                 f"❌ **Order Not Found**\n\n"
                 f"Order ID: `{order_id}`\n"
                 f"Error: {order_data.get('error', 'Order not found')}\n\n"
@@ -1608,14 +4817,29 @@ Filter your orders by status.
                 parse_mode=ParseMode.MARKDOWN
             )
             return
-        await self.show_order_details(query, order_data['order'])
+        await self.show_order_details(query, order_data['order'], order_data.get('version'))
     
-    async def show_order_details(self, update: Update, order: Dict[str, Any]):
+    async def show_order_details(self, update: Update, order: Dict[str, Any], version: Optional[int] = None):
         """Display order details with confirmation buttons"""
+        cache_key = ('order', self._get_user_id(update), version, order.get('id')) if version is not None else None
+        rendered = self.render_cache.get(cache_key) if cache_key else None
+        if rendered is None:
+            rendered = self._render_order_details(order)
+            if cache_key:
+                self.render_cache.put(cache_key, rendered)
+        order_text, reply_markup = rendered
+        await self._reply(
+            update,
+            order_text,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=reply_markup
+        )
+
+    def _render_order_details(self, order: Dict[str, Any]) -> Tuple[str, InlineKeyboardMarkup]:
         order_id = order.get('id', 'Unknown')
         order_number = order.get('order_number', order_id)
         total = order.get('total', 0)
-        status = order.get('status', 'pending')
+        status = UserOrders.status_of(order)
         items = order.get('items', [])
         customer = order.get('customer', {})
         
@@ -1646,25 +4870,12 @@ Filter your orders by status.
         # Create inline keyboard
         keyboard = [
             [
-                InlineKeyboardButton("✅ Confirm Order", callback_data=f"confirm_{order_id}"),
-                InlineKeyboardButton("❌ Cancel Order", callback_data=f"cancel_{order_id}")
+                InlineKeyboardButton("✅ Confirm Order", callback_data=self.callbacks.encode('confirm', order_id)),
+                InlineKeyboardButton("❌ Cancel Order", callback_data=self.callbacks.encode('cancel', order_id))
             ],
             [InlineKeyboardButton("🏠 Main Menu", callback_data="menu_main")]
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        if hasattr(update, 'callback_query') and update.callback_query:
-            await update.callback_query.edit_message_text(
-                order_text,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=reply_markup
-            )
-        else:
-            await update.message.reply_text(
-                order_text,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=reply_markup
-            )
+        return order_text, InlineKeyboardMarkup(keyboard)
     
     async def confirm_order(self, query, user_id: int, order_id: str):
         """Handle order confirmation"""
@@ -1673,7 +4884,8 @@ Filter your orders by status.
         
         if result['success']:
             # Send confirmation to user
-            await query.edit_message_text(
+            await self._reply(
+                query,
                 f"✅ **Order Confirmed!**\n\n"
                 f"Order ID: `{order_id}`\n"
                 f"Status: CONFIRMED\n\n"
@@ -1684,7 +4896,8 @@ Filter your orders by status.
             # Send notification to admin
             await self.notify_admin_order_confirmed(order_id, result.get('order_data'))
         else:
-            await query.edit_message_text(
+            await self._reply(
+                query,
                 f"❌ **Confirmation Failed**\n\n"
                 f"Error: {result.get('error', 'Unknown error')}\n\n"
                 f"Please try again or contact support."
@@ -1695,7 +4908,8 @@ Filter your orders by status.
         result = await self.update_order_status(user_id, order_id, 'cancelled')
         
         if result['success']:
-            await query.edit_message_text(
+            await self._reply(
+                query,
                 f"❌ **Order Cancelled**\n\n"
                 f"Order ID: `{order_id}`\n"
                 f"Status: CANCELLED\n\n"
@@ -1703,21 +4917,25 @@ Filter your orders by status.
                 parse_mode=ParseMode.MARKDOWN
             )
         else:
-            await query.edit_message_text(
+            await self._reply(
+                query,
                 f"❌ **Cancellation Failed**\n\n"
                 f"Error: {result.get('error', 'Unknown error')}\n\n"
                 f"Please try again or contact support."
             )
     
     async def notify_admin_order_confirmed(self, order_id: str, order_data: Dict[str, Any]):
-        """Send notification to admin when order is confirmed"""
+        """Notify admin that an order was confirmed (merged into a digest under load)"""
         if not ADMIN_ID:
             logger.warning("ADMIN_ID not set, cannot send admin notification")
             return
-        
+        await self.admin_digest.add(order_id, order_data or {})
+
+    def _format_admin_order(self, order_id: str, order_data: Dict[str, Any]) -> str:
+        """Single-order admin alert text"""
         customer = order_data.get('customer', {})
         items = order_data.get('items', [])
-        total = order_data.get('total', 0)
+        total = AdminDigest.order_total(order_data)
         
         # Format items for admin
         items_text = ""
@@ -1727,7 +4945,7 @@ Filter your orders by status.
             price = item.get('price', 0)
             items_text += f"• {name} x{quantity} - ${price:.2f}\n"
         
-        admin_text = f"""
+        return f"""
 🔔 **NEW ORDER CONFIRMED**
 
 **Order ID:** `{order_id}`
@@ -1746,18 +4964,56 @@ Filter your orders by status.
 **Action Required:**
 Please process this order and contact the customer.
         """
-        
-        try:
-            await self.application.bot.send_message(
-                chat_id=ADMIN_ID,
-                text=admin_text,
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except Exception as e:
-            logger.error(f"Failed to send admin notification: {e}")
     
-    async def fetch_all_orders(self, user_id: int) -> Dict[str, Any]:
-        """Fetch all orders either using session cookie (login) or telegram link."""
+    async def _ingest_orders(self, user_id: int, orders: List[Dict], payload: bytes) -> UserOrders:
+        """Orders book for a fetched payload; rebuilt (new version) only when the payload changes.
+
+        Hashing the payload, building the book and diffing it against the
+        previous book's search index run on a worker thread.
+        """
+        previous = self.order_books.get(user_id)
+        changes = previous.changes if previous is not None else 0
+
+        def build() -> Tuple[Optional[UserOrders], Any]:
+            digest = hashlib.blake2b(payload, digest_size=16).digest()
+            if previous is not None and previous.digest == digest:
+                return None, None
+            book = UserOrders(orders, digest, 0)
+            return book, book.search_index_delta(previous) if previous is not None else None
+
+        book, delta = await asyncio.get_running_loop().run_in_executor(None, build)
+        if book is None:
+            previous.fetched_at = time.monotonic()
+            return previous
+        self._orders_seq += 1
+        book.version = self._orders_seq
+        # A status change on the previous book while diffing makes the delta stale
+        if delta is not None and previous.changes == changes:
+            book.adopt_search_index(previous, delta)
+        self.order_books.put(user_id, book)
+        return book
+
+    def _apply_status_change(self, user_id: int, order_id: str, status: str) -> None:
+        """Update the cached orders book after a successful status change."""
+        book = self.order_books.get(user_id)
+        if book is None:
+            return
+        if book.set_status(order_id, status):
+            self._orders_seq += 1
+            book.version = self._orders_seq
+        # The next fetch reflects the server's view, so always rebuild from it
+        book.digest = b''
+
+    async def fetch_all_orders(self, user_id: int, max_age: float = 0.0) -> Dict[str, Any]:
+        """Fetch all orders either using session cookie (login) or telegram link.
+
+        With ``max_age`` the locally cached orders are returned without a request
+        if they were fetched less than that many seconds ago.
+        """
+        if max_age > 0:
+            book = self.order_books.get(user_id)
+            if book is not None and book.age() < max_age:
+                return {'success': True, 'orders': book.orders, 'book': book, 'version': book.version}
         try:
             sess = user_sessions.get(user_id) or self.store.get(user_id) or {}
             session_token = sess.get('session_token')
@@ -1771,10 +5027,11 @@ Please process this order and contact the customer.
                 headers = self._make_headers(user_id=user_id, json_content=True, include_webhook_secret=True)
                 url += f'?telegram_user_id={user_id}'
 
-            response = requests.get(url, headers=headers, timeout=15)
+            response = await self._http('GET', url, headers=headers, timeout=15)
             if response.status_code == 200:
                 data = response.json()
-                return {'success': True, 'orders': data.get('orders', [])}
+                book = await self._ingest_orders(user_id, data.get('orders', []), response.content)
+                return {'success': True, 'orders': book.orders, 'book': book, 'version': book.version}
             if response.status_code == 401:
                 return {'success': False, 'error': 'Session expired. Please /login again.'}
             return {'success': False, 'error': f'HTTP {response.status_code}'}
@@ -1796,7 +5053,7 @@ Please process this order and contact the customer.
                 url = urljoin(WEBSITE_URL, '/api/telegram/ensure-session')
                 payload = {'telegramUserId': user_id}
                 headers = self._make_headers(user_id=None, json_content=True, include_webhook_secret=True)
-                response = requests.post(url, json=payload, headers=headers, timeout=15)
+                response = await self._http('POST', url, json=payload, headers=headers, timeout=15)
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -1832,7 +5089,7 @@ Please process this order and contact the customer.
                 'User-Agent': 'KYCut-Bot/2.0'
             }
             
-            response = requests.post(url, json=payload, headers=headers, timeout=15)
+            response = await self._http('POST', url, json=payload, headers=headers, timeout=15)
             
             if response.status_code == 200:
                 data = response.json()
@@ -1904,7 +5161,7 @@ Please process this order and contact the customer.
                 'telegramUsername': telegram_username
             }
             headers = self._make_headers(user_id=None, json_content=True, include_webhook_secret=True)
-            response = requests.post(url, json=payload, headers=headers, timeout=15)
+            response = await self._http('POST', url, json=payload, headers=headers, timeout=15)
             
             if response.status_code == 200:
                 data = response.json()
@@ -1981,10 +5238,11 @@ Please process this order and contact the customer.
             # build headers using helper to inject Authorization if available
             headers = self._make_headers(user_id=user_id, json_content=True, include_webhook_secret=True)
             headers['Cookie'] = f'session={session_token}'
-            response = requests.patch(url, json=payload, headers=headers, timeout=15)
+            response = await self._http('PATCH', url, json=payload, headers=headers, timeout=15)
             
             if response.status_code == 200:
                 data = response.json()
+                self._apply_status_change(user_id, order_id, status)
                 return {
                     'success': True,
                     'order_data': data
@@ -2025,20 +5283,13 @@ Please process this order and contact the customer.
             
             headers = self._make_headers(user_id=user_id, json_content=False, include_webhook_secret=True)
             headers['Cookie'] = f'session={session_token}'
-            response = requests.get(url, headers=headers, timeout=15)
+            response = await self._http('GET', url, headers=headers, timeout=15)
             
             if response.status_code == 200:
                 data = response.json()
                 # Find the specific order by ID or order number
-                orders = data.get('orders', [])
-                order = None
-                
-                for o in orders:
-                    if (o.get('id') == order_id or 
-                        o.get('order_number') == order_id or
-                        str(o.get('id')) == order_id):
-                        order = o
-                        break
+                book = await self._ingest_orders(user_id, data.get('orders', []), response.content)
+                order = book.get(order_id)
                 
                 if order:
                     # Transform order data to expected format
@@ -2046,7 +5297,7 @@ Please process this order and contact the customer.
                         'id': order.get('id'),
                         'order_number': order.get('order_number', order.get('id')),
                         'total': float(order.get('total_amount', 0)),
-                        'status': order.get('status', 'pending'),
+                        'status': UserOrders.status_of(order),
                         'items': [],
                         'customer': {
                             'name': order.get('customer_name', 'N/A'),
@@ -2066,7 +5317,8 @@ Please process this order and contact the customer.
                     
                     return {
                         'success': True,
-                        'order': transformed_order
+                        'order': transformed_order,
+                        'version': book.version
                     }
                 else:
                     return {
@@ -2091,30 +5343,322 @@ Please process this order and contact the customer.
                 'error': f"Connection error: {str(e)}"
             }
 
+    def refresh_sessions(self) -> None:
+        """Standby: re-read sessions the leader persisted, at most once per lease period."""
+        if time.monotonic() - self._sessions_loaded_at < LEASE_SECONDS:
+            return
+        self._sessions_loaded_at = time.monotonic()
+        try:
+            user_sessions.update(self.store.load_all())
+        except Exception as e:
+            logger.error(f"Failed to refresh persisted sessions: {e}")
+
+    def _admit_update(self, update: object) -> Optional['asyncio.Future[bool]']:
+        update_id = getattr(update, 'update_id', None)
+        if update_id is None:
+            return None
+
+        def log_refusal(admitted: asyncio.Future) -> None:
+            if not admitted.cancelled() and admitted.exception() is None and not admitted.result():
+                logger.info("Skipping update %s: already handled or the polling lease was lost", update_id)
+
+        admitted = self.lease.admit_async(update_id)
+        admitted.add_done_callback(log_refusal)
+        return admitted
+
+    async def _maintain_callback_state(self) -> None:
+        """Write new callback tokens every few seconds and prune expired ones hourly."""
+        loop = asyncio.get_running_loop()
+        pruned_at = time.monotonic()
+        while True:
+            await asyncio.sleep(CallbackRouter.FLUSH_SECONDS)
+            try:
+                await loop.run_in_executor(self._http_pool, self.callbacks.flush)
+                if time.monotonic() - pruned_at >= CallbackRouter.PRUNE_SECONDS:
+                    pruned_at = time.monotonic()
+                    await loop.run_in_executor(self._http_pool, self.callbacks.prune)
+            except sqlite3.Error as e:
+                logger.error("Could not save callback state: %s", e)
+
+    async def _renew_lease(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.lease.ttl / 3)
+            try:
+                held = await loop.run_in_executor(self._http_pool, self.lease.try_acquire)
+            except sqlite3.Error as e:
+                logger.error("Could not renew the polling lease: %s", e)
+                continue
+            if not held:
+                logger.error("Polling lease taken over by %s; stopping", self.lease.current_holder())
+                if self._stopping is None:
+                    self._begin_shutdown("Polling lease lost")
+                return
+
+    def _register_gauges(self) -> None:
+        """Scrape-time gauges over state the bot already tracks."""
+        caches = {'render': self.render_cache, 'sent_digests': self.sent_digests,
+                  'order_books': self.order_books, 'callback_state': self.callbacks._state}
+        METRICS.collector('kycut_cache_hit_ratio', 'Hit ratio of in-memory caches', ('cache',),
+                          lambda: (((name,), c.stats()['hit_ratio']) for name, c in caches.items()))
+        METRICS.collector('kycut_cache_lookups_total', 'Cache lookups by result', ('cache', 'result'),
+                          lambda: [sample for name, c in caches.items()
+                                   for sample in (((name, 'hit'), c.hits), ((name, 'miss'), c.misses))],
+                          kind='counter')
+        METRICS.collector('kycut_cache_entries', 'Entries held by in-memory caches', ('cache',),
+                          lambda: (((name,), len(c)) for name, c in caches.items()))
+        METRICS.collector('kycut_outbound_pending', 'Messages queued or in flight to Telegram', (),
+                          lambda: [((), self.outbound.pending())])
+        METRICS.collector('kycut_updates_in_flight', 'Updates being handled', (),
+                          lambda: [((), self.application.update_processor.in_flight)])
+        METRICS.collector('kycut_callbacks_total',
+                          'Inline button work: taps started, run inline, cancelled by a newer tap, stale edits dropped',
+                          ('outcome',), lambda: [((k,), v) for k, v in self.callback_stats.items()], kind='counter')
+
+    def _spawn_background(self, coro) -> asyncio.Task:
+        """Run startup/maintenance work alongside update handling, keeping a reference."""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _warm_up(self) -> None:
+        """Deferred, non-critical startup work, run in parallel after polling begins."""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        steps = {
+            'requests import': self._requests_loaded,
+            'analytics tables': loop.run_in_executor(self._http_pool, self.store.init_analytics),
+            'legacy tables': loop.run_in_executor(self._http_pool, self._db_init),
+        }
+        results = await asyncio.gather(*steps.values(), return_exceptions=True)
+        for name, result in zip(steps, results):
+            if isinstance(result, Exception):
+                logger.error("Warm-up step %s failed: %s", name, result)
+        logger.debug("Warm-up finished in %.0f ms", (time.perf_counter() - started) * 1000)
+        await self._test_api_connectivity()
+
     async def _on_start(self, app: Application) -> None:
-        # Schedule once the application is actually running
-        async def _kickoff_async(context):
+        # Connectivity test and non-critical setup run in the background so
+        # polling starts right away (app.job_queue may be None without the extra)
+        self._requests_loaded = asyncio.get_running_loop().run_in_executor(self._http_pool, lambda: requests.Session)
+        self._spawn_background(self._warm_up())
+        self._spawn_background(self._maintain_callback_state())
+        app.update_processor.on_arrival = self._supersede_callbacks
+        if self.lease is not None:
+            app.update_processor.admit = self._admit_update
+            self._spawn_background(self._renew_lease())
+        self.watchdog.start()
+        if METRICS_PORT:
+            port = METRICS_PORT + (self.shard[0] if self.shard else 0)
+            try:
+                self.metrics_server = MetricsServer(METRICS, METRICS_HOST, port)
+                self.metrics_server.start()
+            except OSError as e:
+                logger.error("Could not start metrics endpoint on %s:%s: %s", METRICS_HOST, port, e)
+
+        self.error_throttle.start(lambda summary: ADMIN_ID and self._send_message(ADMIN_ID, summary))
+
+        # Resume delivering queued notifications and accept new batches
+        # (with shard workers, only worker 0 runs the notification queue)
+        self.admin_digest.start()
+        if self.shard is None or self.shard[0] == 0:
+            self.notifications.start()
+            if NOTIFY_PORT:
+                try:
+                    self.notify_server = NotificationIngestServer(self.notifications, NOTIFY_HOST, NOTIFY_PORT)
+                    self.notify_server.start()
+                except OSError as e:
+                    logger.error("Could not start notification intake on %s:%s: %s", NOTIFY_HOST, NOTIFY_PORT, e)
+
+        # Own the stop signals so a shutdown can drain first (run_polling gets stop_signals=None)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._on_stop_signal, sig)
+            except (NotImplementedError, RuntimeError):
+                # Windows: Ctrl+C raises KeyboardInterrupt and run_polling still calls _on_stop
+                break
+
+    def _on_stop_signal(self, sig: signal.Signals) -> None:
+        self._begin_shutdown(f"{sig.name} received")
+
+    def _begin_shutdown(self, reason: str) -> None:
+        if self._stopping is not None:
+            logger.warning("%s again: stopping without waiting for in-flight work", reason)
+            self._shutdown_deadline = time.monotonic()
+            self.application.stop_running()
+            return
+        logger.info("%s: finishing in-flight work (up to %gs) before stopping", reason, SHUTDOWN_TIMEOUT)
+        self._shutdown_started = time.monotonic()
+        self._shutdown_deadline = self._shutdown_started + SHUTDOWN_TIMEOUT
+        self._stopping = self._spawn_background(self._stop_intake())
+
+    async def _stop_intake(self) -> None:
+        """Stop taking new work, let in-flight handlers finish, then stop the application."""
+        try:
+            if self.notify_server:
+                await asyncio.get_running_loop().run_in_executor(None, self.notify_server.stop)
+                self.notify_server = None
+            if self.application.updater and self.application.updater.running:
+                await self.application.updater.stop()
+            await self._wait_for_handlers(self._shutdown_deadline)
+        except Exception as e:
+            logger.error("Error while stopping intake: %s", e)
+        finally:
+            self.application.stop_running()
+
+    async def _wait_for_handlers(self, deadline: float) -> None:
+        """Wait for queued and running updates until `deadline`, then cancel what is left."""
+        processor = self.application.update_processor
+        seen: set = set()
+        while True:
+            active = processor.active_tasks()
+            seen |= active
+            remaining = deadline - time.monotonic()
+            if (not active and self.application.update_queue.empty()) or remaining <= 0:
+                break
+            if active:
+                await asyncio.wait(active, timeout=min(remaining, 0.1))
+            else:
+                await asyncio.sleep(min(remaining, 0.02))
+        for task in active:
+            task.cancel()
+        if active:
+            await asyncio.gather(*active, return_exceptions=True)
+        self.drain_report['handlers_finished'] += len(seen) - len(active)
+        self.drain_report['handlers_cancelled'] += len(active)
+
+    async def _on_stop(self, app: Application) -> None:
+        """Flush buffered sends and state after the application stops; log what was dropped."""
+        if self._shutdown_deadline is None:
+            # Stopped without our signal handler (e.g. KeyboardInterrupt on Windows)
+            self._shutdown_started = time.monotonic()
+            self._shutdown_deadline = self._shutdown_started + SHUTDOWN_TIMEOUT
+        deadline = self._shutdown_deadline
+        report = self.drain_report
+
+        def left() -> float:
+            return max(0.0, deadline - time.monotonic())
+
+        if self.notify_server:
+            await asyncio.get_running_loop().run_in_executor(None, self.notify_server.stop)
+            self.notify_server = None
+        await self._wait_for_handlers(deadline)
+        for task in list(self._background_tasks):
+            task.cancel()
+
+        # Undelivered notifications stay queued in SQLite and resume on the next start
+        try:
+            await asyncio.wait_for(self.notifications.stop(), timeout=left())
+        except asyncio.TimeoutError:
+            logger.warning("Notification deliveries still in flight at shutdown; they will be retried")
+        summary = self.error_throttle.stop()
+        if summary and ADMIN_ID:
+            self._send_message(ADMIN_ID, summary)
+        try:
+            report['digest_parked'] = await asyncio.wait_for(self.admin_digest.close(), timeout=left())
+        except asyncio.TimeoutError:
+            report['digest_parked'] = len(self.admin_digest._pending())
+
+        sent_before = self.outbound.sent
+        await self.outbound.drain(left())
+        report['outbound_sent'] = self.outbound.sent - sent_before
+        report['outbound_dropped'] = self.outbound.pending()
+        await self.outbound.close()
+        try:
+            report['notifications_queued'] = self.notifications.stats()['pending']
+        except Exception:
+            pass
+
+        self.watchdog.stop()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._http_pool, self.callbacks.flush)
+        except sqlite3.Error as e:
+            logger.error("Could not save callback state: %s", e)
+        if self.lease is not None and self.lease.held:
+            self.lease.release()
+        if self.metrics_server:
+            await asyncio.get_running_loop().run_in_executor(None, self.metrics_server.stop)
+            self.metrics_server = None
+        self._checkpoint()
+        report['elapsed_ms'] = round((time.monotonic() - self._shutdown_started) * 1000)
+        dropped = report['handlers_cancelled'] or report['outbound_dropped']
+        logger.log(logging.WARNING if dropped else logging.INFO, "Shutdown drain: %s", report)
+
+    def _checkpoint(self) -> None:
+        """Commit and close the SQLite connections and the HTTP pool."""
+        for owner in (self.store, self.callbacks, self.notifications, self.admin_digest, self.lease):
+            conn = getattr(owner, 'conn', None)
+            if conn is None:
+                continue
+            try:
+                with owner.lock:
+                    conn.commit()
+                    conn.close()
+            except sqlite3.Error as e:
+                logger.error("Could not close %s database: %s", type(owner).__name__, e)
+        self._http_pool.shutdown(wait=False, cancel_futures=True)
+
+    def run_shard(self, conn) -> None:
+        """Serve updates received from the ingress process over `conn` until stopped.
+
+        Mirrors Application.run_polling (post_init, start, run_forever, then the
+        stop/post_stop/shutdown sequence) with updates read from the pipe.
+        """
+        app = self.application
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(app.initialize())
+            loop.run_until_complete(self._on_start(app))
+            loop.run_until_complete(app.start())
+            threading.Thread(target=self._read_shard_updates, args=(conn, loop),
+                             name='kycut-shard-reader', daemon=True).start()
+            loop.run_forever()
+        finally:
+            if app.running:
+                loop.run_until_complete(app.stop())
+                loop.run_until_complete(self._on_stop(app))
+            loop.run_until_complete(app.shutdown())
+            loop.close()
+
+    def _read_shard_updates(self, conn, loop: asyncio.AbstractEventLoop) -> None:
+        """Reader thread: put updates from the ingress pipe on the update queue, in order."""
+        app = self.application
+        while True:
             try:
-                await self._test_api_connectivity()
+                raw = conn.recv_bytes()
+            except (EOFError, OSError):
+                break
+            if not raw:
+                # Empty message: the ingress is shutting down
+                break
+            try:
+                update = Update.de_json(json.loads(raw), app.bot)
             except Exception as e:
-                logger.error("_kickoff_async failed: %s", e)
+                logger.error("Dropping update the ingress sent that could not be decoded: %s", e)
+                continue
+            loop.call_soon_threadsafe(app.update_queue.put_nowait, update)
+        loop.call_soon_threadsafe(lambda: self._stopping is None and self._begin_shutdown("Ingress closed the pipe"))
 
-        # Run immediately after startup tick
-        app.job_queue.run_once(lambda ctx: app.create_task(_kickoff_async(ctx)), when=timedelta(seconds=0))
-        
     async def on_error(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Enhanced error handler with better logging"""
-        import traceback
+        """Error handler: full report once per distinct error and window, counts for repeats"""
+        err = getattr(context, 'error', context)
+        first, entry = self.error_throttle.record(err)
+        if not first:
+            # Repeats are summarised when the window closes; keep this path cheap
+            logger.debug("Repeated error %s (%s in window)", entry['where'][0], entry['count'])
+            return
 
         # Log basic error
         try:
-            logger.error("Exception while handling an update: %s", getattr(context, 'error', context))
+            logger.error("Exception while handling an update: %s", err)
         except Exception:
             logger.error("Exception while handling an update (unknown error)")
 
         # Detailed traceback for debugging
         try:
-            err = getattr(context, 'error', context)
             tb = ''.join(traceback.format_exception(type(err), err, getattr(err, '__traceback__', None)))
             logger.error("Full traceback:\n%s", tb)
         except Exception as e:
@@ -2139,33 +5683,217 @@ Please process this order and contact the customer.
         except Exception:
             logger.debug("Failed to extract user info from update for error logging")
 
-        # Send admin notification without awaiting (non-blocking)
+        # Queue admin notification without awaiting (non-blocking)
+        if ADMIN_ID:
+            try:
+                name, filename, lineno, func = entry['where']
+                text = (
+                    f"🚨 Bot Error `{name}` at `{filename}:{lineno}`:\n```\n{str(err)[:1000]}\n```\n"
+                    f"Repeats in the next {self.error_throttle.window_seconds / 60:g} min will be summarised."
+                )
+                self._send_message(ADMIN_ID, text, parse_mode=ParseMode.MARKDOWN)
+            except Exception as e:
+                logger.debug("Failed to queue admin notification: %s", e)
+
+def run_worker(index: int, count: int, conn) -> None:
+    """Entry point of a shard worker process (started by ShardIngress)."""
+    setup_logging(f'.w{index}')
+    KYCutBot(shard=(index, count)).run_shard(conn)
+
+
+class _ShardWorker:
+    __slots__ = ('index', 'process', 'conn', 'writer', 'forwarded')
+
+    def __init__(self, index: int, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        # One writer thread per worker keeps sends in order without blocking the poll loop
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'kycut-shard-{index}')
+        self.forwarded = 0
+
+
+class ShardIngress:
+    """Polls Telegram in one process and routes each update to one of `count` workers.
+
+    The shard is the update's user id (chat id if it has no user) modulo `count`,
+    so one user's updates always reach the same worker, in the order Telegram
+    sent them, and the worker's PerUserUpdateProcessor keeps them in order from
+    there. Each worker runs a full KYCutBot without an updater and owns the
+    sessions, caches and send queue for its users. Updates travel as JSON over
+    a one-way multiprocessing pipe. A worker that exits is restarted.
+    """
+
+    def __init__(self, count: int, lease: Optional[LeaderLease] = None):
+        import multiprocessing
+        self.count = count
+        self.ctx = multiprocessing.get_context('spawn')
+        self.workers: List[_ShardWorker] = []
+        self.dropped = 0
+        self.skipped = 0
+        self._stopping = False
+        self._stop: Optional[asyncio.Event] = None
+        # With a lease the ingress polls only while it is the leader (see LeaderLease)
+        self.lease = lease
+        self.lockfile = os.path.join(os.getcwd(), '.kycut_bot.pid')
+        self.lockfile_fd = None if lease else acquire_instance_lock(self.lockfile)
+
+    @staticmethod
+    def shard_key(data: Dict[str, Any]) -> Optional[int]:
+        """User id of an update dict (chat id as a fallback), like PerUserUpdateProcessor._update_key."""
+        chat_id = None
+        for value in data.values():
+            if not isinstance(value, dict):
+                continue
+            user = value.get('from') or value.get('user')
+            if isinstance(user, dict) and 'id' in user:
+                return int(user['id'])
+            chat = value.get('chat') or (value.get('message') or {}).get('chat')
+            if chat_id is None and isinstance(chat, dict) and 'id' in chat:
+                chat_id = int(chat['id'])
+        return chat_id
+
+    def shard_of(self, data: Dict[str, Any]) -> int:
+        key = self.shard_key(data)
+        return key % self.count if key is not None else 0
+
+    def _spawn(self, index: int) -> _ShardWorker:
+        recv_conn, send_conn = self.ctx.Pipe(duplex=False)
+        process = self.ctx.Process(target=run_worker, args=(index, self.count, recv_conn), name=f'kycut-shard-{index}')
+        process.start()
+        recv_conn.close()
+        logger.info("Started shard worker %s/%s (pid %s)", index, self.count, process.pid)
+        return _ShardWorker(index, process, send_conn)
+
+    def _send(self, worker: _ShardWorker, payload: bytes) -> None:
         try:
-            bot_obj = getattr(context, 'bot', None) or (self.application.bot if hasattr(self, 'application') else None)
-            if bot_obj:
-                text = f"🚨 Bot Error:\n```\n{str(getattr(context,'error',''))[:1000]}\n```"
-                # Schedule send as a background task to avoid raising inside the handler
-                try:
-                    asyncio.create_task(bot_obj.send_message(chat_id=ADMIN_ID, text=text, parse_mode=ParseMode.MARKDOWN))
-                except Exception as e:
-                    logger.debug("Failed to schedule admin notification: %s", e)
-        except Exception:
-            logger.debug("Admin notification skipped due to missing bot object")
+            worker.conn.send_bytes(payload)
+        except (OSError, ValueError) as e:
+            self.dropped += 1
+            logger.error("Update for shard %s dropped: %s", worker.index, e)
+
+    async def forward(self, update: Update) -> None:
+        if self.lease is not None and not await self.lease.admit_async(update.update_id):
+            self.skipped += 1
+            logger.info("Skipping update %s: already handled or the polling lease was lost", update.update_id)
+            return
+        data = update.to_dict()
+        worker = self.workers[self.shard_of(data)]
+        worker.forwarded += 1
+        worker.writer.submit(self._send, worker, json.dumps(data).encode())
+
+    async def _supervise(self) -> None:
+        renew_every = self.lease.ttl / 3 if self.lease else 0
+        renewed = time.monotonic()
+        while not self._stopping:
+            await asyncio.sleep(1)
+            if self.lease and time.monotonic() - renewed >= renew_every:
+                renewed = time.monotonic()
+                if not self.lease.try_acquire():
+                    logger.error("Polling lease taken over by %s; stopping", self.lease.current_holder())
+                    self._stop.set()
+                    return
+            for i, worker in enumerate(self.workers):
+                if not worker.process.is_alive() and not self._stopping:
+                    logger.error("Shard worker %s exited with code %s; restarting", i, worker.process.exitcode)
+                    worker.writer.shutdown(wait=False)
+                    worker.conn.close()
+                    self.workers[i] = self._spawn(i)
+
+    async def _serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        stop = self._stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                break
+        bot = Bot(BOT_TOKEN, base_url=TELEGRAM_API_BASE_URL) if TELEGRAM_API_BASE_URL else Bot(BOT_TOKEN)
+        updates: asyncio.Queue = asyncio.Queue()
+        updater = Updater(bot, updates)
+        async with updater:
+            await updater.start_polling(allowed_updates=Update.ALL_TYPES,
+                                        drop_pending_updates=DROP_PENDING_UPDATES and self.lease is None)
+            supervisor = loop.create_task(self._supervise())
+            stopped = loop.create_task(stop.wait())
+            while True:
+                getter = loop.create_task(updates.get())
+                await asyncio.wait((getter, stopped), return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    break
+                await self.forward(getter.result())
+            self._stopping = True
+            supervisor.cancel()
+            await updater.stop()
+            while not updates.empty():
+                await self.forward(updates.get_nowait())
+
+    def run(self) -> None:
+        # Workers start before the lease is ours, so a standby takes over with warm workers
+        self.workers = [self._spawn(i) for i in range(self.count)]
+        try:
+            if self.lease:
+                self.lease.wait()
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stopping = True
+            self.stop_workers()
+            if self.lease and self.lease.held:
+                self.lease.release()
+
+    def stop_workers(self) -> None:
+        """Tell each worker to drain and exit (see KYCutBot._on_stop), then wait for it."""
+        for worker in self.workers:
+            worker.writer.submit(self._send, worker, b'')
+            worker.writer.shutdown(wait=True)
+            worker.conn.close()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT + 10
+        for worker in self.workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logger.warning("Shard worker %s did not stop in time; terminating", worker.index)
+                worker.process.terminate()
+                worker.process.join(5)
+        logger.info("Ingress stopped: forwarded %s, dropped %s, skipped %s",
+                    {w.index: w.forwarded for w in self.workers}, self.dropped, self.skipped)
+
 
 # Enhanced main function with better startup handling
 def main():
     """Enhanced main function with better startup handling"""
+    setup_logging()
+    # Fail fast if bot token is not provided via env or .env
+    if not BOT_TOKEN:
+        print("Error: TELEGRAM BOT TOKEN is not set. Please set BOT_TOKEN or TELEGRAM_BOT_TOKEN in the environment or .env file.")
+        sys.exit(1)
     logger.info("🚀 Starting Enhanced KYCut Telegram Bot...")
     
+    # Standby instances must not drop what arrived while the old leader was down
+    lease = LeaderLease(DB_PATH) if BOT_STANDBY else None
+    drop_pending = DROP_PENDING_UPDATES and lease is None
+    if BOT_WORKERS > 1:
+        logger.info("🔀 Polling in this process, handling updates in %s worker processes", BOT_WORKERS)
+        ShardIngress(BOT_WORKERS, lease).run()
+        return
+
     try:
         bot = KYCutBot()
         logger.info("✅ Bot initialized successfully")
-        
+        if lease is not None:
+            # Blocks while another instance holds the lease; keeps sessions current meanwhile
+            lease.wait(bot.refresh_sessions)
+            bot.lease = lease
+
         # Start the bot
         logger.info("🔄 Starting bot polling...")
         bot.application.run_polling(
             allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
+            drop_pending_updates=drop_pending,
+            # SIGINT/SIGTERM are handled by the bot so in-flight work can drain
+            stop_signals=None,
         )
         
     except KeyboardInterrupt:
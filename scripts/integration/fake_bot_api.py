@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""Offline end-to-end benchmark of kycut_telegram_bot.py against a fake Bot API.
+
+FakeBotAPI serves getMe, getUpdates (long polling, offsets), sendMessage,
+editMessageText, answerCallbackQuery and deleteWebhook from this process;
+any other method succeeds with ``true``. The bot runs unmodified in a child
+process, pointed at it through TELEGRAM_API_BASE_URL, so every update takes
+the real path: getUpdates, the bot's update processor, the handler, the
+website API and the outbound queue back to sendMessage or editMessageText.
+
+Updates are injected open-loop at --rate per second. Each one goes to a
+simulated user with nothing in flight, who steps through --script: commands
+(with {code}, {order} and {user} filled in per user) and ``tap:TEXT`` steps
+that press a button containing TEXT (``tap:*`` for any) on the last message
+the bot showed that user. A tap with no such button on screen is skipped.
+When every user is waiting on a reply the update is not sent and counts as
+skipped, so raise --users to push the rate further.
+
+Users talk to the bot from group chats: the bot's replies there quote the
+command, which ties each sendMessage to its update. A tap's reply is the
+edit of the tapped message. Latency is update-to-reply: from queueing the
+update here until the first reply to it reaches this server. An update with
+no reply within --timeout counts as unanswered (a tap that would leave the
+message unchanged is never edited, so it ends up here too).
+
+By default mock_api.py is started in a child process as the website API,
+seeded with one user per simulated user; --api-url targets another one.
+The bot's send rate limits are lifted unless BOT_SEND_* is set, since
+Telegram's limits would hide everything else.
+
+Run: python3 scripts/integration/fake_bot_api.py --rate 50 --duration 30 --users 200
+     python3 scripts/integration/fake_bot_api.py --script "/start,/help" --rate 200 --json help.json
+"""
+import argparse
+import importlib.util
+import json
+import math
+import multiprocessing
+import os
+import random
+import shlex
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BOT = os.path.normpath(os.path.join(HERE, '..', 'TELEGRAM-BOT', 'kycut_telegram_bot.py'))
+MOCK_PATH = os.path.join(HERE, 'mock_api.py')
+
+TOKEN = '123456:fake-bot-api'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+DEFAULT_SCRIPT = '/start,/link {code},/orders,tap:Next,tap:Previous,/stats,/search pending,/order {order},tap:*,/help'
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def serve_mock(conn, argv):
+    """Child process: mock_api.py on a free port, reported back over `conn`."""
+    mock = load_module('mock_api', MOCK_PATH)
+    server = mock.make_server(mock.parse_args(argv))
+    conn.send(server.server_address[1])
+    conn.close()
+    server.serve_forever()
+
+
+def mock_stats(api_url):
+    """Request counters of a mock_api.py server, or None for any other API."""
+    try:
+        with urllib.request.urlopen(api_url.rstrip('/') + '/__mock/stats', timeout=5) as r:
+            return json.loads(r.read())
+    except (OSError, ValueError):
+        return None
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted `values`."""
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def is_error_reply(text):
+    # Failures start with ❌; so does the (successful) cancellation notice
+    first = text.lstrip().split('\n', 1)[0]
+    return first.startswith('❌') and 'Order Cancelled' not in first
+
+
+class FakeBotAPI(ThreadingHTTPServer):
+    """The Bot API methods the bot uses, plus update injection and reply bookkeeping.
+
+    Injected updates carry a record dict; the first sendMessage quoting the
+    update's message (or editMessageText of the tapped message) sets its
+    'replied' time and appends it to `completed`. Later replies to the same
+    update only count towards `extra`.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _Handler)
+        self.ready = threading.Condition()
+        self.updates = []
+        self.next_update_id = 1
+        self.message_ids = defaultdict(int)
+        # (chat_id, message_id) -> record of the update whose reply it would be
+        self.waiting = {}
+        self.callbacks = {}
+        # chat_id -> last message the bot sent or edited there
+        self.screens = {}
+        self.completed = deque()
+        self.answers = []
+        self.calls = Counter()
+        self.polls = 0
+        self.polled_updates = 0
+        self.dropped = 0
+        self.extra = 0
+        self.unattributed = 0
+        self.polled = threading.Event()
+
+    def handle_error(self, request, client_address):
+        # Long polls cut short when the bot process is stopped
+        pass
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/bot'
+
+    def _message_id(self, chat_id):
+        self.message_ids[chat_id] += 1
+        return self.message_ids[chat_id]
+
+    def _queue(self, update, record):
+        update['update_id'] = self.next_update_id
+        self.next_update_id += 1
+        record['sent'] = time.perf_counter()
+        self.updates.append(update)
+        self.ready.notify_all()
+
+    def inject_message(self, user, chat_id, text, record):
+        """Queue a text message from `user` (a Bot API User dict) in group chat `chat_id`."""
+        with self.ready:
+            message = {'message_id': self._message_id(chat_id), 'date': int(time.time()), 'text': text,
+                       'chat': {'id': chat_id, 'type': 'group', 'title': f'Bench {user["id"]}'}, 'from': user}
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+            self.waiting[(chat_id, message['message_id'])] = record
+            self._queue({'message': message}, record)
+
+    def inject_callback(self, user, message, data, record):
+        """Queue a tap by `user` on a button with `data` under the bot's `message`."""
+        with self.ready:
+            query_id = str(self.next_update_id)
+            self.callbacks[query_id] = record
+            self.waiting[(message['chat']['id'], message['message_id'])] = record
+            self._queue({'callback_query': {'id': query_id, 'from': user, 'chat_instance': str(message['chat']['id']),
+                                            'data': data, 'message': message}}, record)
+
+    def screen(self, chat_id):
+        with self.ready:
+            return self.screens.get(chat_id)
+
+    def take_updates(self, offset, limit, timeout):
+        with self.ready:
+            if offset:
+                # Everything below the offset is confirmed
+                self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            if not self.updates and timeout > 0:
+                self.ready.wait(timeout)
+            batch = self.updates[:limit]
+            self.polls += 1
+            self.polled_updates += len(batch)
+        self.polled.set()
+        return batch
+
+    def drop_pending(self):
+        with self.ready:
+            self.dropped += len(self.updates)
+            self.updates = []
+
+    def answered(self, query_id):
+        with self.ready:
+            record = self.callbacks.pop(query_id, None)
+            if record is not None:
+                self.answers.append(time.perf_counter() - record['sent'])
+
+    def reply(self, chat_id, message_id, text, reply_markup, quoted=None):
+        """Record a message the bot sent (`quoted` set) or edited, and attribute it to an update."""
+        now = time.perf_counter()
+        with self.ready:
+            if message_id is None:
+                message_id = self._message_id(chat_id)
+            message = {'message_id': message_id, 'date': int(time.time()), 'text': text, 'from': BOT_USER,
+                       'chat': {'id': chat_id, 'type': 'group', 'title': 'Bench'}}
+            if reply_markup:
+                message['reply_markup'] = reply_markup
+            self.screens[chat_id] = message
+            record = self.waiting.get((chat_id, quoted if quoted is not None else message_id))
+            if record is None:
+                self.unattributed += 1
+            elif 'replied' in record:
+                self.extra += 1
+            else:
+                record['replied'] = now
+                record['error'] = is_error_reply(text)
+                self.completed.append(record)
+        return message
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _params(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            return json.loads(body or '{}')
+        return {k: v[0] for k, v in parse_qs(body).items()}
+
+    @staticmethod
+    def _object(value):
+        # Form-encoded requests carry nested objects as JSON strings
+        return json.loads(value) if isinstance(value, str) else value
+
+    def _send(self, result):
+        payload = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        api = self.server
+        method = self.path.rsplit('/', 1)[-1]
+        params = self._params()
+        api.calls[method] += 1
+        if method == 'getMe':
+            self._send(BOT_USER)
+        elif method == 'getUpdates':
+            self._send(api.take_updates(int(params.get('offset') or 0), int(params.get('limit') or 100),
+                                        float(params.get('timeout') or 0)))
+        elif method == 'sendMessage':
+            quoted = self._object(params.get('reply_parameters')) or {}
+            self._send(api.reply(int(params['chat_id']), None, params.get('text', ''),
+                                 self._object(params.get('reply_markup')),
+                                 quoted=quoted.get('message_id') or params.get('reply_to_message_id')))
+        elif method == 'editMessageText':
+            self._send(api.reply(int(params['chat_id']), int(params['message_id']), params.get('text', ''),
+                                 self._object(params.get('reply_markup'))))
+        elif method == 'answerCallbackQuery':
+            api.answered(params.get('callback_query_id'))
+            self._send(True)
+        elif method == 'deleteWebhook':
+            if str(params.get('drop_pending_updates')).lower() == 'true':
+                api.drop_pending()
+            self._send(True)
+        else:
+            self._send(True)
+
+
+class SimulatedUser:
+    def __init__(self, index, user_id, script, orders, seed):
+        self.index = index
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'bench{user_id}'}
+        self.chat_id = -user_id
+        self.script = script
+        self.orders = orders
+        self.rng = random.Random(seed * 1000003 + index)
+        self.step = 0
+
+    def _fill(self, text):
+        return text.format(code=''.join(self.rng.choice(string.ascii_uppercase + string.digits) for _ in range(8)),
+                           order=f'ORD-{self.user["id"]}-{self.rng.randrange(max(1, self.orders))}',
+                           user=self.index)
+
+    def _button(self, screen, wanted):
+        rows = ((screen or {}).get('reply_markup') or {}).get('inline_keyboard') or ()
+        found = [b for row in rows for b in row
+                 if b.get('callback_data') and (wanted == '*' or wanted in b.get('text', ''))]
+        return self.rng.choice(found) if found else None
+
+    def next_update(self, api, stats):
+        """Inject this user's next script step; returns its record."""
+        for _ in range(len(self.script)):
+            step = self.script[self.step % len(self.script)]
+            self.step += 1
+            if step.startswith('tap:'):
+                screen = api.screen(self.chat_id)
+                button = self._button(screen, step[4:])
+                if button is None:
+                    stats.taps_skipped += 1
+                    continue
+                record = {'step': step, 'user': self}
+                api.inject_callback(self.user, screen, button['callback_data'], record)
+                return record
+            record = {'step': step.split()[0], 'user': self}
+            api.inject_message(self.user, self.chat_id, self._fill(step), record)
+            return record
+        raise RuntimeError('script has only taps and none can be made; start it with a command')
+
+
+class Stats:
+    def __init__(self, script):
+        self.steps = list(dict.fromkeys(s if s.startswith('tap:') else s.split()[0] for s in script))
+        self.latencies = defaultdict(list)
+        self.unanswered = Counter()
+        self.errors = Counter()
+        self.sent = 0
+        self.skipped = 0
+        self.taps_skipped = 0
+
+    def record(self, record):
+        self.latencies[record['step']].append(record['replied'] - record['sent'])
+        self.errors[record['step']] += record['error']
+
+    def summary(self, elapsed):
+        rows = {}
+        groups = [(s, self.latencies.get(s, []), self.unanswered[s], self.errors[s]) for s in self.steps]
+        groups.append(('total', [v for _, values, _, _ in groups for v in values],
+                       sum(self.unanswered.values()), sum(self.errors.values())))
+        for step, values, unanswered, errors in groups:
+            if not values and not unanswered:
+                continue
+            values = sorted(values)
+            row = {'count': len(values) + unanswered, 'unanswered': unanswered, 'error_replies': errors,
+                   'per_second': (len(values) + unanswered) / elapsed}
+            if values:
+                row.update({'p50_ms': percentile(values, 0.50) * 1e3, 'p95_ms': percentile(values, 0.95) * 1e3,
+                            'p99_ms': percentile(values, 0.99) * 1e3, 'max_ms': values[-1] * 1e3})
+            rows[step] = row
+        return rows
+
+
+def inject(api, users, stats, rate, duration, timeout):
+    """Open-loop injection for `duration` seconds, then wait out what is still in flight."""
+    idle = deque(users)
+    in_flight = deque()
+    interval = 1.0 / rate
+    started = time.perf_counter()
+    stop_at = started + duration
+    next_at = started
+
+    def settle(now):
+        while api.completed:
+            record = api.completed.popleft()
+            stats.record(record)
+            idle.append(record['user'])
+        while in_flight and ('replied' in in_flight[0] or in_flight[0]['sent'] + timeout < now):
+            record = in_flight.popleft()
+            if 'replied' not in record:
+                record['replied'] = None
+                stats.unanswered[record['step']] += 1
+                idle.append(record['user'])
+
+    while True:
+        now = time.perf_counter()
+        if now >= stop_at:
+            break
+        if now < next_at:
+            time.sleep(min(next_at - now, stop_at - now))
+            continue
+        next_at += interval
+        settle(now)
+        if not idle:
+            stats.skipped += 1
+            continue
+        in_flight.append(idle.popleft().next_update(api, stats))
+        stats.sent += 1
+    elapsed = time.perf_counter() - started
+    while in_flight:
+        settle(time.perf_counter())
+        time.sleep(0.01)
+    settle(time.perf_counter())
+    return elapsed
+
+
+def stop_bot(proc):
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    return proc.returncode
+
+
+def tail(path, limit=2000):
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return f.read()[-limit:]
+
+
+def print_report(args, api_url, elapsed, rows, stats, api, api_stats):
+    print(f"Bot:    {args.bot_path}")
+    print(f"Load:   {args.rate:g} updates/s for {elapsed:.1f} s over {args.users:,} users   seed {args.seed}")
+    print(f"API:    {api_url}" + ('' if args.api_url else f" (mock_api.py, {args.orders} orders per user)"))
+    print(f"\n  {'step':16} {'count':>7} {'no reply':>8} {'❌':>6} {'per s':>7} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for step, row in rows.items():
+        timings = ''.join(f" {row[k]:8.1f}" if k in row else f" {'-':>8}"
+                          for k in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+        print(f"  {step:16} {row['count']:7,} {row['unanswered']:8,} {row['error_replies']:6,} "
+              f"{row['per_second']:7.1f}{timings}")
+    print(f"\nUpdates sent: {stats.sent:,}   skipped, every user busy: {stats.skipped:,}   "
+          f"taps with no button: {stats.taps_skipped:,}")
+    if api.answers:
+        answers = sorted(api.answers)
+        print(f"Callback answers: {len(answers):,}   p50 {percentile(answers, 0.5) * 1e3:.1f} ms   "
+              f"p99 {percentile(answers, 0.99) * 1e3:.1f} ms")
+    print(f"getUpdates polls: {api.polls:,} ({api.polled_updates / max(1, api.polls):.1f} updates each)   "
+          f"further replies: {api.extra:,}   unattributed sends: {api.unattributed:,}")
+    print("Bot API calls: " + ', '.join(f"{m} {n:,}" for m, n in api.calls.most_common()))
+    if api_stats:
+        print(f"Website requests: {api_stats['requests']:,} (at most {api_stats['max_in_flight']} at once)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=50.0, help='updates injected per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of injection')
+    parser.add_argument('--users', type=int, default=200, help='simulated users (one update in flight each)')
+    parser.add_argument('--script', default=DEFAULT_SCRIPT, help=f'comma-separated steps (default {DEFAULT_SCRIPT})')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--orders', type=int, default=20, help='orders seeded per user in the mock API')
+    parser.add_argument('--mock-args', default='', help='extra mock_api.py options (latency, faults)')
+    parser.add_argument('--api-url', help='use this website API instead of starting mock_api.py')
+    parser.add_argument('--bot-path', default=DEFAULT_BOT, help='bot script to run (e.g. an older revision)')
+    parser.add_argument('--timeout', type=float, default=10.0, help='seconds to wait for a reply')
+    parser.add_argument('--startup-timeout', type=float, default=60.0, help='seconds to wait for the first poll')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+    script = [s.strip() for s in args.script.split(',') if s.strip()]
+    if not script or args.rate <= 0 or args.users < 1:
+        parser.error('--script, --rate and --users must be non-empty/positive')
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    mock_api = load_module('mock_api', MOCK_PATH)
+    mock = None
+    api_url = args.api_url
+    if api_url is None:
+        argv = ['--host', '127.0.0.1', '--port', '0', '--users', str(args.users),
+                '--orders-per-user', str(args.orders), '--seed', str(args.seed)] + shlex.split(args.mock_args)
+        mock_api.parse_args(argv)
+        parent, child = multiprocessing.Pipe()
+        mock = multiprocessing.Process(target=serve_mock, args=(child, argv), daemon=True)
+        mock.start()
+        api_url = f'http://127.0.0.1:{parent.recv()}'
+
+    api = FakeBotAPI()
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    users = [SimulatedUser(i, mock_api.USER_BASE + i, script, args.orders, args.seed) for i in range(args.users)]
+    stats = Stats(script)
+
+    with tempfile.TemporaryDirectory(prefix='kycut-e2e-') as tmp:
+        env = dict(os.environ, BOT_TOKEN=TOKEN, TELEGRAM_API_BASE_URL=api.base_url, WEBSITE_URL=api_url,
+                   BOT_LOCAL_DB=os.path.join(tmp, 'bot.db'), ADMIN_ID='0', TELEGRAM_ADMIN_ID='0')
+        for name in ('BOT_SEND_GLOBAL_RATE', 'BOT_SEND_CHAT_RATE', 'BOT_SEND_CHAT_BURST'):
+            env.setdefault(name, '1000000')
+        output = os.path.join(tmp, 'bot.out')
+        with open(output, 'w') as out:
+            proc = subprocess.Popen([sys.executable, args.bot_path], cwd=tmp, env=env, stdout=out, stderr=out)
+        try:
+            deadline = time.perf_counter() + args.startup_timeout
+            while not api.polled.wait(0.2):
+                if proc.poll() is not None or time.perf_counter() > deadline:
+                    print(f"Bot never polled getUpdates; its output:\n{tail(output)}", file=sys.stderr)
+                    return 1
+            elapsed = inject(api, users, stats, args.rate, args.duration, args.timeout)
+        finally:
+            code = stop_bot(proc)
+            api_stats = mock_stats(api_url)
+            if mock is not None:
+                mock.terminate()
+            api.shutdown()
+        if code not in (0, -15):
+            print(f"Bot exited with {code}; its output:\n{tail(output)}", file=sys.stderr)
+
+    rows = stats.summary(elapsed)
+    print_report(args, api_url, elapsed, rows, stats, api, api_stats)
+    if args.json:
+        config = {k: v for k, v in vars(args).items() if k != 'json'}
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'api_url': api_url, 'elapsed': elapsed, 'steps': rows,
+                       'sent': stats.sent, 'skipped': stats.skipped, 'taps_skipped': stats.taps_skipped,
+                       'polls': api.polls, 'dropped': api.dropped, 'unattributed': api.unattributed,
+                       'calls': dict(api.calls), 'api': api_stats}, f, indent=2)
+    return 0 if rows else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""Load generator for kycut_telegram_bot.py against the local mock API.
+
+Runs the bot's handlers in-process for many concurrent virtual users. Each
+user sends /start and /link, then loops over a weighted mix of /orders, page
+taps, Confirm/Cancel taps, /stats, /search, /order and repeated /start or
+/link, with a random think time between actions. /login is available through
+--mix but not in the default mix: a login session carries no bot token, so
+later /order calls would fail. Taps use the buttons of the last message the bot showed
+that user; with none on screen the user sends /orders instead.
+
+Updates go through the bot's own update processor (per-user ordering and the
+BOT_CONCURRENT_UPDATES limit) and every website call is a real HTTP request.
+Only Telegram is replaced, by fake messages that record when a reply lands.
+Latency is update-to-reply: from handing the update to the processor until
+the bot's first reply or edit for it goes out. An action is an error if the
+handler raises, no reply arrives within --timeout, or the reply is an error
+message.
+
+By default mock_api.py is started in a child process on a free port, with
+its seeded users as the virtual users (--orders orders each) and any
+--mock-args, e.g. "--latency lognormal:40:0.5 --throttle-rate 0.02" to see how
+the bot copes with a slow or throttling website. --api-url targets an API that
+is already running instead. Each user's actions, codes and
+think times come from --seed, so runs are repeatable; timings vary.
+
+Run: python3 scripts/integration/load_generator.py --users 1000 --duration 30 --seed 1
+     python3 scripts/integration/load_generator.py --users 200 --json before.json
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import shlex
+import string
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter, defaultdict
+
+# The bot refuses to import without a token; Telegram itself is never contacted.
+os.environ.setdefault('BOT_TOKEN', '0:loadgen')
+os.environ['TELEGRAM_API_BASE_URL'] = 'http://127.0.0.1:9/bot'
+# Admin alerts would be real Bot API sends
+os.environ['ADMIN_ID'] = os.environ['TELEGRAM_ADMIN_ID'] = '0'
+# Telegram's send limits would dominate the numbers and aren't what is measured here
+for name in ('BOT_SEND_GLOBAL_RATE', 'BOT_SEND_CHAT_RATE', 'BOT_SEND_CHAT_BURST'):
+    os.environ.setdefault(name, '1000000')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOT_PATH = os.path.normpath(os.path.join(HERE, '..', 'TELEGRAM-BOT', 'kycut_telegram_bot.py'))
+MOCK_PATH = os.path.join(HERE, 'mock_api.py')
+
+ACTIONS = ('start', 'link', 'orders', 'page', 'confirm', 'cancel', 'stats', 'search', 'order', 'login')
+DEFAULT_MIX = 'start=1,link=1,orders=4,page=4,confirm=1,cancel=1,stats=1,search=1,order=1'
+# Button text each tap looks for on the current message
+BUTTONS = {'page': ('Next ➡️', '⬅️ Previous'), 'confirm': ('✅ Confirm',), 'cancel': ('❌ Cancel',)}
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def serve_mock(conn, argv):
+    """Child process: mock_api.py on a free port, reported back over `conn`."""
+    mock = load_module('mock_api', MOCK_PATH)
+    server = mock.make_server(mock.parse_args(argv))
+    conn.send(server.server_address[1])
+    conn.close()
+    server.serve_forever()
+
+
+def mock_stats(api_url):
+    """Request counters of a mock_api.py server, or None for any other API."""
+    try:
+        with urllib.request.urlopen(api_url.rstrip('/') + '/__mock/stats', timeout=5) as r:
+            return json.loads(r.read())
+    except (OSError, ValueError):
+        return None
+
+
+def parse_mix(text):
+    weights = dict.fromkeys(ACTIONS, 0.0)
+    for part in filter(None, text.split(',')):
+        name, _, weight = part.partition('=')
+        if name.strip() not in weights:
+            raise argparse.ArgumentTypeError(f"unknown action {name!r} (choose from {', '.join(ACTIONS)})")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def is_error_reply(text):
+    # Failures start with ❌; so does the (successful) cancellation notice
+    first = text.lstrip().split('\n', 1)[0]
+    return first.startswith('❌') and 'Order Cancelled' not in first
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted `values`."""
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+class FakeUser:
+    def __init__(self, uid):
+        self.id = uid
+        self.username = f'load{uid}'
+        self.first_name = 'Load'
+        self.is_bot = False
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+        self.type = 'private'
+
+
+class FakeMessage:
+    """A message in a virtual user's chat; replies to it resolve `replied`."""
+
+    def __init__(self, user, message_id, text=None, replied=None):
+        self.user = user
+        self.message_id = message_id
+        self.text = text
+        self.chat = FakeChat(user.uid)
+        self.from_user = user.tg
+        self.replied = replied
+
+    async def reply_text(self, text, **kwargs):
+        return self.user.received(self.replied, None, text, kwargs.get('reply_markup'))
+
+
+class FakeCallbackQuery:
+    def __init__(self, user, data, message, replied):
+        self.id = str(message.message_id)
+        self.user = user
+        self.data = data
+        self.from_user = user.tg
+        self.message = message
+        self.replied = replied
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+    async def edit_message_text(self, text, **kwargs):
+        return self.user.received(self.replied, self.message, text, kwargs.get('reply_markup'))
+
+
+class FakeUpdate:
+    def __init__(self, update_id, user, message=None, callback_query=None):
+        self.update_id = update_id
+        self.effective_user = user.tg
+        self.effective_chat = FakeChat(user.uid)
+        self.message = message
+        self.callback_query = callback_query
+
+
+class FakeContext:
+    def __init__(self, args=()):
+        self.args = list(args)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+
+    def record(self, action, seconds, error=None):
+        self.latencies[action].append(seconds)
+        if error:
+            self.errors[action][error] += 1
+
+    def summary(self, elapsed):
+        rows = {}
+        groups = [(a, self.latencies.get(a, ()), sum(self.errors[a].values())) for a in ACTIONS]
+        groups.append(('total', [v for _, values, _ in groups for v in values], sum(e for _, _, e in groups)))
+        for action, values, errors in groups:
+            if not values:
+                continue
+            values = sorted(values)
+            rows[action] = {
+                'count': len(values),
+                'errors': errors,
+                'error_rate': errors / len(values),
+                'per_second': len(values) / elapsed,
+                'p50_ms': percentile(values, 0.50) * 1e3,
+                'p95_ms': percentile(values, 0.95) * 1e3,
+                'p99_ms': percentile(values, 0.99) * 1e3,
+                'max_ms': values[-1] * 1e3,
+            }
+        return rows
+
+
+class VirtualUser:
+    def __init__(self, runner, index):
+        self.runner = runner
+        self.index = index
+        self.uid = runner.user_base + index
+        self.tg = FakeUser(self.uid)
+        self.rng = random.Random(runner.args.seed * 1000003 + index)
+        self.message_ids = 0
+        # (message, inline keyboard rows) of the last message the bot showed this user
+        self.screen = None
+
+    def _message(self, text=None, replied=None):
+        self.message_ids += 1
+        return FakeMessage(self, self.message_ids, text, replied)
+
+    def received(self, replied, message, text, markup):
+        """The bot replied (message=None) or edited `message`."""
+        if message is None:
+            message = self._message(text)
+        rows = getattr(markup, 'inline_keyboard', None)
+        self.screen = (message, rows) if rows else None
+        if replied is not None and not replied.done():
+            replied.set_result((text, time.perf_counter()))
+        return message
+
+    def _button(self, action):
+        if self.screen is None:
+            return None
+        labels = BUTTONS[action]
+        found = [b for row in self.screen[1] for b in row if b.text in labels and b.callback_data]
+        if action == 'page':
+            # Prefer paging forward, like someone reading through their orders
+            found.sort(key=lambda b: labels.index(b.text))
+            return found[0] if found else None
+        return self.rng.choice(found) if found else None
+
+    def _link_code(self):
+        return ''.join(self.rng.choice(string.ascii_uppercase + string.digits) for _ in range(8))
+
+    def _order_number(self):
+        # The mock's numbering for seeded users
+        return f'ORD-{self.uid}-{self.rng.randrange(max(1, self.runner.args.orders))}'
+
+    def _args(self, action):
+        if action == 'link':
+            return [self._link_code()]
+        if action == 'order':
+            return [self._order_number()]
+        if action == 'search':
+            # Mostly local hits; a miss goes on to the website's search
+            return [self.rng.choice(('pending', 'shipped', 'Booster', self._order_number(),
+                                     'zz' + self._link_code()))]
+        if action == 'login':
+            return [f'user{self.index}@example.com', self.runner.password]
+        return []
+
+    async def run(self, start_at, stop_at):
+        await asyncio.sleep(max(0.0, start_at - time.perf_counter()))
+        plan = ['start', 'link']
+        actions, weights = zip(*self.runner.mix.items())
+        think = self.runner.args.think_ms / 1e3
+        while time.perf_counter() < stop_at:
+            action = plan.pop(0) if plan else self.rng.choices(actions, weights)[0]
+            await self.perform(action)
+            if think:
+                await asyncio.sleep(self.rng.expovariate(1 / think))
+
+    async def perform(self, action):
+        runner = self.runner
+        replied = asyncio.get_running_loop().create_future()
+        if action in BUTTONS:
+            button = self._button(action)
+            if button is None:
+                # Nothing to tap on screen
+                action = 'orders'
+            else:
+                query = FakeCallbackQuery(self, button.callback_data, self.screen[0], replied)
+                update = FakeUpdate(runner.next_update_id(), self, callback_query=query)
+                await runner.dispatch(action, runner.handlers['callback'], update, FakeContext(), replied)
+                return
+        args = self._args(action)
+        text = ' '.join(['/' + action] + args)
+        update = FakeUpdate(runner.next_update_id(), self, message=self._message(text, replied))
+        await runner.dispatch(action, runner.handlers[action], update, FakeContext(args), replied)
+
+
+class Runner:
+    def __init__(self, bot, args, user_base, password):
+        self.bot = bot
+        self.args = args
+        self.user_base = user_base
+        self.password = password
+        self.mix = {a: w for a, w in args.mix.items() if w > 0}
+        self.stats = Stats()
+        self._update_ids = 0
+        timed = bot._timed
+        self.handlers = {
+            'start': timed(bot.start_command),
+            'link': timed(bot.link_command),
+            'orders': timed(bot.orders_command),
+            'stats': timed(bot.stats_command),
+            'search': timed(bot.search_command),
+            'order': timed(bot.order_command),
+            'login': timed(bot.login_command),
+            'callback': timed(bot._dispatch_callback),
+        }
+
+    def next_update_id(self):
+        self._update_ids += 1
+        return self._update_ids
+
+    async def dispatch(self, action, handler, update, context, replied):
+        """Run one update through the bot's processor and record its update-to-reply latency."""
+        timeout = self.args.timeout
+        started = time.perf_counter()
+        task = asyncio.ensure_future(
+            self.bot.application.update_processor.process_update(update, handler(update, context)))
+        await asyncio.wait((replied, task), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not replied.done() and task.done() and not task.cancelled() and task.exception() is None:
+            # The handler returned; its reply may still be waiting on the outbound queue
+            await asyncio.wait((replied,), timeout=max(0.0, started + timeout - time.perf_counter()))
+        if replied.done():
+            text, at = replied.result()
+            self.stats.record(action, at - started, 'error reply' if is_error_reply(text) else None)
+        elif task.done() and not task.cancelled() and task.exception() is not None:
+            self.stats.record(action, time.perf_counter() - started, type(task.exception()).__name__)
+        else:
+            self.stats.record(action, time.perf_counter() - started, 'timeout' if not task.done() else 'no reply')
+        # One update per user at a time: finish this one (link sleeps, then shows the menu)
+        await asyncio.wait((task,), timeout=timeout)
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()
+
+    async def run(self):
+        args = self.args
+        users = [VirtualUser(self, i) for i in range(args.users)]
+        started = time.perf_counter()
+        stop_at = started + args.duration
+        await asyncio.gather(*(
+            user.run(started + args.ramp_up * i / args.users, stop_at) for i, user in enumerate(users)
+        ))
+        elapsed = time.perf_counter() - started
+        await self.bot.outbound.drain(timeout=10)
+        return elapsed
+
+
+def print_report(args, api_url, elapsed, rows, stats, processor, api_stats):
+    print(f"Users: {args.users:,}   duration {elapsed:.1f} s (ramp-up {args.ramp_up:g} s)   "
+          f"think {args.think_ms:g} ms   seed {args.seed}")
+    print(f"API:   {api_url}" + ('' if args.api_url else f" (mock_api.py, {args.orders} orders per user)"))
+    print(f"\n  {'action':8} {'count':>8} {'errors':>7} {'err %':>6} {'per s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for action, row in rows.items():
+        print(f"  {action:8} {row['count']:8,} {row['errors']:7,} {row['error_rate'] * 100:6.2f} "
+              f"{row['per_second']:8.1f} {row['p50_ms']:8.1f} {row['p95_ms']:8.1f} "
+              f"{row['p99_ms']:8.1f} {row['max_ms']:8.1f}")
+    causes = Counter()
+    for counter in stats.errors.values():
+        causes.update(counter)
+    if causes:
+        print("\nErrors: " + ', '.join(f"{cause} {n:,}" for cause, n in causes.most_common()))
+    print(f"Most updates queued behind one user: {processor.max_queue_depth}")
+    if api_stats:
+        print(f"\nWebsite requests: {api_stats['requests']:,} (at most {api_stats['max_in_flight']} at once)"
+              + ''.join(f", {kind} {n:,}" for kind, n in sorted(api_stats['injected'].items())))
+        for route, statuses in api_stats['by_route'].items():
+            print(f"  {route:36} " + '  '.join(f"{status}: {n:,}" for status, n in sorted(statuses.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of load')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='seconds over which users join')
+    parser.add_argument('--think-ms', type=float, default=1000.0, help='mean pause between a user\'s actions')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'action weights (default {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--orders', type=int, default=20, help='orders seeded per user in the mock API')
+    parser.add_argument('--mock-args', default='', help='extra mock_api.py options (latency, faults)')
+    parser.add_argument('--api-url', help='use this website API instead of starting mock_api.py')
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds to wait for a reply')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    mock_api = load_module('mock_api', MOCK_PATH)
+    mock = None
+    api_url = args.api_url
+    if api_url is None:
+        argv = ['--host', '127.0.0.1', '--port', '0', '--users', str(args.users),
+                '--orders-per-user', str(args.orders), '--seed', str(args.seed)] + shlex.split(args.mock_args)
+        mock_api.parse_args(argv)
+        parent, child = multiprocessing.Pipe()
+        mock = multiprocessing.Process(target=serve_mock, args=(child, argv), daemon=True)
+        mock.start()
+        api_url = f'http://127.0.0.1:{parent.recv()}'
+    os.environ['WEBSITE_URL'] = api_url
+
+    tmp = tempfile.mkdtemp(prefix='kycut-load-')
+    os.environ['BOT_LOCAL_DB'] = os.path.join(tmp, 'bot.db')
+    os.chdir(tmp)
+    mod = load_module('kycut_telegram_bot', BOT_PATH)
+    # Handlers log a warning per failed call; the report counts them instead
+    logging.disable(logging.WARNING)
+
+    async def run():
+        bot = mod.KYCutBot()
+        # Import requests up front (see KYCutBot._warm_up)
+        mod.requests.Session
+        runner = Runner(bot, args, mock_api.USER_BASE, mock_api.MOCK_PASSWORD)
+        try:
+            elapsed = await runner.run()
+        finally:
+            bot._http_pool.shutdown(wait=False, cancel_futures=True)
+        return elapsed, runner.stats, bot.application.update_processor, mock_stats(api_url)
+
+    try:
+        elapsed, stats, processor, api_stats = asyncio.run(run())
+    finally:
+        if mock is not None:
+            mock.terminate()
+    rows = stats.summary(elapsed)
+    print_report(args, api_url, elapsed, rows, stats, processor, api_stats)
+    if args.json:
+        config = {k: v for k, v in vars(args).items() if k != 'json'}
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'api_url': api_url, 'elapsed': elapsed, 'actions': rows,
+                       'errors': {a: dict(c) for a, c in stats.errors.items() if c}, 'api': api_stats}, f, indent=2)
+    return 1 if not rows else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Benchmark the caller-side cost of logging in kycut_telegram_bot.py.
+
+Measures how long a logging call holds up the calling (event-loop) thread:
+
+* the old debug event: json.dumps plus a synchronous FileHandler write;
+* EVENTS.log with the default sampling, and with every event written;
+* a console line, written synchronously vs. through setup_logging's queue.
+
+Calls are spaced out (--gap-us) so the listener thread keeps up, as it does
+at the bot's real logging rates. Console output goes to a sink that stalls
+for --stall-ms on every flush, standing in for a slow terminal, pipe or
+disk. Everything else is written to a throwaway directory.
+
+Run: python3 scripts/integration/logging_bench.py --n 5000
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# The bot refuses to import without a token; nothing here talks to Telegram.
+os.environ.setdefault('BOT_TOKEN', '0:bench')
+
+FIELDS = {'endpoint_key': 'orders_user', 'method': 'GET', 'url': 'https://kycut.com/api/orders/user',
+          'attempt': 1, 'user_id': 123456789, 'trace_id': None}
+
+
+def load_bot_module():
+    bot_path = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'TELEGRAM-BOT', 'kycut_telegram_bot.py'))
+    spec = importlib.util.spec_from_file_location('kycut_telegram_bot', bot_path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class StallingStream:
+    """Write-only stream whose flush() blocks, like a console nobody is reading fast enough."""
+
+    def __init__(self, stall):
+        self.stall = stall
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += 1
+
+    def flush(self):
+        if self.stall:
+            time.sleep(self.stall)
+
+
+def call_us(fn, n, gap):
+    """Median and p99 wall time of `fn()` on this thread, in µs."""
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+        if gap:
+            time.sleep(gap)
+    samples.sort()
+    return statistics.median(samples) * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=5000, help='calls per measurement')
+    parser.add_argument('--gap-us', type=float, default=200.0, help='pause between calls')
+    parser.add_argument('--stall-ms', type=float, default=1.0, help='console flush stall')
+    args = parser.parse_args()
+    gap = args.gap_us / 1e6
+
+    mod = load_bot_module()
+    tmp = tempfile.mkdtemp(prefix='kycut-logging-')
+    os.chdir(tmp)
+    stream = StallingStream(args.stall_ms / 1000)
+
+    # Before: handlers attached directly, formatting and writing on the caller's thread
+    sync_debug = logging.getLogger('bench.sync.debug')
+    sync_debug.propagate = False
+    sync_debug.setLevel(logging.DEBUG)
+    file_handler = logging.FileHandler(os.path.join(tmp, 'sync.debug.log'), encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s\t%(levelname)s\t%(message)s'))
+    sync_debug.addHandler(file_handler)
+    sync_info = logging.getLogger('bench.sync.info')
+    sync_info.propagate = False
+    sync_info.setLevel(logging.INFO)
+    console = logging.StreamHandler(stream)
+    console.setFormatter(mod.ColorFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    sync_info.addHandler(console)
+
+    results = {
+        'debug event, json.dumps + FileHandler (before)':
+            call_us(lambda: sync_debug.debug(json.dumps(dict(FIELDS, event='api_request_attempt'))), args.n, gap),
+        'console line, synchronous (before)':
+            call_us(lambda: sync_info.info("Transient API error %s on %s; retrying", 502, 'orders_user'), args.n, gap),
+    }
+
+    # After: setup_logging's queue listener, its console handler writing to the same stalling stream
+    sys.stdout = stream
+    try:
+        mod.setup_logging()
+        events = mod.EVENTS
+        results['EVENTS.log, default sampling'] = call_us(
+            lambda: events.log('api_request_attempt', **FIELDS), args.n, gap)
+        sample, bucket = events.sample, events.bucket
+        events.sample, events.bucket = 1.0, None
+        results['EVENTS.log, every event written'] = call_us(
+            lambda: events.log('api_request_attempt', **FIELDS), args.n, gap)
+        events.sample, events.bucket = sample, bucket
+        results['console line, queued'] = call_us(
+            lambda: mod.logger.info("Transient API error %s on %s; retrying", 502, 'orders_user'), args.n, gap)
+        mod._stop_log_listener()
+    finally:
+        sys.stdout = sys.__stdout__
+
+    print(f"Calls per measurement: {args.n:,}, {args.gap_us:g} µs apart; console flush stall {args.stall_ms:g} ms")
+    print(f"  {'':48} {'median':>9} {'p99':>10}")
+    for name, (median, p99) in results.items():
+        print(f"  {name:48} {median:7.2f} µs {p99:8.2f} µs")
+    print(f"Debug events written: {events.written:,}; kept only in the ring: {events.skipped:,}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Benchmark the cost of recording metrics in kycut_telegram_bot.py.
+
+Times the operations used on hot paths: observing into a resolved histogram
+child, resolving a child by labels and observing (as the HTTP and outbound
+paths do), a counter increment, and the overhead the sqlite_timed decorator
+adds to a trivial function. Also times rendering /metrics once many label
+combinations exist. The budget is under 1µs per observation.
+
+Run: python3 scripts/integration/metrics_bench.py --n 1000000
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+# The bot refuses to import without a token; nothing here talks to Telegram.
+os.environ.setdefault('BOT_TOKEN', '0:bench')
+
+BUDGET_NS = 1000
+
+
+def load_bot_module():
+    bot_path = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'TELEGRAM-BOT', 'kycut_telegram_bot.py'))
+    spec = importlib.util.spec_from_file_location('kycut_telegram_bot', bot_path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def per_call_ns(fn, n):
+    t0 = time.perf_counter()
+    fn(n)
+    return (time.perf_counter() - t0) / n * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=1000000, help='observations per measurement')
+    parser.add_argument('--series', type=int, default=200, help='label combinations for the render timing')
+    args = parser.parse_args()
+
+    mod = load_bot_module()
+    registry = mod.MetricsRegistry()
+    hist = registry.histogram('bench_seconds', 'bench', ('endpoint', 'status'))
+    counter = registry.counter('bench_total', 'bench', ('handler',))
+    child = hist.labels('orders_user', 200)
+    values = [i % 997 / 1000.0 for i in range(1000)]
+
+    def loop_baseline(n):
+        for i in range(n):
+            values[i % 1000]
+
+    def loop_observe(n):
+        observe = child.observe
+        for i in range(n):
+            observe(values[i % 1000])
+
+    def loop_labels_observe(n):
+        labels = hist.labels
+        for i in range(n):
+            labels('orders_user', 200).observe(values[i % 1000])
+
+    def loop_counter(n):
+        inc = counter.labels('orders_command').inc
+        for i in range(n):
+            inc()
+
+    @mod.sqlite_timed('bench_op')
+    def timed_noop():
+        return None
+
+    def plain_noop():
+        return None
+
+    def loop_timed(n):
+        for i in range(n):
+            timed_noop()
+
+    def loop_plain(n):
+        for i in range(n):
+            plain_noop()
+
+    base = per_call_ns(loop_baseline, args.n)
+    results = {
+        'histogram observe (resolved child)': per_call_ns(loop_observe, args.n) - base,
+        'labels() + observe': per_call_ns(loop_labels_observe, args.n) - base,
+        'counter inc': per_call_ns(loop_counter, args.n) - base,
+        'sqlite_timed overhead': per_call_ns(loop_timed, args.n) - per_call_ns(loop_plain, args.n),
+    }
+
+    for i in range(args.series):
+        hist.labels(f'endpoint_{i % 20}', 200 + i // 20).observe(0.01)
+    t0 = time.perf_counter()
+    text = registry.render()
+    render_ms = (time.perf_counter() - t0) * 1e3
+
+    print(f"Observations per measurement: {args.n:,}")
+    for name, ns in results.items():
+        flag = 'ok' if ns < BUDGET_NS else 'OVER BUDGET'
+        print(f"  {name:36} {ns:8.1f} ns  {flag}")
+    print(f"Render {len(hist.children)} histogram series: {render_ms:.2f} ms ({len(text.splitlines()):,} lines)")
+    return 0 if all(ns < BUDGET_NS for ns in results.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,23 +1,63 @@
 #!/usr/bin/env python3
 """Simple mock API for KYCut to run integration tests locally.
 
-Implements minimal endpoints used by KYCut bot:
+Implements the endpoints used by KYCut bot, with the payloads of the Next.js routes:
 - GET /api/bot/ping
+- GET /api/bot/status
+- POST /api/bot/webhook (update_activity, update_username, log_command)
 - GET /api/orders/telegram?telegram_user_id=...
+- GET /api/orders/user (session cookie or bot token)
+- GET /api/orders/stats
+- GET /api/orders/search?q=&status=&telegram_user_id=&date_from=&date_to=&limit=&offset=
 - PATCH /api/orders/{id}/status
 - POST /api/telegram/link
 - POST /api/telegram/ensure-session
+- POST /api/auth/login
+
+Bot tokens and session cookies name the telegram user they belong to. Seeded
+users log in as userN or userN@example.com, the fixed user as tester or
+test@example.com, all with the password MOCK_PASSWORD.
+
+For benchmarks it also serves:
+- GET /__mock/stats   requests received per route and status, injected faults
+- POST /__mock/reset  zero those counters
+
+Requests are handled one thread per connection. With --users the store also
+holds that many seeded users (telegram ids from USER_BASE) with
+--orders-per-user orders each; a user's orders are generated from --seed the
+first time they are asked for, so 100k x 50 costs nothing up front.
+
+Faults are injected on /api/ routes only, in this order: a delay drawn from
+--latency, then --error-rate 500s, --throttle-rate 429s (with Retry-After:
+--retry-after), and with --slow-body-rate the body is trickled out over
+--slow-body-ms. Latency specs: fixed:MS, uniform:LO:HI, normal:MEAN:SD,
+lognormal:MEDIAN:SIGMA or exp:MEAN (milliseconds); prefix a path (or "METHOD path")
+to override it for that route, e.g. --latency /api/orders/telegram=lognormal:80:0.6.
 
 Run: python3 scripts/integration/mock_api.py
+     python3 scripts/integration/mock_api.py --users 100000 --orders-per-user 50 \\
+         --latency lognormal:40:0.5 --throttle-rate 0.02 --error-rate 0.01
 """
+import argparse
 import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from collections import deque
+from http.cookies import SimpleCookie
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs
 import re
 from datetime import datetime, timedelta
 
 PORT = 3000
 WEBHOOK_SECRET = 'kycut_webhook_2024_secure_key_789xyz'
+# Telegram ids of the seeded users start here
+USER_BASE = 1000000
+MOCK_PASSWORD = 'password123'
+# /api/bot/webhook allows this many calls per user and action per minute
+WEBHOOK_RATE_LIMIT = 10
 
 # Simple in-memory orders store
 ORDERS = {
@@ -37,22 +77,421 @@ ORDERS = {
     ]
 }
 
+PRODUCTS = [('Pokémon Booster Box', 144.99), ('Magic Collector Pack', 29.99), ('Yu-Gi-Oh! Tin', 19.99),
+            ('Graded Charizard', 399.0), ('Sleeves (100)', 8.99), ('Deck Box', 14.5), ('Playmat', 24.0)]
+STATUSES = ('pending', 'pending', 'confirmed', 'processing', 'shipped', 'delivered', 'delivered', 'cancelled')
+GENERATED_ID = re.compile(r'^(?:ORD-)?(\d+)-(\d+)$')
+TOKEN_USER = re.compile(r'^mock_(?:bot_token|session)_(\d+)$')
+
+
+def bot_token_for(tg):
+    return f'mock_bot_token_{tg}'
+
+
+def session_for(tg):
+    return f'mock_session_{tg}'
+
+
+def now_iso():
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+def user_order(order):
+    """An order as /api/orders/user returns it."""
+    items = order.get('items') or []
+    return {
+        'id': order['id'],
+        'order_number': order.get('order_number', order['id']),
+        'total_amount': order.get('total_amount', 0),
+        'status': order.get('status'),
+        'customer_name': order.get('customer_name', 'User'),
+        'customer_email': order.get('customer_email', ''),
+        'created_at': order.get('created_at'),
+        'updated_at': order.get('created_at'),
+        'payment_status': {'paid': 'completed', 'failed': 'failed'}.get(order.get('status'), 'pending'),
+        'notes': '',
+        'telegram_deeplink': None,
+        'items': [{
+            'id': f"{order['id']}_{i}",
+            'product_name': item.get('product_name', 'Unknown Product'),
+            'product_id': item.get('product_id', 'unknown'),
+            'quantity': item.get('quantity', 1),
+            'product_price': item.get('product_price', 0),
+            'total_price': round(item.get('quantity', 1) * item.get('product_price', 0), 2),
+        } for i, item in enumerate(items)],
+        'total_items': sum(item.get('quantity', 1) for item in items),
+        'currency_symbol': '$',
+    }
+
+
+def search_order(order):
+    """An order as /api/orders/search returns it."""
+    return {
+        'id': order['id'],
+        'order_number': order.get('order_number', order['id']),
+        'total_amount': order.get('total_amount', 0),
+        'currency': 'USD',
+        'status': order.get('status'),
+        'created_at': order.get('created_at'),
+        'updated_at': order.get('created_at'),
+        'tg_deeplink': None,
+        'items': [{'product_name': item.get('product_name', 'Unknown Product'),
+                   'price': item.get('product_price', 0), 'quantity': item.get('quantity', 1)}
+                  for item in order.get('items') or []],
+    }
+
+
+def order_stats(orders):
+    """The `stats` object of /api/orders/stats."""
+    week_ago = (datetime.utcnow() - timedelta(days=7)).isoformat()
+    return {
+        'total_orders': len(orders),
+        'total_value': round(sum(float(o.get('total_amount') or 0) for o in orders), 2),
+        'pending_orders': sum(1 for o in orders if o.get('status') == 'pending'),
+        'completed_orders': sum(1 for o in orders if o.get('status') == 'delivered'),
+        'recent_orders': sum(1 for o in orders if str(o.get('created_at', '')) >= week_ago),
+    }
+
+
+class Store:
+    """ORDERS plus the seeded users, with an index from order id and number to the order."""
+
+    def __init__(self, users=0, orders_per_user=0, seed=1):
+        self.users = users
+        self.orders_per_user = orders_per_user
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.index = {}
+        for orders in ORDERS.values():
+            self._index(orders)
+        # telegram id -> linked account (telegram username, last seen), from link / ensure-session
+        self.links = {}
+        # (telegram id, action) -> times of recent /api/bot/webhook calls
+        self.webhook_calls = {}
+
+    def _index(self, orders):
+        for o in orders:
+            self.index[str(o.get('id'))] = o
+            self.index[str(o.get('order_number'))] = o
+
+    def _generate(self, uid):
+        rng = random.Random(self.seed * 1000003 + uid)
+        now = datetime.utcnow()
+        orders = []
+        for n in range(self.orders_per_user):
+            items = [{'product_id': f'prod-{k}', 'product_name': PRODUCTS[k][0], 'quantity': rng.randint(1, 3),
+                      'product_price': PRODUCTS[k][1]}
+                     for k in rng.sample(range(len(PRODUCTS)), rng.randint(1, 3))]
+            orders.append({
+                'id': f'{uid}-{n}',
+                'order_number': f'ORD-{uid}-{n}',
+                'total_amount': round(sum(i['quantity'] * i['product_price'] for i in items), 2),
+                'created_at': (now - timedelta(minutes=rng.randrange(525600))).isoformat() + 'Z',
+                'status': rng.choice(STATUSES),
+                'items': items,
+                'customer_name': f'Seeded User {uid - USER_BASE}',
+                'customer_email': f'user{uid - USER_BASE}@example.com',
+            })
+        # Oldest first, as the website returns them (ORDER BY created_at)
+        orders.sort(key=lambda o: o['created_at'])
+        return orders
+
+    def orders_for(self, tg):
+        """Orders of telegram user `tg` (a string), generating a seeded user's on first use."""
+        orders = ORDERS.get(tg)
+        if orders is not None:
+            return orders
+        uid = int(tg) if tg.isdigit() else -1
+        if not USER_BASE <= uid < USER_BASE + self.users:
+            return []
+        with self.lock:
+            if tg not in ORDERS:
+                ORDERS[tg] = self._generate(uid)
+                self._index(ORDERS[tg])
+            return ORDERS[tg]
+
+    def find(self, order_id):
+        order = self.index.get(order_id)
+        if order is None:
+            m = GENERATED_ID.match(order_id)
+            if m:
+                self.orders_for(m.group(1))
+                order = self.index.get(order_id)
+        return order
+
+    def loaded(self):
+        return len(ORDERS)
+
+    def all_orders(self):
+        """Every order loaded so far (seeded users count once they have been asked for)."""
+        return [o for orders in list(ORDERS.values()) for o in orders]
+
+    def user_for_login(self, name):
+        """Telegram id of the account `name` logs in to, if any."""
+        name = name.strip().lower()
+        if name in ('tester', 'test@example.com'):
+            return '99999'
+        m = re.match(r'^user(\d+)(@example\.com)?$', name)
+        if m and int(m.group(1)) < self.users:
+            return str(USER_BASE + int(m.group(1)))
+        return None
+
+    def link(self, tg, username=None):
+        with self.lock:
+            entry = self.links.setdefault(tg, {'telegram_username': None, 'linked_at': time.time()})
+            entry['last_seen'] = time.time()
+            if username:
+                entry['telegram_username'] = username
+
+    def allow_webhook(self, tg, action):
+        """Sliding one-minute window per user and action, like checkRateLimit on the site."""
+        now = time.time()
+        with self.lock:
+            calls = self.webhook_calls.setdefault((tg, action), deque())
+            while calls and calls[0] <= now - 60:
+                calls.popleft()
+            if len(calls) >= WEBHOOK_RATE_LIMIT:
+                return False
+            calls.append(now)
+            return True
+
+
+def parse_latency(spec):
+    """Latency spec -> function returning a delay in seconds, given a random.Random."""
+    kind, _, rest = spec.partition(':')
+    try:
+        p = [float(x) for x in rest.split(':')] if rest else []
+        if kind == 'fixed' and len(p) == 1:
+            return lambda rng: p[0] / 1000
+        if kind == 'uniform' and len(p) == 2:
+            return lambda rng: rng.uniform(p[0], p[1]) / 1000
+        if kind == 'normal' and len(p) == 2:
+            return lambda rng: max(0.0, rng.gauss(p[0], p[1])) / 1000
+        if kind == 'lognormal' and len(p) == 2:
+            return lambda rng: p[0] * rng.lognormvariate(0, p[1]) / 1000
+        if kind == 'exp' and len(p) == 1 and p[0] > 0:
+            return lambda rng: rng.expovariate(1000 / p[0])
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"bad latency spec {spec!r}")
+
+
+class Faults:
+    """Delays and injected failures, drawn from one seeded generator."""
+
+    def __init__(self, latency=(), error_rate=0.0, throttle_rate=0.0, retry_after=1,
+                 slow_body_rate=0.0, slow_body_ms=2000.0, seed=1):
+        self.default_latency = None
+        self.route_latency = {}
+        for spec in latency:
+            route, sep, dist = spec.rpartition('=')
+            if sep:
+                self.route_latency[route] = parse_latency(dist)
+            else:
+                self.default_latency = parse_latency(dist)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.slow_body_rate = slow_body_rate
+        self.slow_body = slow_body_ms / 1000
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self, route):
+        """(delay seconds, 'error' / 'throttle' / None, slow body?) for one request."""
+        latency = self.route_latency.get(route) or self.route_latency.get(route.partition(' ')[2]) \
+            or self.default_latency
+        with self.lock:
+            delay = latency(self.rng) if latency else 0.0
+            roll = self.rng.random()
+            slow = self.slow_body_rate > 0 and self.rng.random() < self.slow_body_rate
+        if roll < self.error_rate:
+            return delay, 'error', False
+        if roll < self.error_rate + self.throttle_rate:
+            return delay, 'throttle', False
+        return delay, None, slow
+
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.by_route = {}
+            self.injected = Counter()
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+    def begin(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self, route, status, injected=None):
+        with self.lock:
+            self.in_flight -= 1
+            self.by_route.setdefault(route, Counter())[str(status)] += 1
+            if injected:
+                self.injected[injected] += 1
+
+    def snapshot(self, store):
+        with self.lock:
+            by_route = {route: dict(statuses) for route, statuses in sorted(self.by_route.items())}
+            return {
+                'since': datetime.utcfromtimestamp(self.started).isoformat() + 'Z',
+                'seconds': round(time.time() - self.started, 3),
+                'requests': sum(sum(s.values()) for s in by_route.values()),
+                'by_route': by_route,
+                'injected': dict(self.injected),
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'users_loaded': store.loaded(),
+            }
+
+
+def route_of(method, path):
+    """Route name used for counters and per-route latency, e.g. 'PATCH /api/orders/{id}/status'."""
+    if re.match(r'^/api/orders/[^/]+/status$', path):
+        path = '/api/orders/{id}/status'
+    return f'{method} {path}'
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for bursts of new connections from many concurrent clients
+    request_queue_size = 1024
+
+    def __init__(self, address, store=None, faults=None, verbose=False):
+        super().__init__(address, Handler)
+        self.store = store or Store()
+        self.faults = faults or Faults()
+        self.counters = Counters()
+        self.verbose = verbose
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up (timeouts) while a delayed response was pending
+        if self.verbose:
+            super().handle_error(request, client_address)
+
+
 class Handler(BaseHTTPRequestHandler):
     protocol_version = 'HTTP/1.1'
 
-    def _send(self, status, data):
+    def log_message(self, format, *args):
+        if getattr(self.server, 'verbose', True):
+            super().log_message(format, *args)
+
+    def _send(self, status, data, headers=None):
         body = json.dumps(data).encode('utf-8')
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(body)
+        if self._slow and len(body) > 1:
+            # Trickle the body out in chunks over the configured time
+            chunks = 10
+            step = -(-len(body) // chunks)
+            for i in range(0, len(body), step):
+                self.wfile.write(body[i:i + step])
+                self.wfile.flush()
+                time.sleep(self.server.faults.slow_body / chunks)
+        else:
+            self.wfile.write(body)
+        self._status = status
 
-    def do_GET(self):
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8') if length else '{}'
+        try:
+            return json.loads(body) if body else {}
+        except Exception:
+            return {}
+
+    def _auth_user(self):
+        """Telegram id behind the session cookie, else the bot token (requireUser, then requireAuth)."""
+        cookie = SimpleCookie()
+        try:
+            cookie.load(self.headers.get('Cookie') or '')
+        except Exception:
+            pass
+        candidates = [cookie['session'].value if 'session' in cookie else '']
+        auth = self.headers.get('Authorization') or ''
+        if auth.startswith('Bearer '):
+            candidates.append(auth[7:].strip())
+        for token in candidates:
+            m = TOKEN_USER.match(token)
+            if m:
+                return m.group(1)
+        return None
+
+    def _scoped_orders(self, qs):
+        """Orders a stats/search call may see, or None after answering 401.
+
+        The site scopes to the signed-in user only when no webhook secret is sent;
+        the bot sends both, and gets its user's orders here.
+        """
+        user = self._auth_user()
+        if user is None and self.headers.get('X-Webhook-Secret') != WEBHOOK_SECRET:
+            self._send(401, {'error': 'Authentication required'})
+            return None
+        tg = qs.get('telegram_user_id', [None])[0]
+        if tg:
+            return self.server.store.orders_for(tg)
+        if user is not None:
+            return self.server.store.orders_for(user)
+        return self.server.store.all_orders()
+
+    def _handle(self, method):
         parsed = urlparse(self.path)
-        path = parsed.path
-        qs = parse_qs(parsed.query)
+        route = route_of(method, parsed.path)
+        if parsed.path.startswith('/__mock/'):
+            return self._control(method, parsed.path)
+        server = self.server
+        server.counters.begin()
+        self._slow = False
+        self._status = None
+        injected = None
+        try:
+            delay, fault, self._slow = server.faults.draw(route)
+            if delay:
+                time.sleep(delay)
+            if fault == 'error':
+                injected = 'error'
+                return self._send(500, {'success': False, 'error': 'Internal server error (injected)'})
+            if fault == 'throttle':
+                injected = 'throttle'
+                return self._send(429, {'success': False, 'error': 'Too many requests (injected)'},
+                                  {'Retry-After': str(server.faults.retry_after)})
+            if self._slow:
+                injected = 'slow_body'
+            return getattr(self, 'route_' + method)(parsed.path, parse_qs(parsed.query))
+        finally:
+            server.counters.end(route, self._status or 'error', injected)
+
+    def _control(self, method, path):
+        self._slow = False
+        if method == 'GET' and path == '/__mock/stats':
+            return self._send(200, self.server.counters.snapshot(self.server.store))
+        if method == 'POST' and path == '/__mock/reset':
+            self.server.counters.reset()
+            return self._send(200, {'success': True})
+        return self._send(404, {'success': False, 'message': 'Not found'})
+
+    def do_GET(self):
+        self._handle('GET')
 
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def route_GET(self, path, qs):
         if path == '/api/bot/ping':
             # optional webhook secret check
             header = self.headers.get('X-Webhook-Secret')
@@ -67,73 +506,204 @@ class Handler(BaseHTTPRequestHandler):
                 'status': 'online'
             })
 
+        if path == '/api/bot/status':
+            header = self.headers.get('X-Webhook-Secret')
+            if header and header != WEBHOOK_SECRET:
+                return self._send(401, {'error': 'Unauthorized'})
+            store = self.server.store
+            day_ago = time.time() - 86400
+            since = (datetime.utcnow() - timedelta(days=1)).isoformat()
+            links = list(store.links.values())
+            return self._send(200, {
+                'success': True,
+                'timestamp': now_iso(),
+                'bot': {'connected': False, 'username': None, 'id': None},
+                'statistics': {
+                    'total_telegram_links': len(links),
+                    'active_telegram_links': len(links),
+                    'recent_activity_24h': sum(1 for link in links if link['last_seen'] >= day_ago),
+                    'recent_orders_24h': sum(1 for o in store.all_orders() if str(o.get('created_at', '')) >= since),
+                },
+                'environment': {
+                    'has_bot_token': False,
+                    'has_webhook_secret': True,
+                    'has_admin_id': False,
+                    'database_connected': True,
+                },
+            })
+
         if path == '/api/orders/telegram':
             tg = qs.get('telegram_user_id', ['99999'])[0]
-            orders = ORDERS.get(tg, [])
+            orders = self.server.store.orders_for(tg)
             return self._send(200, {'success': True, 'orders': orders})
 
+        if path == '/api/orders/user':
+            user = self._auth_user()
+            if user is None:
+                return self._send(401, {'error': 'Authentication required'})
+            orders = [user_order(o) for o in self.server.store.orders_for(user)]
+            breakdown = {}
+            for o in orders:
+                breakdown[o['status']] = breakdown.get(o['status'], 0) + 1
+            return self._send(200, {
+                'success': True,
+                'orders': orders,
+                'metadata': {
+                    'total_orders': len(orders),
+                    'total_value': round(sum(o['total_amount'] for o in orders), 2),
+                    'status_breakdown': breakdown,
+                },
+            })
+
+        if path == '/api/orders/stats':
+            orders = self._scoped_orders(qs)
+            if orders is None:
+                return
+            return self._send(200, {'success': True, 'stats': order_stats(orders), 'currency': 'USD',
+                                    'generated_at': now_iso()})
+
+        if path == '/api/orders/search':
+            orders = self._scoped_orders(qs)
+            if orders is None:
+                return
+            q = qs.get('q', [''])[0]
+            status = qs.get('status', [None])[0]
+            date_from = qs.get('date_from', [None])[0]
+            date_to = qs.get('date_to', [None])[0]
+            try:
+                limit = min(int(qs.get('limit', ['50'])[0]), 100)
+                offset = int(qs.get('offset', ['0'])[0])
+            except ValueError:
+                return self._send(500, {'error': 'Failed to search orders'})
+            # LIKE '%q%' on the order id (which is also its number) and status
+            found = [o for o in orders
+                     if (not q or q in str(o['id']) or q in str(o.get('order_number', '')) or q in str(o.get('status', '')))
+                     and (not status or o.get('status') == status)
+                     and (not date_from or str(o.get('created_at', '')) >= date_from)
+                     and (not date_to or str(o.get('created_at', '')) <= date_to)]
+            found.sort(key=lambda o: str(o.get('created_at', '')))
+            return self._send(200, {
+                'success': True,
+                'orders': [search_order(o) for o in found[offset:offset + limit]],
+                'total': len(found),
+                'limit': limit,
+                'offset': offset,
+                'query': {'q': q, 'status': status, 'telegram_user_id': qs.get('telegram_user_id', [None])[0],
+                          'date_from': date_from, 'date_to': date_to},
+            })
+
         # default 404
         return self._send(404, {'success': False, 'message': 'Not found'})
 
-    def do_POST(self):
-        parsed = urlparse(self.path)
-        path = parsed.path
-        length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(length).decode('utf-8') if length else '{}'
-        try:
-            data = json.loads(body) if body else {}
-        except Exception:
-            data = {}
+    def route_POST(self, path, qs):
+        data = self._body()
 
         if path == '/api/telegram/link':
             code = data.get('code')
             tg = str(data.get('telegramUserId', '99999'))
-            # Return success with a mock bot token
-            token = 'mock_bot_token_123:ABC'
+            # Return success with a mock bot token for this user
+            token = bot_token_for(tg)
             # Persist link mapping (simple)
-            ORDERS.setdefault(tg, ORDERS.get(tg, []))
-            return self._send(200, {'success': True, 'botToken': token, 'expiresAt': (datetime.utcnow() + timedelta(hours=1)).isoformat() + 'Z', 'userId': 'user-123'})
+            ORDERS.setdefault(tg, self.server.store.orders_for(tg))
+            self.server.store.link(tg, data.get('telegramUsername'))
+            return self._send(200, {'success': True, 'botToken': token, 'expiresAt': (datetime.utcnow() + timedelta(hours=1)).isoformat() + 'Z', 'userId': f'user-{tg}'})
 
         if path == '/api/telegram/ensure-session':
             tg = str(data.get('telegramUserId', '99999'))
-            token = 'mock_bot_token_123:ABC'
-            return self._send(200, {'success': True, 'userId': 'user-123', 'botToken': token, 'expiresAt': (datetime.utcnow() + timedelta(hours=1)).isoformat() + 'Z'})
+            token = bot_token_for(tg)
+            self.server.store.link(tg)
+            return self._send(200, {'success': True, 'userId': f'user-{tg}', 'botToken': token, 'expiresAt': (datetime.utcnow() + timedelta(hours=1)).isoformat() + 'Z'})
+
+        if path == '/api/bot/webhook':
+            if self.headers.get('X-Webhook-Secret') != WEBHOOK_SECRET:
+                return self._send(401, {'error': 'Unauthorized'})
+            tg = data.get('telegram_user_id')
+            action = data.get('action')
+            if not tg or not action:
+                return self._send(400, {'error': 'Telegram user ID and action required'})
+            if not self.server.store.allow_webhook(str(tg), action):
+                return self._send(429, {'error': 'Rate limit exceeded'})
+            if action in ('update_activity', 'update_username'):
+                link = self.server.store.links.get(str(tg))
+                if link is not None:
+                    username = (data.get('data') or {}).get('username') if action == 'update_username' else None
+                    self.server.store.link(str(tg), username)
+            elif action != 'log_command':
+                return self._send(400, {'error': 'Invalid action'})
+            return self._send(200, {'success': True, 'message': 'Webhook processed successfully',
+                                    'action': action, 'telegram_user_id': tg, 'timestamp': now_iso()})
+
+        if path == '/api/auth/login':
+            name = data.get('emailOrUsername')
+            password = data.get('password')
+            issues = []
+            if not isinstance(name, str) or not name:
+                issues.append({'path': ['emailOrUsername'], 'message': 'Email or username is required'})
+            if not isinstance(password, str) or len(password) < 8:
+                issues.append({'path': ['password'], 'message': 'Password must be at least 8 characters'})
+            if issues:
+                return self._send(400, {'error': 'Invalid input', 'code': 'VALIDATION_ERROR', 'issues': issues})
+            tg = self.server.store.user_for_login(name)
+            if tg is None or password != MOCK_PASSWORD:
+                return self._send(401, {'error': 'Invalid credentials'})
+            cookie = f'session={session_for(tg)}; Max-Age=604800; Path=/; HttpOnly; SameSite=Lax'
+            return self._send(200, {'success': True}, {'Set-Cookie': cookie})
 
         return self._send(404, {'success': False, 'message': 'Not found'})
 
-    def do_PATCH(self):
-        parsed = urlparse(self.path)
-        path = parsed.path
+    def route_PATCH(self, path, qs):
         m = re.match(r'^/api/orders/([^/]+)/status$', path)
-        length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(length).decode('utf-8') if length else '{}'
-        try:
-            data = json.loads(body) if body else {}
-        except Exception:
-            data = {}
+        data = self._body()
 
         if m:
             order_id = m.group(1)
             # find order and update status
-            found = None
-            for tg, orders in ORDERS.items():
-                for o in orders:
-                    if o.get('id') == order_id or o.get('order_number') == order_id:
-                        o['status'] = data.get('status', o.get('status'))
-                        found = o
-                        break
-                if found:
-                    break
+            found = self.server.store.find(order_id)
             if found:
+                found['status'] = data.get('status', found.get('status'))
                 return self._send(200, {'success': True, 'order': found})
             else:
                 return self._send(404, {'success': False, 'message': 'Order not found'})
 
         return self._send(404, {'success': False, 'message': 'Not found'})
 
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=PORT, help='0 picks a free port')
+    parser.add_argument('--users', type=int, default=0, help=f'seeded users, telegram ids {USER_BASE} and up')
+    parser.add_argument('--orders-per-user', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', action='append', default=[], metavar='[ROUTE=]SPEC',
+                        help='response delay, e.g. lognormal:40:0.5 or /api/orders/telegram=fixed:200')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction answered 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds on 429s')
+    parser.add_argument('--slow-body-rate', type=float, default=0.0, help='fraction with a trickled body')
+    parser.add_argument('--slow-body-ms', type=float, default=2000.0, help='time to send a trickled body')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args(argv)
+    for spec in args.latency:
+        try:
+            parse_latency(spec.rpartition('=')[2])
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+    return args
+
+
+def make_server(args):
+    """MockServer configured from parse_args() options (not yet serving)."""
+    faults = Faults(args.latency, args.error_rate, args.throttle_rate, args.retry_after,
+                    args.slow_body_rate, args.slow_body_ms, args.seed)
+    store = Store(args.users, args.orders_per_user, args.seed)
+    return MockServer((args.host, args.port), store, faults, args.verbose)
+
+
 if __name__ == '__main__':
-    server = HTTPServer(('0.0.0.0', PORT), Handler)
-    print(f"Mock API listening on http://0.0.0.0:{PORT}")
+    args = parse_args()
+    server = make_server(args)
+    print(f"Mock API listening on http://{args.host}:{server.server_address[1]}")
     try:
         server.serve_forever()
     except KeyboardInterrupt:
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Load test for the bot's order-notification fan-out.
+
+Seeds a throwaway SQLite DB with linked users, posts batches of order events
+into NotificationFanout and delivers them through the real OutboundScheduler to
+a fake Bot API (an in-process `send_message` with configurable latency and
+RetryAfter injection). Reports sustained messages per second and queue lag.
+
+With --restart-after N the fan-out is stopped after N deliveries, with its
+in-flight sends cancelled rather than drained, and a new instance is started on
+the same DB, to show that delivery resumes where it left off. Only sends that
+were already on their way to the API when cancelled can be delivered twice.
+Deliveries are counted per event, so a duplicate can't hide a lost message.
+
+Run: python3 scripts/integration/notification_loadtest.py --users 2000 --events 20000 --rate 500
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+
+# The bot refuses to import without a token; the fake Bot API doesn't check it.
+os.environ.setdefault('BOT_TOKEN', '0:loadtest')
+
+
+def load_bot_module():
+    bot_path = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'TELEGRAM-BOT', 'kycut_telegram_bot.py'))
+    spec = importlib.util.spec_from_file_location('kycut_telegram_bot', bot_path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class FakeBotAPI:
+    """Stands in for telegram.Bot.send_message."""
+
+    def __init__(self, latency_ms: float, retry_after_rate: float, retry_after_cls):
+        self.latency = latency_ms / 1000.0
+        self.retry_after_rate = retry_after_rate
+        self.retry_after_cls = retry_after_cls
+        self.delivered = {}
+        self.by_event = {}
+        self.calls = 0
+        self.flood_errors = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        if self.retry_after_rate and random.random() < self.retry_after_rate:
+            self.flood_errors += 1
+            raise self.retry_after_cls(1)
+        self.delivered[chat_id] = self.delivered.get(chat_id, 0) + 1
+        # The order number identifies the event (make_events gives each one its own)
+        event = re.search(r'ORD-\d+', text).group()
+        self.by_event[event] = self.by_event.get(event, 0) + 1
+        return {'ok': True}
+
+
+def seed_users(mod, db_path, users):
+    mod.SessionStore(sqlite_path=db_path, json_path=os.path.join(os.path.dirname(db_path), 'sessions.json'))
+    con = sqlite3.connect(db_path)
+    con.executemany(
+        "INSERT OR REPLACE INTO telegram_users (telegram_user_id, website_user_id, linked) VALUES (?, ?, 1)",
+        [(100000 + i, f'user-{i}') for i in range(users)],
+    )
+    con.commit()
+    con.close()
+
+
+def make_events(users, events, duplicate_rate, unknown_rate, invalid_rate):
+    out = []
+    for n in range(events):
+        if out and random.random() < duplicate_rate:
+            out.append(dict(random.choice(out)))
+            continue
+        uid = 100000 + random.randrange(users)
+        if random.random() < unknown_rate:
+            uid = 900000 + n          # not linked -> skipped
+        elif random.random() < invalid_rate:
+            uid = f'tg-{n}'           # not a Telegram id -> skipped
+        out.append({
+            'telegram_user_id': uid,
+            'order_id': f'ord-{n}',
+            'order_number': f'ORD-{100000 + n}',
+            'event': 'status_changed',
+            'status': random.choice(['confirmed', 'shipped', 'delivered']),
+            'total_amount': round(random.uniform(5, 500), 2),
+        })
+    return out
+
+
+async def run(args):
+    mod = load_bot_module()
+    tmp = tempfile.mkdtemp(prefix='kycut-fanout-')
+    db_path = os.path.join(tmp, 'bot.db')
+    seed_users(mod, db_path, args.users)
+
+    from telegram.error import RetryAfter
+    api = FakeBotAPI(args.latency_ms, args.retry_after_rate, RetryAfter)
+    outbound = mod.OutboundScheduler(global_rate=args.rate, chat_rate=args.chat_rate, chat_burst=args.chat_burst)
+
+    def make_fanout():
+        return mod.NotificationFanout(
+            db_path,
+            lambda chat_id, text, **kw: outbound.submit(
+                chat_id, lambda: api.send_message(chat_id, text, **kw), mod.SEND_PRIORITY_BULK),
+            window=args.window,
+        )
+
+    events = make_events(args.users, args.events, args.duplicate_rate, args.unknown_rate, args.invalid_rate)
+    fanout = make_fanout()
+    t_ingest = time.perf_counter()
+    totals = {'accepted': 0, 'duplicates': 0, 'skipped': 0}
+    for i in range(0, len(events), args.batch):
+        summary = fanout.ingest_batch(events[i:i + args.batch])
+        for k in totals:
+            totals[k] += summary[k]
+    ingest_s = time.perf_counter() - t_ingest
+    print(f"Ingested {len(events)} events in {ingest_s:.2f}s "
+          f"({len(events) / ingest_s:,.0f} events/s): {totals}")
+
+    t0 = time.perf_counter()
+    fanout.start()
+    restarted = False
+    sent_before_restart = 0
+    while True:
+        await asyncio.sleep(1)
+        st = fanout.stats()
+        elapsed = time.perf_counter() - t0
+        print(f"[{elapsed:6.1f}s] sent={sent_before_restart + st['sent']} pending={st['pending']} "
+              f"in_flight={st['in_flight']} rate={st['throughput_per_sec']:.0f}/s "
+              f"oldest_pending={st['oldest_pending_age']:.1f}s")
+        if args.restart_after and not restarted and st['sent'] >= args.restart_after:
+            in_flight = st['in_flight']
+            await fanout.stop(drain=False)
+            sent_before_restart = fanout.sent
+            print(f"-- stopping fan-out after {sent_before_restart} deliveries, cancelling {in_flight} "
+                  f"in flight, and starting a new instance")
+            fanout = make_fanout()
+            fanout.start()
+            restarted = True
+            continue
+        if st['pending'] == 0 and st['in_flight'] == 0:
+            break
+    await fanout.stop()
+    await outbound.close()
+    elapsed = time.perf_counter() - t0
+
+    delivered = sum(api.delivered.values())
+    print()
+    print(f"Delivered:        {delivered} messages to {len(api.delivered)} chats")
+    print(f"Expected:         {totals['accepted']} (accepted after de-duplication)")
+    print(f"Duplicates sent:  {sum(n - 1 for n in api.by_event.values())}")
+    print(f"Never delivered:  {totals['accepted'] - len(api.by_event)}")
+    print(f"Flood errors:     {api.flood_errors} (retried by the scheduler)")
+    print(f"Elapsed:          {elapsed:.2f}s")
+    print(f"Sustained rate:   {delivered / elapsed:,.1f} msg/s (limit {args.rate:g} msg/s)")
+    print(f"Max queue lag:    {fanout.max_lag:.2f}s")
+    print(f"Skipped:          {fanout.skip_reasons}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=1000, help='events per ingest batch')
+    parser.add_argument('--rate', type=float, default=500.0, help='global send limit (msg/s)')
+    parser.add_argument('--chat-rate', type=float, default=1.0)
+    parser.add_argument('--chat-burst', type=float, default=3.0)
+    parser.add_argument('--window', type=int, default=500, help='max deliveries in flight')
+    parser.add_argument('--latency-ms', type=float, default=40.0, help='fake Bot API latency')
+    parser.add_argument('--retry-after-rate', type=float, default=0.0, help='fraction of sends answered with RetryAfter')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05)
+    parser.add_argument('--unknown-rate', type=float, default=0.01, help='fraction of events for unlinked users')
+    parser.add_argument('--invalid-rate', type=float, default=0.0, help='fraction of events with a malformed telegram_user_id')
+    parser.add_argument('--restart-after', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Benchmark the per-user order aggregates and search index behind the orders views.
+
+Builds a synthetic order history (50k orders by default), then compares the old
+per-view full scans with reads from UserOrders, whose counters are computed once
+at ingest and adjusted on each status change. Random confirm/cancel changes are
+applied afterwards and the counters are checked against a full recount. Some
+orders have no status; they must count as neither pending nor completed, as
+in the original views. Finally /search queries are timed against the order
+search index, an exact order id is checked to rank first, and carrying the
+index over to a refetched book (one status changed, one order added) is
+timed against building it again.
+
+Run: python3 scripts/integration/order_aggregates_bench.py --orders 50000
+"""
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+
+# The bot refuses to import without a token; nothing here talks to Telegram.
+os.environ.setdefault('BOT_TOKEN', '0:bench')
+
+STATUSES = ['pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']
+# Share of orders whose status is missing or null
+NO_STATUS_RATE = 0.02
+PRODUCTS = ['Steam Gift Card', 'Netflix Premium', 'Spotify Family', 'Xbox Game Pass', 'PSN Wallet Top-Up']
+QUERIES = ['netflix', 'steam pending', 'ORD-1001', 'xbox game shipped', 'cancelled', 'nothing-matches']
+
+
+def load_bot_module():
+    bot_path = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'TELEGRAM-BOT', 'kycut_telegram_bot.py'))
+    spec = importlib.util.spec_from_file_location('kycut_telegram_bot', bot_path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def make_orders(n):
+    orders = []
+    for i in range(n):
+        order = {
+            'id': f'ord-{i}',
+            'order_number': f'ORD-{100000 + i}',
+            'status': random.choice(STATUSES),
+            'total_amount': round(random.uniform(5, 500), 2),
+            'created_at': '2024-01-01T00:00:00Z',
+            'items': [{'product_name': random.choice(PRODUCTS), 'quantity': 1}],
+        }
+        if random.random() < NO_STATUS_RATE:
+            if random.random() < 0.5:
+                del order['status']
+            else:
+                order['status'] = None
+        orders.append(order)
+    return orders
+
+
+def full_scan(orders):
+    """What the views computed on every render before the aggregates existed."""
+    total_spent = sum(float(o.get('total_amount', 0) or 0) for o in orders)
+    pending = len([o for o in orders if (o.get('status') or '').lower() == 'pending'])
+    completed = len([o for o in orders if (o.get('status') or '').lower() in ['delivered', 'completed']])
+    return len(orders), total_spent, pending, completed
+
+
+def book_read(book):
+    return book.total_orders, book.total_spent, book.pending_count, book.completed_count
+
+
+def timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=50000, help='orders per user')
+    parser.add_argument('--views', type=int, default=200, help='page/stats renders to time')
+    parser.add_argument('--changes', type=int, default=10000, help='status changes to apply')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    mod = load_bot_module()
+    orders = make_orders(args.orders)
+
+    t0 = time.perf_counter()
+    book = mod.UserOrders(orders, b'', 1)
+    ingest_s = time.perf_counter() - t0
+
+    scan_s = timed(lambda: full_scan(orders), args.views)
+    read_s = timed(lambda: book_read(book), args.views * 100)
+    assert full_scan(orders)[0] == book_read(book)[0]
+    no_status = sum(1 for o in orders if not o.get('status'))
+    unknown_ok = (full_scan(orders)[2:] == book_read(book)[2:]
+                  and book.count(mod.UserOrders.UNKNOWN_STATUS) == no_status)
+
+    keys = [o['order_number'] for o in orders]
+    t0 = time.perf_counter()
+    for _ in range(args.changes):
+        book.set_status(random.choice(keys), random.choice(['confirmed', 'cancelled']))
+    change_s = (time.perf_counter() - t0) / args.changes
+
+    scanned, read = full_scan(orders), book_read(book)
+    consistent = scanned[0] == read[0] and scanned[2:] == read[2:] and abs(scanned[1] - read[1]) < 0.01
+
+    print(f"Orders per user:     {args.orders:,}")
+    print(f"Ingest (one-off):    {ingest_s * 1e3:8.2f} ms")
+    print(f"Full scan per view:  {scan_s * 1e3:8.3f} ms")
+    print(f"Aggregate read:      {read_s * 1e6:8.3f} µs  ({scan_s / read_s:,.0f}x faster)")
+    print(f"Status change:       {change_s * 1e6:8.3f} µs")
+    print(f"Orders without status uncounted: {'yes' if unknown_ok else 'NO'} ({no_status:,} orders)")
+    print(f"Counters consistent after {args.changes:,} changes: {'yes' if consistent else 'NO'}")
+
+    t0 = time.perf_counter()
+    index = book.search_index
+    print(f"Search index build:  {(time.perf_counter() - t0) * 1e3:8.2f} ms ({len(index.tokens):,} tokens)")
+    for q in QUERIES:
+        per_query = timed(lambda: index.search(q), args.views)
+        print(f"  search {q!r:22} {per_query * 1e3:8.3f} ms  {index.search(q)[1]:>6,} matches")
+    # 'ord-1001' is an exact id; ord-10010.. and ORD-1001xx only match by prefix
+    exact_first = index.search('ORD-1001', 1)[0] == [book.aliases['ord-1001']]
+    print(f"Exact match ranked first: {'yes' if exact_first else 'NO'}")
+
+    refetched = [dict(o) for o in orders] + make_orders(1)
+    refetched[-1].update(id='ord-new', order_number='ORD-NEW')
+    refetched[0]['status'] = 'cancelled' if refetched[0].get('status') != 'cancelled' else 'confirmed'
+    fresh = mod.UserOrders(refetched, b'', 2)
+    t0 = time.perf_counter()
+    adopted = fresh.adopt_search_index(book)
+    adopt_s = time.perf_counter() - t0
+    adopted = adopted and fresh.search_index.search('ORD-NEW')[1] == 1 and \
+        fresh.search_index.search(f"{refetched[0]['order_number']} {refetched[0]['status']}")[1] == 1
+    print(f"Index carried over:  {adopt_s * 1e3:8.2f} ms on refetch ({'ok' if adopted else 'NOT REUSED'})")
+    return 0 if consistent and unknown_ok and exact_first and adopted else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Startup benchmark for kycut_telegram_bot.py.
+
+Measures, over several fresh processes:
+
+* import time of the bot module (new interpreter, module loaded from its path);
+* time from process spawn until the bot first polls ``getUpdates``;
+* time-to-first-update: spawn until the reply to a queued ``/help`` arrives.
+
+The bot talks to a minimal fake Bot API served from this script (via
+TELEGRAM_API_BASE_URL), uses a throwaway working directory and DB, and points
+WEBSITE_URL at a closed port, so nothing leaves the machine.
+
+Run: python3 scripts/integration/startup_bench.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+DEFAULT_BOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'TELEGRAM-BOT', 'kycut_telegram_bot.py'))
+TOKEN = '123456:startup-bench'
+CHAT_ID = 4242
+
+IMPORT_SNIPPET = """
+import importlib.util, sys, time
+t = time.perf_counter()
+spec = importlib.util.spec_from_file_location('kycut_telegram_bot', sys.argv[1])
+mod = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mod)
+print(time.perf_counter() - t)
+"""
+
+
+class FakeBotAPI(ThreadingHTTPServer):
+    """Just enough of the Bot API for the bot to start, poll once and reply."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.reset()
+
+    def reset(self):
+        self.first_poll = None
+        self.first_reply = None
+        self.delivered = False
+        self.replied = threading.Event()
+
+    def handle_error(self, request, client_address):
+        # Long polls cut short when the bot process is stopped
+        pass
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/bot'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _params(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            return json.loads(body or '{}')
+        return {k: v[0] for k, v in parse_qs(body).items()}
+
+    def _send(self, result):
+        payload = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        api = self.server
+        method = self.path.rsplit('/', 1)[-1]
+        params = self._params()
+        now = int(time.time())
+        if method == 'getMe':
+            self._send({'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'})
+        elif method in ('deleteWebhook', 'answerCallbackQuery', 'setMyCommands'):
+            self._send(True)
+        elif method == 'getUpdates':
+            if api.first_poll is None:
+                api.first_poll = time.perf_counter()
+            if not api.delivered:
+                api.delivered = True
+                self._send([{'update_id': 1, 'message': {
+                    'message_id': 1, 'date': now, 'text': '/help',
+                    'chat': {'id': CHAT_ID, 'type': 'private'},
+                    'from': {'id': CHAT_ID, 'is_bot': False, 'first_name': 'Bench'},
+                    'entities': [{'type': 'bot_command', 'offset': 0, 'length': 5}],
+                }}])
+            else:
+                time.sleep(min(float(params.get('timeout') or 0), 0.5))
+                self._send([])
+        elif method in ('sendMessage', 'editMessageText'):
+            if api.first_reply is None:
+                api.first_reply = time.perf_counter()
+                api.replied.set()
+            self._send({'message_id': 2, 'date': now, 'text': params.get('text', ''),
+                        'chat': {'id': int(params.get('chat_id') or CHAT_ID), 'type': 'private'}})
+        else:
+            self._send(True)
+
+
+def measure_import(bot_path):
+    out = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET, bot_path], capture_output=True, text=True,
+                         env=dict(os.environ, BOT_TOKEN=TOKEN), check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_first_update(bot_path, api, timeout):
+    api.reset()
+    with tempfile.TemporaryDirectory(prefix='kycut-startup-') as tmp:
+        env = dict(os.environ, BOT_TOKEN=TOKEN, TELEGRAM_API_BASE_URL=api.base_url,
+                   BOT_LOCAL_DB=os.path.join(tmp, 'bot.db'), WEBSITE_URL='http://127.0.0.1:9')
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, bot_path], cwd=tmp, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        try:
+            if not api.replied.wait(timeout):
+                proc.kill()
+                err = proc.communicate()[1]
+                raise RuntimeError(f"no reply within {timeout}s; bot stderr:\n{err[-2000:]}")
+        finally:
+            if proc.poll() is None:
+                proc.terminate()
+                try:
+                    proc.wait(10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+    return api.first_poll - t0, api.first_reply - t0
+
+
+def summary(values):
+    values = sorted(values)
+    return f"median {statistics.median(values) * 1e3:7.1f} ms   min {values[0] * 1e3:7.1f} ms   max {values[-1] * 1e3:7.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--bot-path', default=DEFAULT_BOT, help='bot script to measure (e.g. an older revision)')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    args = parser.parse_args()
+
+    api = FakeBotAPI()
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+
+    imports, polls, replies = [], [], []
+    for _ in range(args.runs):
+        imports.append(measure_import(args.bot_path))
+        poll, reply = measure_first_update(args.bot_path, api, args.timeout)
+        polls.append(poll)
+        replies.append(reply)
+
+    print(f"Bot:                  {args.bot_path}")
+    print(f"Runs:                 {args.runs}")
+    print(f"Module import:        {summary(imports)}")
+    print(f"Spawn -> first poll:  {summary(polls)}")
+    print(f"Time to first update: {summary(replies)}")
+    api.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
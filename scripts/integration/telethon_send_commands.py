@@ -184,6 +184,8 @@ async def _run_local_commands(cmds):
     try:
         for m in cmds:
             await dispatch_text(m)
+        # Replies are queued on the outbound scheduler; let them go out before exiting
+        await bot.outbound.drain(timeout=30)
     finally:
         # best-effort cleanup if bot has application
         try:
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Summarise per-update traces written by kycut_telegram_bot.py.
+
+Reads the trace log(s) (logs/telegram_bot.trace.log plus rotated and shard
+worker files by default), groups span lines by trace id and prints the slowest
+traces as span trees, followed by a per-span-name breakdown of where the time
+went across all traces read.
+
+Run: python3 scripts/integration/trace_report.py --top 10
+     python3 scripts/integration/trace_report.py --name handler.orders_command logs/telegram_bot.trace.log
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+from collections import defaultdict
+from datetime import datetime
+
+DEFAULT_GLOB = os.path.join('logs', 'telegram_bot.trace*.log*')
+
+
+def read_spans(paths):
+    """Yield span dicts from tab-separated log lines (asctime, level, JSON)."""
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                payload = line.rstrip('\n').split('\t', 2)[-1]
+                try:
+                    record = json.loads(payload)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and record.get('event') == 'span':
+                    yield record
+
+
+def group_traces(spans):
+    traces = defaultdict(list)
+    for span in spans:
+        traces[span['trace_id']].append(span)
+    return traces
+
+
+def trace_duration(spans):
+    root = next((s for s in spans if s.get('parent_id') is None), None)
+    if root is not None and 'trace_ms' in root:
+        return root['trace_ms']
+    start = min(s['start'] for s in spans)
+    return max(s['start'] + s['duration_ms'] / 1000 for s in spans) * 1000 - start * 1000
+
+
+def format_attrs(attrs):
+    return ' '.join(f'{k}={v}' for k, v in (attrs or {}).items())
+
+
+def print_tree(spans, out):
+    children = defaultdict(list)
+    for span in spans:
+        children[span.get('parent_id')].append(span)
+    t0 = min(s['start'] for s in spans)
+
+    def walk(parent_id, depth):
+        for span in sorted(children.get(parent_id, ()), key=lambda s: s['start']):
+            offset = (span['start'] - t0) * 1000
+            label = '  ' * depth + span['name']
+            out.write(f"    {offset:+9.1f} ms {span['duration_ms']:9.1f} ms  {label:44} {format_attrs(span.get('attrs'))}\n")
+            walk(span['span_id'], depth + 1)
+
+    walk(None, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*', help=f'trace logs (default: {DEFAULT_GLOB})')
+    parser.add_argument('--top', type=int, default=10, help='slowest traces to print')
+    parser.add_argument('--name', help='only traces containing a span with this name')
+    parser.add_argument('--min-ms', type=float, default=0.0, help='ignore traces faster than this')
+    args = parser.parse_args()
+
+    paths = args.files or sorted(glob.glob(DEFAULT_GLOB))
+    if not paths:
+        print(f"No trace logs found ({DEFAULT_GLOB}); set BOT_TRACE_SAMPLE or BOT_TRACE_SLOW_MS on the bot.")
+        return 1
+    traces = group_traces(read_spans(paths))
+    if args.name:
+        traces = {tid: spans for tid, spans in traces.items() if any(s['name'] == args.name for s in spans)}
+    ranked = sorted(((trace_duration(spans), tid) for tid, spans in traces.items()), reverse=True)
+    ranked = [(ms, tid) for ms, tid in ranked if ms >= args.min_ms]
+    if not ranked:
+        print("No matching traces.")
+        return 1
+
+    out = sys.stdout
+    durations = [ms for ms, _ in ranked]
+    out.write(f"Traces: {len(ranked):,} from {len(paths)} file(s)   "
+              f"median {statistics.median(durations):.1f} ms   max {durations[0]:.1f} ms\n\n")
+    for ms, tid in ranked[:args.top]:
+        spans = traces[tid]
+        root = next((s for s in spans if s.get('parent_id') is None), spans[0])
+        when = datetime.fromtimestamp(root['start']).strftime('%Y-%m-%d %H:%M:%S')
+        out.write(f"{tid}  {ms:.1f} ms  {when}  {root['name']} {format_attrs(root.get('attrs'))}\n")
+        print_tree(spans, out)
+        out.write('\n')
+
+    by_name = defaultdict(list)
+    for _, tid in ranked:
+        for span in traces[tid]:
+            if span.get('parent_id') is not None:
+                by_name[span['name']].append(span['duration_ms'])
+    out.write(f"{'span':40} {'count':>7} {'median ms':>10} {'max ms':>10} {'total ms':>11}\n")
+    for name, values in sorted(by_name.items(), key=lambda kv: -sum(kv[1])):
+        out.write(f"{name:40} {len(values):7,} {statistics.median(values):10.1f} {max(values):10.1f} {sum(values):11.1f}\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())